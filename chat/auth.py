@@ -0,0 +1,63 @@
+import logging
+from urllib.parse import parse_qs
+from channels.db import database_sync_to_async
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.tokens import AccessToken
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+
+class JWTAuthMixin:
+    """
+    WebSocket 连接的 JWT 认证
+    token 可以放在 URL 参数 ?token= 中，也可以在连接后通过 authentication 消息发送
+    """
+
+    def get_query_param(self, name):
+        """从 URL 参数中获取一个值"""
+        query_string = self.scope.get('query_string', b'').decode()
+        return parse_qs(query_string).get(name, [None])[0]
+
+    def get_query_token(self):
+        """从 URL 参数中获取 token"""
+        return self.get_query_param('token')
+
+    @database_sync_to_async
+    def authenticate(self, token):
+        try:
+            # 验证token
+            access_token = AccessToken(token)
+            user_id = access_token['user_id']
+            self.user = User.objects.get(id=user_id)
+            self.scope["user"] = self.user
+            return True
+        except Exception as e:
+            logger.error(f"Authentication error: {str(e)}")
+            return False
+
+
+def get_course_membership(user, course_id):
+    """
+    返回 (课程, 身份)，身份为 'teacher'、'student' 或 'admin'
+    课程不存在或用户不是课程的教师、没有选这门课时返回 (课程或None, None)
+    """
+    from course_management.models import Course, StudentCourse
+
+    try:
+        course = Course.objects.filter(course_id=course_id).first()
+    except (TypeError, ValueError):
+        course = None
+    if course is None:
+        return None, None
+    if user.is_superuser:
+        return course, 'admin'
+    if user.role == 'teacher':
+        teacher = getattr(user, 'teacher_profile', None)
+        if teacher is not None and course.teacher_id == teacher.pk:
+            return course, 'teacher'
+    elif user.role == 'student':
+        student = getattr(user, 'student_profile', None)
+        if student is not None and StudentCourse.objects.filter(student=student, course=course).exists():
+            return course, 'student'
+    return course, None
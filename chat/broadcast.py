@@ -0,0 +1,42 @@
+"""
+课程聊天的群组广播
+
+同一课程的所有连接加入同一个 channel layer 群组，消息保存后通过 group_send 推送给群组中的每个连接，
+WebSocket 和 REST 接口发送的消息都会实时送达。单机部署使用内存 channel layer，多节点部署使用 Redis。
+"""
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+logger = logging.getLogger(__name__)
+
+
+def course_group_name(course_id):
+    """课程聊天的群组名"""
+    return f'chat_course_{course_id}'
+
+
+def message_event(chat_message):
+    """
+    群组事件，由 ChatConsumer.chat_message 发送给客户端
+    延迟写入的消息广播时还没有 id，客户端以 uid 作为消息的唯一标识
+    """
+    return {
+        'type': 'chat.message',
+        'id': chat_message.id,
+        'uid': str(chat_message.uid),
+        'message': chat_message.text,
+        'sender': chat_message.sender.username,
+        'timestamp': chat_message.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def broadcast_message(chat_message):
+    """在同步代码（REST 接口）中广播一条已保存的消息，广播失败不影响消息保存"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(course_group_name(chat_message.course_id), message_event(chat_message))
+    except Exception as e:
+        logger.error(f"广播聊天消息失败: {e}")
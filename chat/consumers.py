@@ -1,27 +1,46 @@
 import json
 import logging
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
+from .auth import JWTAuthMixin, get_course_membership
+from .broadcast import course_group_name, message_event
+from .history import recent_history
+from .presence import presence
 from .models import ChatMessage
-from course_management.models import Course
-from rest_framework_simplejwt.tokens import AccessToken
-from django.contrib.auth import get_user_model
-from django.core.exceptions import ObjectDoesNotExist
-from urllib.parse import parse_qs
+from .persistence import WRITE_BEHIND, write_buffer
+from .receipts import count_new_messages
 
 logger = logging.getLogger(__name__)
-User = get_user_model()
 
-class ChatConsumer(AsyncWebsocketConsumer):
+# 连接上缓存的课程成员身份的有效期（秒），过期后在下一条消息前重新校验
+MEMBERSHIP_REVALIDATE_SECONDS = getattr(settings, 'CHAT_MEMBERSHIP_REVALIDATE_SECONDS', 300)
+
+class ChatConsumer(JWTAuthMixin, AsyncWebsocketConsumer):
+    """
+    课程聊天
+    认证成功后校验课程成员身份（课程教师或选课学生），课程和身份缓存在连接上，每条消息只需要一次插入；
+    然后加入课程群组，消息保存后广播给群组中的所有连接（包括发送者自己）；
+    认证成功的消息中带有课程最近的消息（见 history.RecentHistory）和当前在线的用户；
+    在线状态和“正在输入”的变化由 presence.PresenceHub 合并后定期推送给订阅了的连接
+    """
+
     async def connect(self):
         logger.info("WebSocket connect attempt")
         self.course_id = self.scope['url_route']['kwargs']['course_id']
+        self.group_name = course_group_name(self.course_id)
         self.user = None
+        self.course = None
+        self.membership = None
+        self.membership_checked_at = None
+        self.history_attached = False
+        self.presence_joined = False
+        # 客户端通过 ?presence=1 订阅在线状态和“正在输入”的变化
+        self.presence_subscribed = self.get_query_param('presence') in ('1', 'true')
 
         # 从 URL 参数中获取 token
-        query_string = self.scope.get('query_string', b'').decode()
-        query_params = parse_qs(query_string)
-        token = query_params.get('token', [None])[0]
+        token = self.get_query_token()
 
         if token:
             # 尝试认证
@@ -29,21 +48,67 @@ class ChatConsumer(AsyncWebsocketConsumer):
             if authenticated:
                 logger.info("Authentication successful via URL parameter")
                 await self.accept()
-                await self.send(json.dumps({
-                    'type': 'authentication_successful',
-                    'message': '认证成功'
-                }))
+                if not await self.join_course():
+                    return
+                await self.send_authenticated()
                 return
             else:
                 logger.error("Authentication failed via URL parameter")
-                return  # 拒绝连接
+                await self.close()  # 拒绝连接
+                return
         
         # 如果没有 token，接受连接但等待认证消息
         await self.accept()
         logger.info("WebSocket connection accepted, waiting for authentication")
 
+    async def check_membership(self):
+        """查询并缓存课程和成员身份，返回是否是课程成员"""
+        self.course, self.membership = await database_sync_to_async(get_course_membership)(self.user, self.course_id)
+        self.membership_checked_at = time.monotonic()
+        return self.membership is not None
+
+    async def reject(self):
+        """不是课程成员时关闭连接"""
+        logger.warning(f"User {self.user} is not a member of course {self.course_id}")
+        await self.send(json.dumps({
+            'type': 'error',
+            'message': '课程不存在或您不是该课程的成员'
+        }))
+        await self.close(code=4403)
+
+    async def join_course(self):
+        """认证成功后校验成员身份并加入课程群组"""
+        if not await self.check_membership():
+            await self.reject()
+            return False
+        # 先开始缓存广播的消息，再加入群组，加载最近消息期间广播的消息不会遗漏
+        recent_history.attach(self.course_id)
+        self.history_attached = True
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        presence.join(self.course_id, self.user)
+        self.presence_joined = True
+        return True
+
+    async def send_authenticated(self):
+        """认证成功，同时推送课程最近的消息，客户端不必再调用接口拉取"""
+        history = await database_sync_to_async(recent_history.recent)(self.course_id)
+        await self.send(json.dumps({
+            'type': 'authentication_successful',
+            'message': '认证成功',
+            'history': history,
+            'presence': presence.snapshot(self.course_id)
+        }))
+
     async def disconnect(self, close_code):
         logger.info(f"WebSocket disconnected with code: {close_code}")
+        if self.membership:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        if self.history_attached:
+            recent_history.detach(self.course_id)
+            self.history_attached = False
+        if self.presence_joined:
+            presence.leave(self.course_id, self.user)
+            self.presence_joined = False
 
     async def receive(self, text_data):
         try:
@@ -59,10 +124,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     
                     if authenticated:
                         logger.info("Authentication successful")
-                        await self.send(json.dumps({
-                            'type': 'authentication_successful',
-                            'message': '认证成功'
-                        }))
+                        if not await self.join_course():
+                            return
+                        await self.send_authenticated()
                     else:
                         logger.error("Authentication failed")
                         await self.send(json.dumps({
@@ -78,18 +142,34 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     await self.close()
                 return
 
+            # 缓存的成员身份过期后重新校验，退课或换了授课教师时断开连接
+            if time.monotonic() - self.membership_checked_at > MEMBERSHIP_REVALIDATE_SECONDS:
+                if not await self.check_membership():
+                    await self.channel_layer.group_discard(self.group_name, self.channel_name)
+                    await self.reject()
+                    return
+
+            # 正在输入，客户端可以每次按键都发送，由 presence 合并后定期广播
+            if data.get('type') == 'typing':
+                presence.start_typing(self.course_id, self.user)
+                return
+            if data.get('type') == 'stop_typing':
+                presence.stop_typing(self.course_id, self.user)
+                return
+
             # 处理聊天消息
             if 'message' in data:
+                presence.stop_typing(self.course_id, self.user)
                 message = data['message']
-                chat_message = await self.save_message(message)
+                if WRITE_BEHIND:
+                    # uid 和时间已确定，先广播，由后台线程批量写入
+                    chat_message = ChatMessage(sender=self.user, text=message, course=self.course)
+                    write_buffer.add(chat_message)
+                else:
+                    chat_message = await self.save_message(message)
                 
-                # 直接发送消息给当前连接
-                await self.send(text_data=json.dumps({
-                    'type': 'chat_message',
-                    'message': message,
-                    'sender': chat_message.sender.username,
-                    'timestamp': chat_message.timestamp.strftime("%Y-%m-%d %H:%M:%S")
-                }))
+                # 广播给课程群组中的所有连接
+                await self.channel_layer.group_send(self.group_name, message_event(chat_message))
 
         except json.JSONDecodeError:
             await self.send(json.dumps({
@@ -103,25 +183,31 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'message': str(e)
             }))
 
-    @database_sync_to_async
-    def authenticate(self, token):
-        try:
-            # 验证token
-            access_token = AccessToken(token)
-            user_id = access_token['user_id']
-            self.user = User.objects.get(id=user_id)
-            self.scope["user"] = self.user
-            return True
-        except Exception as e:
-            logger.error(f"Authentication error: {str(e)}")
-            return False
+    async def chat_message(self, event):
+        """群组广播的消息"""
+        recent_history.add(self.course_id, event)
+        await self.send(text_data=json.dumps({
+            'type': 'chat_message',
+            'id': event['id'],
+            'uid': event['uid'],
+            'message': event['message'],
+            'sender': event['sender'],
+            'timestamp': event['timestamp']
+        }))
+
+    async def chat_presence(self, event):
+        """合并后的在线状态变化，只发给订阅了的连接"""
+        diff = presence.apply(self.course_id, event)
+        if diff is not None and self.presence_subscribed:
+            await self.send(text_data=json.dumps({'type': 'presence', **diff}))
 
     @database_sync_to_async
     def save_message(self, message):
-        course = Course.objects.get(id=self.course_id)
+        # 课程和发送者都已缓存在连接上，这里只有一次插入
         chat_message = ChatMessage.objects.create(
             sender=self.user,
             text=message,
-            course=course
+            course=self.course
         )
+        count_new_messages([chat_message])
         return chat_message 
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""
+课程聊天最近消息的内存缓存
+
+上课开始时大量客户端同时（重新）连接，每个连接都要先拉取聊天记录。本模块为每门课程保留最近
+CHAT_RECENT_HISTORY_SIZE 条消息，认证成功时随 authentication_successful 一起发给客户端：
+
+- 缓存在本进程内，只在本进程有该课程的连接时保留：这期间课程的所有消息都会通过群组广播送达本进程的连接，
+  由 ChatConsumer.chat_message 加入缓存（按 uid 去重），因此多节点部署时每个节点的缓存也是完整的；
+- 本进程第一个连接加入课程时从数据库加载一次，最后一个连接断开时丢弃缓存；
+- 延迟写入的消息在广播时就进入缓存，不需要等待写入数据库。
+"""
+import threading
+from collections import Counter, OrderedDict
+from django.conf import settings
+
+HISTORY_SIZE = getattr(settings, 'CHAT_RECENT_HISTORY_SIZE', 50)
+
+
+def load_recent(course_id, size):
+    """从数据库加载课程最近的 size 条消息，返回群组事件列表（按时间升序）"""
+    from .broadcast import message_event
+    from .models import ChatMessage
+
+    messages = ChatMessage.objects.filter(course_id=course_id).select_related('sender').order_by('-timestamp', '-id')
+    return [message_event(m) for m in reversed(messages[:size])]
+
+
+class RecentHistory:
+    """按课程保存最近的消息，线程安全；add() 不访问数据库，可以在事件循环中直接调用"""
+
+    def __init__(self, size=HISTORY_SIZE):
+        self.size = size
+        self._courses = {}  # course_id -> OrderedDict(uid -> 消息)
+        self._loaded = set()
+        self._connections = Counter()
+        self._lock = threading.Lock()
+
+    def attach(self, course_id):
+        """本进程有一个新连接加入课程，之后广播的消息开始进入缓存"""
+        course_id = str(course_id)
+        with self._lock:
+            self._connections[course_id] += 1
+            self._courses.setdefault(course_id, OrderedDict())
+
+    def detach(self, course_id):
+        """连接离开课程，最后一个连接离开时丢弃缓存"""
+        course_id = str(course_id)
+        with self._lock:
+            self._connections[course_id] -= 1
+            if self._connections[course_id] <= 0:
+                del self._connections[course_id]
+                self._courses.pop(course_id, None)
+                self._loaded.discard(course_id)
+
+    def add(self, course_id, event):
+        """加入一条广播的消息，同一进程的每个连接都会调用，按 uid 去重"""
+        course_id = str(course_id)
+        with self._lock:
+            messages = self._courses.get(course_id)
+            if messages is None or event['uid'] in messages:
+                return
+            messages[event['uid']] = self._payload(event)
+            while len(messages) > self.size:
+                messages.popitem(last=False)
+
+    def recent(self, course_id):
+        """返回课程最近的消息；缓存还没有加载时查询一次数据库（在同步代码中调用）"""
+        course_id = str(course_id)
+        if self.size <= 0:
+            return []
+        with self._lock:
+            if course_id in self._loaded:
+                return list(self._courses[course_id].values())
+        loaded = load_recent(course_id, self.size)
+        with self._lock:
+            messages = self._courses.get(course_id)
+            if messages is None:
+                # 加载期间连接已经全部断开
+                return [self._payload(event) for event in loaded]
+            if course_id not in self._loaded:
+                # 加载期间广播的消息已经在缓存中，与数据库中的合并后按时间排序
+                merged = OrderedDict((event['uid'], self._payload(event)) for event in loaded)
+                for uid, message in messages.items():
+                    merged.setdefault(uid, message)
+                ordered = sorted(merged.values(), key=lambda m: m['timestamp'])[-self.size:]
+                self._courses[course_id] = OrderedDict((m['uid'], m) for m in ordered)
+                self._loaded.add(course_id)
+            return list(self._courses[course_id].values())
+
+    @staticmethod
+    def _payload(event):
+        """发给客户端的消息字段，与 chat_message 推送的格式相同"""
+        return {key: value for key, value in event.items() if key != 'type'}
+
+
+recent_history = RecentHistory()
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:20
+
+import uuid
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def populate_uid(apps, schema_editor):
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    for message in ChatMessage.objects.filter(uid__isnull=True).only('id'):
+        message.uid = uuid.uuid4()
+        message.save(update_fields=['uid'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_auto_20250704_1245'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='uid',
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.RunPython(populate_uid, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='uid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
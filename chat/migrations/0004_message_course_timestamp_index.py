@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_message_uid'),
+        ('course_management', '0015_coursetime_thumbnails'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['course', 'timestamp', 'id'], name='chat_course_timestamp_idx'),
+        ),
+    ]
@@ -1,5 +1,7 @@
+import uuid
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from course_management.models import Course
 
 class ChatMessage(models.Model):
@@ -14,11 +16,52 @@ class ChatMessage(models.Model):
         related_name='chat_messages'
     )
     text = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
+    # 消息在广播时就确定 uid 和时间，延迟批量写入后客户端看到的标识和顺序保持不变
+    uid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    timestamp = models.DateTimeField(default=timezone.now)
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # 聊天记录的游标分页和 since 轮询
+            models.Index(fields=['course', 'timestamp', 'id'], name='chat_course_timestamp_idx'),
+        ]
 
     def __str__(self):
         return f"{self.sender.username}: {self.text[:50]}"
+
+
+class ChatReadState(models.Model):
+    """
+    用户在一门课程聊天中的已读位置
+    已读游标为最后一条已读消息的 (timestamp, id)，unread_count 是缓存的未读数：
+    新消息写入时加一，标记已读时重新计算，轮询未读数只需要读取这一行
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='chat_read_states'
+    )
+    course = models.ForeignKey(
+        Course,
+        on_delete=models.CASCADE,
+        related_name='chat_read_states'
+    )
+    last_read_at = models.DateTimeField(null=True, blank=True)
+    last_read_id = models.BigIntegerField(default=0)
+    unread_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['user', 'course']
+
+    def __str__(self):
+        return f"{self.user.username} - {self.course.title}: {self.unread_count} 条未读"
+
+    def has_read(self, chat_message):
+        """消息是否在已读游标之内（自己发送的消息总是已读）"""
+        if chat_message.sender_id == self.user_id:
+            return True
+        if self.last_read_at is None:
+            return False
+        return (chat_message.timestamp, chat_message.id or 0) <= (self.last_read_at, self.last_read_id)
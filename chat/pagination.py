@@ -0,0 +1,88 @@
+"""
+聊天记录的游标分页
+
+向前翻页按 (timestamp, id) 做键集分页，配合 (course, timestamp, id) 联合索引，只扫描需要的那几行。
+轮询新消息按 id（写入顺序）判断：延迟批量写入的消息保留广播时的时间戳，可能晚于时间戳更新的消息写入，
+按时间戳轮询会跳过它们。游标是消息的 timestamp 和 id 编码后的字符串，分页信息放在响应头中，
+响应体仍然是按时间升序的消息列表：
+
+- X-Before-Cursor：本页最早一条消息的游标，传给 ?before= 加载更早的消息
+- X-After-Cursor：本页最后写入（id 最大）的消息的游标，传给 ?after= 获取之后写入的新消息
+- X-Has-More：是否还有更早（before/默认）或更新（after/since）的消息
+"""
+import base64
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+PAGE_SIZE = getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 50)
+MAX_PAGE_SIZE = getattr(settings, 'CHAT_HISTORY_MAX_PAGE_SIZE', 200)
+
+
+class InvalidCursor(ValueError):
+    """无法解析的游标"""
+
+
+def encode_cursor(message):
+    raw = f'{message.timestamp.isoformat()}|{message.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """返回 (timestamp, id)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, message_id = raw.rsplit('|', 1)
+        timestamp = parse_datetime(timestamp)
+        if timestamp is None:
+            raise ValueError
+        return timestamp, int(message_id)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+
+
+def page_size(value):
+    try:
+        return max(1, min(int(value), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return PAGE_SIZE
+
+
+def older_than(queryset, cursor):
+    timestamp, message_id = decode_cursor(cursor)
+    return queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+
+
+def newer_than(queryset, cursor):
+    """游标之后写入的消息"""
+    _, message_id = decode_cursor(cursor)
+    return queryset.filter(id__gt=message_id)
+
+
+def latest_page(queryset, size):
+    """最新的 size 条（按时间升序返回），以及是否还有更早的消息"""
+    rows = list(queryset.order_by('-timestamp', '-id')[:size + 1])
+    has_more = len(rows) > size
+    return rows[:size][::-1], has_more
+
+
+def earliest_page(queryset, size):
+    """最早的 size 条，以及是否还有更新的消息"""
+    rows = list(queryset.order_by('timestamp', 'id')[:size + 1])
+    has_more = len(rows) > size
+    return rows[:size], has_more
+
+
+def inserted_page(queryset, size):
+    """最早写入的 size 条（按时间升序返回），以及是否还有之后写入的消息"""
+    rows = list(queryset.order_by('id')[:size + 1])
+    has_more = len(rows) > size
+    return sorted(rows[:size], key=lambda m: (m.timestamp, m.id)), has_more
+
+
+def cursor_headers(messages, has_more):
+    headers = {'X-Has-More': 'true' if has_more else 'false'}
+    if messages:
+        headers['X-Before-Cursor'] = encode_cursor(messages[0])
+        headers['X-After-Cursor'] = encode_cursor(max(messages, key=lambda m: m.id))
+    return headers
@@ -0,0 +1,144 @@
+"""
+聊天消息的延迟批量写入
+
+答疑高峰时每条消息单独 INSERT，SQLite 的写锁会让它们排队。开启 CHAT_WRITE_BEHIND 后，
+ChatConsumer 先广播消息，再把消息交给 ChatWriteBuffer，由后台线程每隔 CHAT_WRITE_BEHIND_INTERVAL_MS
+或攒够 CHAT_WRITE_BEHIND_BATCH_SIZE 条时用 bulk_create 批量写入：
+
+- 消息的 uid 和 timestamp 在广播前就已确定并原样写入，写入后客户端看到的标识和顺序不变；
+  轮询新消息的 after 游标按 id（写入顺序）判断，稍后才写入的消息不会被跳过（见 pagination.newer_than）；
+- 只有一个写入线程，按加入的顺序写入；数据库暂时不可用时，失败的批次在下一次写入时排在最前面重试，
+  违反约束（如课程已删除）的消息逐条写入并丢弃失败的；
+- 写入成功后更新课程中其他用户缓存的未读数（见 receipts.count_new_messages），并发送 signals.messages_created；
+- 进程退出时写入剩余的消息。
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND = getattr(settings, 'CHAT_WRITE_BEHIND', True)
+BATCH_SIZE = getattr(settings, 'CHAT_WRITE_BEHIND_BATCH_SIZE', 100)
+INTERVAL_MS = getattr(settings, 'CHAT_WRITE_BEHIND_INTERVAL_MS', 200)
+
+
+class ChatWriteBuffer:
+    """线程安全的写入缓冲区，add() 不访问数据库，可以在事件循环中直接调用"""
+
+    def __init__(self, batch_size=BATCH_SIZE, interval_ms=INTERVAL_MS):
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self._queue = queue.Queue()
+        self._pending = []  # 写入失败等待重试的消息，保持原有顺序
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def add(self, chat_message):
+        self._ensure_thread()
+        self._queue.put(chat_message)
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='chat-write-behind', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            self._write(batch)
+
+    def _collect(self):
+        """等待第一条消息，然后在写入间隔内最多收集 batch_size 条；收到 None 时退出"""
+        item = self._queue.get()
+        if item is None:
+            self._queue.task_done()
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # 停止前先写入已收集的消息，再把停止信号放回去
+                self._queue.task_done()
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _write(self, batch):
+        from .models import ChatMessage
+        from .receipts import count_new_messages
+        from .signals import messages_created
+
+        messages = self._pending + batch
+        try:
+            written = self._insert(ChatMessage, messages)
+            if written:
+                # 写入成功后更新其他用户的未读数，并通知其他模块（如全文索引）
+                count_new_messages(written)
+                for receiver, response in messages_created.send_robust(sender=ChatMessage, messages=written):
+                    if isinstance(response, Exception):
+                        logger.error(f"处理批量写入的聊天消息失败 ({receiver.__name__}): {response}")
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _insert(self, model, messages):
+        """写入消息，返回写入成功的消息"""
+        try:
+            # 后台线程长期存在，写入前清理失效的数据库连接
+            close_old_connections()
+            model.objects.bulk_create(messages, batch_size=self.batch_size)
+            self._pending = []
+            if any(message.pk is None for message in messages):
+                # MySQL 等数据库的 bulk_create 不回填主键，按 uid 重新读取，接收 messages_created 的模块需要 id
+                return list(model.objects.filter(uid__in=[m.uid for m in messages]).order_by('timestamp', 'id'))
+            return messages
+        except IntegrityError:
+            # 课程或发送者已被删除等无法写入的消息，逐条写入并丢弃失败的，不阻塞后面的消息
+            self._pending = []
+            written = []
+            for message in messages:
+                try:
+                    message.save(force_insert=True)
+                    written.append(message)
+                except IntegrityError as e:
+                    logger.error(f"丢弃无法写入的聊天消息 {message.uid}: {e}")
+            return written
+        except Exception as e:
+            logger.error(f"批量写入 {len(messages)} 条聊天消息失败，稍后重试: {e}")
+            self._pending = messages
+            return []
+
+    def flush(self):
+        """等待已加入的消息全部写入（写入失败的除外）"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+        return not self._pending
+
+    def stop(self):
+        """写入剩余的消息并停止写入线程"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._pending:
+            # 退出前最后再试一次
+            self._write([])
+
+
+write_buffer = ChatWriteBuffer()
+atexit.register(write_buffer.stop)
@@ -0,0 +1,218 @@
+"""
+课程聊天的在线状态和“正在输入”提示
+
+300 人的课程里如果每次上下线、每次按键都广播给所有连接，消息数是 O(n²)。本模块在每个进程中合并这些变化：
+
+- 连接加入/离开、客户端发送的 typing 只修改本进程的状态，不立即广播；
+- 每隔 CHAT_PRESENCE_INTERVAL_MS，每门课程把这段时间内的变化合并成一个 chat.presence 群组事件
+  （joined/left/typing/stopped_typing），通过 channel layer 发给课程群组，每个连接每个周期最多收到一条；
+- 在线和输入状态是带 TTL 的软状态：各进程定期重新广播本进程的在线用户（每 TTL 的一半），
+  收到的状态超过 TTL 没有刷新就视为下线，进程异常退出后不会留下“幽灵”在线用户；
+- 每个进程根据收到的事件维护课程的在线视图，同一事件被本进程的每个连接处理时只计算一次差异。
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+INTERVAL_MS = getattr(settings, 'CHAT_PRESENCE_INTERVAL_MS', 1000)
+PRESENCE_TTL = getattr(settings, 'CHAT_PRESENCE_TTL_SECONDS', 60)
+TYPING_TTL = getattr(settings, 'CHAT_TYPING_TTL_SECONDS', 5)
+# 记住最近处理过的事件的差异，本进程的每个连接收到同一事件时直接复用
+DIFF_CACHE_SIZE = 256
+
+
+class CoursePresence:
+    """一门课程在本进程中的状态"""
+
+    def __init__(self):
+        self.local = {}  # user_id -> [username, 本进程的连接数]
+        self.local_typing = {}  # user_id -> 过期时间
+        self.online = {}  # 合并后的视图：user_id -> (username, 过期时间)
+        self.typing = {}  # 合并后的视图：user_id -> 过期时间
+        self.joined = set()
+        self.left = set()
+        self.started_typing = set()
+        self.stopped_typing = set()
+        self.refreshed_at = None
+
+
+class PresenceHub:
+    """本进程中所有课程的在线状态，方法都在事件循环中调用"""
+
+    def __init__(self, interval_ms=INTERVAL_MS, ttl=PRESENCE_TTL, typing_ttl=TYPING_TTL, clock=time.monotonic):
+        self.interval = interval_ms / 1000
+        self.ttl = ttl
+        self.typing_ttl = typing_ttl
+        self.clock = clock
+        self.origin = uuid.uuid4().hex
+        self.courses = {}
+        self._diffs = OrderedDict()
+        self._task = None
+
+    def join(self, course_id, user):
+        course = self.courses.setdefault(str(course_id), CoursePresence())
+        entry = course.local.setdefault(user.id, [user.username, 0])
+        entry[1] += 1
+        if entry[1] == 1:
+            course.joined.add(user.id)
+            course.left.discard(user.id)
+        self._ensure_running()
+
+    def leave(self, course_id, user):
+        course = self.courses.get(str(course_id))
+        if course is None or user.id not in course.local:
+            return
+        entry = course.local[user.id]
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del course.local[user.id]
+            course.joined.discard(user.id)
+            course.left.add(user.id)
+            self.stop_typing(course_id, user)
+
+    def start_typing(self, course_id, user):
+        """客户端每次按键都可以调用，只有开始输入时才会产生变化"""
+        course = self.courses.get(str(course_id))
+        if course is None or user.id not in course.local:
+            return
+        if user.id not in course.local_typing:
+            course.started_typing.add(user.id)
+            course.stopped_typing.discard(user.id)
+        course.local_typing[user.id] = self.clock() + self.typing_ttl
+
+    def stop_typing(self, course_id, user):
+        course = self.courses.get(str(course_id))
+        if course is not None and course.local_typing.pop(user.id, None) is not None:
+            course.started_typing.discard(user.id)
+            course.stopped_typing.add(user.id)
+
+    def snapshot(self, course_id):
+        """课程当前的在线用户和正在输入的用户，新连接认证成功时发送"""
+        course = self.courses.get(str(course_id))
+        if course is None:
+            return {'online': [], 'typing': []}
+        online = {user_id: username for user_id, (username, _) in course.online.items()}
+        online.update((user_id, entry[0]) for user_id, entry in course.local.items())
+        return {
+            'online': [{'id': user_id, 'username': username} for user_id, username in online.items()],
+            'typing': list(set(course.typing) | set(course.local_typing)),
+        }
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while self.courses:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"广播在线状态失败: {e}")
+
+    async def flush(self):
+        """把各课程在这个周期内的变化合并成一个群组事件发送"""
+        from channels.layers import get_channel_layer
+        from .broadcast import course_group_name
+
+        channel_layer = get_channel_layer()
+        for course_id, course in list(self.courses.items()):
+            event = self._collect(course)
+            if event is not None:
+                await channel_layer.group_send(course_group_name(course_id), event)
+            if not course.local:
+                # 本进程已经没有这门课程的连接
+                del self.courses[course_id]
+
+    def _collect(self, course):
+        now = self.clock()
+        for user_id, expires_at in list(course.local_typing.items()):
+            if expires_at <= now:
+                del course.local_typing[user_id]
+                course.started_typing.discard(user_id)
+                course.stopped_typing.add(user_id)
+
+        refresh = course.refreshed_at is None or now - course.refreshed_at >= self.ttl / 2
+        if refresh:
+            course.refreshed_at = now
+            joined = set(course.local)
+            typing = set(course.local_typing)
+        else:
+            joined = course.joined
+            typing = course.started_typing
+        # 其他进程的用户超过 TTL 没有刷新
+        left = course.left | {
+            user_id for user_id, (_, expires_at) in course.online.items()
+            if expires_at <= now and user_id not in course.local
+        }
+        stopped = course.stopped_typing | {
+            user_id for user_id, expires_at in course.typing.items()
+            if expires_at <= now and user_id not in course.local_typing
+        }
+        course.joined, course.left, course.started_typing, course.stopped_typing = set(), set(), set(), set()
+        if not (joined or left or typing or stopped):
+            return None
+        return {
+            'type': 'chat.presence',
+            'event_id': uuid.uuid4().hex,
+            'origin': self.origin,
+            'ttl': self.ttl,
+            'typing_ttl': self.typing_ttl,
+            'joined': [{'id': user_id, 'username': course.local[user_id][0]} for user_id in joined],
+            'left': list(left),
+            'typing': list(typing),
+            'stopped_typing': list(stopped),
+        }
+
+    def apply(self, course_id, event):
+        """
+        把群组事件合并到本进程的视图，返回发给客户端的差异（没有变化时为 None）
+        本进程的每个连接都会收到同一个事件，差异只计算一次
+        """
+        if event['event_id'] in self._diffs:
+            return self._diffs[event['event_id']]
+        course = self.courses.get(str(course_id))
+        diff = None
+        if course is not None:
+            diff = self._merge(course, event)
+        self._diffs[event['event_id']] = diff
+        while len(self._diffs) > DIFF_CACHE_SIZE:
+            self._diffs.popitem(last=False)
+        return diff
+
+    def _merge(self, course, event):
+        now = self.clock()
+        joined, left, typing, stopped = [], [], [], []
+        for user in event['joined']:
+            if user['id'] not in course.online:
+                joined.append(user)
+            course.online[user['id']] = (user['username'], now + event['ttl'])
+        for user_id in event['left']:
+            # 用户在本进程还有连接时以本进程为准
+            if user_id in course.local and event['origin'] != self.origin:
+                continue
+            if course.online.pop(user_id, None) is not None:
+                left.append(user_id)
+            if course.typing.pop(user_id, None) is not None:
+                stopped.append(user_id)
+        for user_id in event['typing']:
+            if user_id not in course.typing:
+                typing.append(user_id)
+            course.typing[user_id] = now + event['typing_ttl']
+        for user_id in event['stopped_typing']:
+            if user_id in course.local_typing and event['origin'] != self.origin:
+                continue
+            if course.typing.pop(user_id, None) is not None and user_id not in stopped:
+                stopped.append(user_id)
+        if not (joined or left or typing or stopped):
+            return None
+        return {'joined': joined, 'left': left, 'typing': typing, 'stopped_typing': stopped}
+
+
+presence = PresenceHub()
@@ -0,0 +1,106 @@
+"""
+聊天的个人已读回执
+
+每个用户在每门课程中有一条 ChatReadState，记录已读游标和缓存的未读数：
+
+- 新消息写入后调用 count_new_messages，课程中除发送者以外已有已读记录的用户未读数加一，
+  一批消息按 (课程, 发送者) 分组，每组一条 UPDATE；延迟写入的消息保留广播时的时间戳，
+  已读游标已经越过其中部分消息的用户（很少见）按游标重新计算，与 has_read() 保持一致；
+- 标记已读时已读游标只前进不后退，未读数按游标之后的消息重新计算（使用 (course, timestamp, id) 索引）；
+- 用户第一次查询未读数时才创建已读记录，此时计算一次未读数；
+- 延迟写入的消息广播时还没有 id，已读回执可以用 uid 引用消息（见 messages_for_receipt）。
+"""
+import logging
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import F, Q
+from .models import ChatMessage, ChatReadState
+
+logger = logging.getLogger(__name__)
+
+
+def _read_before(message):
+    """已读游标在该消息之前的已读记录"""
+    return (Q(last_read_at__isnull=True) | Q(last_read_at__lt=message.timestamp)
+            | Q(last_read_at=message.timestamp, last_read_id__lt=message.id or 0))
+
+
+def _unread_after(user, course_id, last_read_at, last_read_id):
+    messages = ChatMessage.objects.filter(course_id=course_id).exclude(sender=user)
+    if last_read_at is not None:
+        messages = messages.filter(
+            Q(timestamp__gt=last_read_at) | Q(timestamp=last_read_at, id__gt=last_read_id)
+        )
+    return messages.count()
+
+
+def get_read_state(user, course_id):
+    """返回用户在课程中的已读记录，不存在时创建并计算一次未读数"""
+    state = ChatReadState.objects.filter(user=user, course_id=course_id).first()
+    if state is not None:
+        return state
+    with transaction.atomic():
+        state, created = ChatReadState.objects.select_for_update().get_or_create(user=user, course_id=course_id)
+        if created:
+            state.unread_count = _unread_after(user, course_id, None, 0)
+            state.save(update_fields=['unread_count'])
+    return state
+
+
+def count_new_messages(messages):
+    """新消息写入后更新课程中其他用户的未读数，写入失败时只记录日志"""
+    groups = defaultdict(list)
+    for message in messages:
+        groups[(message.course_id, message.sender_id)].append(message)
+    try:
+        for (course_id, sender_id), group in groups.items():
+            states = ChatReadState.objects.filter(course_id=course_id).exclude(user_id=sender_id)
+            earliest = _read_before(min(group, key=lambda m: (m.timestamp, m.id or 0)))
+            states.filter(earliest).update(unread_count=F('unread_count') + len(group))
+            with transaction.atomic():
+                for state in states.exclude(earliest).select_for_update():
+                    state.unread_count = _unread_after(
+                        state.user_id, course_id, state.last_read_at, state.last_read_id
+                    )
+                    state.save(update_fields=['unread_count'])
+    except Exception as e:
+        logger.error(f"更新聊天未读数失败: {e}")
+
+
+def messages_for_receipt(user, message_ids=(), message_uids=()):
+    """
+    已读回执按 id 或 uid 引用的消息，不包括用户自己发送的
+    uid 对应的消息还在本进程的写入缓冲区中时先等待写入；仍未写入的消息不推进已读游标，
+    写入后由 count_new_messages 按已读游标计入未读数，已读游标和未读数保持一致
+    """
+    from .persistence import WRITE_BEHIND, write_buffer
+
+    def lookup():
+        messages = ChatMessage.objects.filter(Q(id__in=message_ids) | Q(uid__in=message_uids))
+        return list(messages.exclude(sender=user))
+
+    messages = lookup()
+    if WRITE_BEHIND and message_uids:
+        found = {str(m.uid) for m in messages}
+        if any(str(uid) not in found for uid in message_uids):
+            write_buffer.flush()
+            messages = lookup()
+    return messages
+
+
+def mark_read(user, course_id, up_to=None):
+    """
+    把已读游标前进到 up_to 消息（默认课程中的最新消息），返回更新后的已读记录
+    已读游标不会后退，未读数按新的游标重新计算
+    """
+    if up_to is None:
+        up_to = ChatMessage.objects.filter(course_id=course_id).order_by('-timestamp', '-id').first()
+    with transaction.atomic():
+        state, _ = ChatReadState.objects.select_for_update().get_or_create(user=user, course_id=course_id)
+        if up_to is not None and (state.last_read_at is None
+                                  or (up_to.timestamp, up_to.id) > (state.last_read_at, state.last_read_id)):
+            state.last_read_at = up_to.timestamp
+            state.last_read_id = up_to.id
+        state.unread_count = _unread_after(user, course_id, state.last_read_at, state.last_read_id)
+        state.save()
+    return state
@@ -5,11 +5,20 @@ from course_management.models import StudentCourse
 class ChatMessageSerializer(serializers.ModelSerializer):
     sender_name = serializers.CharField(source='sender.username', read_only=True)
     timestamp = serializers.DateTimeField(format="%Y-%m-%d %H:%M:%S", read_only=True)
+    is_read = serializers.SerializerMethodField()
 
     class Meta:
         model = ChatMessage
-        fields = ['id', 'sender', 'sender_name', 'course', 'text', 'timestamp', 'is_read']
-        read_only_fields = ['sender', 'sender_name', 'timestamp', 'is_read']
+        fields = ['id', 'uid', 'sender', 'sender_name', 'course', 'text', 'timestamp', 'is_read']
+        read_only_fields = ['uid', 'sender', 'sender_name', 'timestamp', 'is_read']
+
+    def get_is_read(self, obj):
+        """按当前用户的已读位置判断，自己发送的消息总是已读"""
+        read_state = self.context.get('read_state')
+        if read_state is not None:
+            return read_state.has_read(obj)
+        request = self.context.get('request')
+        return bool(request and obj.sender_id == request.user.id)
 
     def validate_course(self, value):
         request = self.context.get('request')
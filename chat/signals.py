@@ -0,0 +1,4 @@
+from django.dispatch import Signal
+
+# 聊天消息批量写入数据库后发送（bulk_create 不会发送 post_save），参数 messages 为写入成功的消息
+messages_created = Signal()
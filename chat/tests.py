@@ -1,10 +1,23 @@
-from django.test import TestCase
+import asyncio
+import time
+from unittest import mock
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import TestCase, TransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
 from django.contrib.auth import get_user_model
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase
 from rest_framework import status
-from course_management.models import Course
-from .models import ChatMessage
-from datetime import datetime
+from course_management.models import Course, StudentCourse
+from .models import ChatMessage, ChatReadState
+from .pagination import cursor_headers, encode_cursor, inserted_page, newer_than
+from .persistence import ChatWriteBuffer, write_buffer
+from .receipts import get_read_state, mark_read
+from .presence import presence
+from .routing import websocket_urlpatterns
+from datetime import datetime, timedelta
 
 User = get_user_model()
 
@@ -146,3 +159,316 @@ class ChatMessageAPITests(APITestCase):
         except ValueError:
             is_valid_format = False
         self.assertTrue(is_valid_format)
+
+    def test_cursor_pagination(self):
+        """测试按游标翻页：默认最新一页，before 加载更早的消息，after 获取新消息"""
+        # 前三条消息的时间戳相同，按 id 区分先后
+        for i in range(2, 8):
+            offset = timedelta(seconds=i) if i >= 4 else timedelta()
+            ChatMessage.objects.create(sender=self.user, text=f'Test message {i}', course=self.course,
+                                       timestamp=self.message.timestamp + offset)
+        self.client.force_authenticate(user=self.user)
+        url = f'/api/chat/messages/?course_id={self.course.course_id}&limit=3'
+
+        response = self.client.get(url)
+        self.assertEqual([m['text'] for m in response.data], ['Test message 5', 'Test message 6', 'Test message 7'])
+        self.assertEqual(response['X-Has-More'], 'true')
+
+        seen = [m['text'] for m in response.data]
+        while response['X-Has-More'] == 'true':
+            response = self.client.get(f"{url}&before={response['X-Before-Cursor']}")
+            seen = [m['text'] for m in response.data] + seen
+        self.assertEqual(seen, [f'Test message {i}' for i in range(1, 8)])
+
+        # 从最早一页向后翻，与向前翻的结果一致
+        response = self.client.get(f"{url}&after={response['X-Before-Cursor']}")
+        self.assertEqual([m['text'] for m in response.data], ['Test message 2', 'Test message 3', 'Test message 4'])
+
+        response = self.client.get(f'{url}&before=invalid')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cursor_headers_are_exposed_to_cross_origin_clients(self):
+        """跨域的前端可以读取分页游标响应头"""
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(
+            f'/api/chat/messages/?course_id={self.course.course_id}', HTTP_ORIGIN='http://localhost:8080'
+        )
+        exposed = {h.strip() for h in response['Access-Control-Expose-Headers'].split(',')}
+        self.assertTrue({'X-Before-Cursor', 'X-After-Cursor', 'X-Has-More'} <= exposed)
+
+    def test_read_receipts_are_per_user(self):
+        """测试已读状态按用户记录，未读数随新消息增加、标记已读后重新计算"""
+        third_user = User.objects.create_user(username='thirduser', password='testpass123')
+        for user in (self.user, self.other_user, third_user):
+            StudentCourse.objects.create(student=user.student_profile, course=self.course)
+        url = f'/api/chat/messages/unread/?course_id={self.course.course_id}'
+
+        self.client.force_authenticate(user=self.other_user)
+        self.assertEqual(self.client.get(url).data['unread_count'], 1)
+        self.client.force_authenticate(user=third_user)
+        self.assertEqual(self.client.get(url).data['unread_count'], 1)
+
+        # 新消息增加其他用户的未读数，发送者自己的不变
+        self.client.force_authenticate(user=self.user)
+        second = self.client.post('/api/chat/messages/', {'text': 'Test message 2', 'course': self.course.course_id})
+        self.assertEqual(self.client.get(url).data['unread_count'], 0)
+
+        # 一个用户标记已读不影响其他用户
+        self.client.force_authenticate(user=self.other_user)
+        response = self.client.post('/api/chat/messages/mark_as_read/', {'message_ids': [self.message.id]}, format='json')
+        self.assertEqual(response.data['unread_count'], 1)
+        messages = self.client.get(f'/api/chat/messages/?course_id={self.course.course_id}').data
+        self.assertEqual([m['is_read'] for m in messages], [True, False])
+        self.client.force_authenticate(user=third_user)
+        self.assertEqual(self.client.get(url).data['unread_count'], 2)
+
+        # 已读位置不会后退
+        self.client.force_authenticate(user=self.other_user)
+        self.client.post('/api/chat/messages/mark_as_read/', {'message_ids': [second.data['id']]}, format='json')
+        response = self.client.post('/api/chat/messages/mark_as_read/', {'message_ids': [self.message.id]}, format='json')
+        self.assertEqual(response.data['unread_count'], 0)
+        self.assertEqual(self.client.get(url).data['unread_count'], 0)
+
+    def test_read_state_requires_course_membership(self):
+        """课程不存在或 ID 无效时返回 404，不是课程成员时返回 403，且不创建已读记录"""
+        self.client.force_authenticate(user=self.other_user)
+        for course_id in (self.course.course_id + 100, 'abc'):
+            response = self.client.get(f'/api/chat/messages/unread/?course_id={course_id}')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(f'/api/chat/messages/unread/?course_id={self.course.course_id}')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post('/api/chat/messages/mark_as_read/', {'message_ids': [self.message.id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(ChatReadState.objects.exists())
+
+
+class ChatBroadcastTests(TransactionTestCase):
+    # 模拟的客户端数量和发送的消息数
+    CLIENTS = 50
+    MESSAGES = 20
+
+    def setUp(self):
+        """测试数据初始化"""
+        self.course = Course.objects.create(title='Test Course', description='Test Course Description')
+        self.users = [
+            User.objects.create_user(username=f'student{i}')
+            for i in range(self.CLIENTS)
+        ]
+        for user in self.users:
+            StudentCourse.objects.create(student=user.student_profile, course=self.course)
+        # 延迟写入的消息在清空数据库之前写完
+        self.addCleanup(write_buffer.flush)
+
+    async def _connect(self, user):
+        path = f'/ws/chat/{self.course.course_id}/?token={AccessToken.for_user(user)}'
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'authentication_successful')
+        return communicator
+
+    def test_message_fans_out_to_course_group(self):
+        """一个客户端发送的消息按顺序送达课程中的所有客户端，并在限定时间内完成"""
+        async def run():
+            communicators = await asyncio.gather(*(self._connect(user) for user in self.users))
+            sender = communicators[0]
+
+            started = time.monotonic()
+            for i in range(self.MESSAGES):
+                await sender.send_json_to({'message': f'问题 {i}'})
+
+            async def receive_all(communicator):
+                return [await communicator.receive_json_from(timeout=5) for _ in range(self.MESSAGES)]
+
+            received = await asyncio.gather(*(receive_all(c) for c in communicators))
+            elapsed = time.monotonic() - started
+
+            for messages in received:
+                self.assertEqual([m['message'] for m in messages], [f'问题 {i}' for i in range(self.MESSAGES)])
+                self.assertEqual(messages[0]['sender'], 'student0')
+                self.assertEqual(len({m['uid'] for m in messages}), self.MESSAGES)
+            self.broadcast_uids = {m['uid'] for m in received[0]}
+            # 宽松的上限，只用于发现广播退化为逐条写库等数量级的变慢
+            self.assertLess(elapsed, 10)
+
+            for communicator in communicators:
+                await communicator.disconnect()
+        async_to_sync(run)()
+        # 批量写入后的 uid 与广播时一致，顺序不变
+        self.assertTrue(write_buffer.flush())
+        saved = ChatMessage.objects.filter(course=self.course).order_by('timestamp', 'id')
+        self.assertEqual([m.text for m in saved], [f'问题 {i}' for i in range(self.MESSAGES)])
+        self.assertEqual({str(m.uid) for m in saved}, self.broadcast_uids)
+
+    def test_recent_history_is_pushed_on_connect(self):
+        """认证成功时推送最近的消息，已有连接时从内存缓存读取，不再查询数据库"""
+        ChatMessage.objects.create(sender=self.users[1], text='之前的消息', course=self.course)
+        async def run():
+            path = f'/ws/chat/{self.course.course_id}/?token={AccessToken.for_user(self.users[0])}'
+            first = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+            await first.connect()
+            hello = await first.receive_json_from()
+            self.assertEqual([m['message'] for m in hello['history']], ['之前的消息'])
+
+            await first.send_json_to({'message': '新消息'})
+            await first.receive_json_from()
+
+            with mock.patch('chat.history.load_recent', side_effect=AssertionError('不应查询数据库')):
+                path = f'/ws/chat/{self.course.course_id}/?token={AccessToken.for_user(self.users[1])}'
+                second = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+                await second.connect()
+                hello = await second.receive_json_from()
+            self.assertEqual([m['message'] for m in hello['history']], ['之前的消息', '新消息'])
+            self.assertEqual(hello['history'][-1]['sender'], 'student0')
+
+            await first.disconnect()
+            await second.disconnect()
+        async_to_sync(run)()
+
+    def test_presence_updates_are_coalesced(self):
+        """上下线和每次按键的输入提示合并成周期性的差异，每个周期最多一条"""
+        first_user, second_user = self.users[:2]
+
+        async def connect(user):
+            path = f'/ws/chat/{self.course.course_id}/?presence=1&token={AccessToken.for_user(user)}'
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+            await communicator.connect()
+            return communicator, await communicator.receive_json_from()
+
+        async def next_presence(communicator):
+            while True:
+                message = await communicator.receive_json_from(timeout=2)
+                if message['type'] == 'presence':
+                    return message
+
+        async def run():
+            first, _ = await connect(first_user)
+            second, hello = await connect(second_user)
+            self.assertEqual({u['username'] for u in hello['presence']['online']}, {'student0', 'student1'})
+
+            joined = set()
+            while joined != {first_user.id, second_user.id}:
+                joined |= {u['id'] for u in (await next_presence(first))['joined']}
+
+            for _ in range(20):
+                await first.send_json_to({'type': 'typing'})
+            diff = await next_presence(second)
+            while not diff['typing']:
+                diff = await next_presence(second)
+            self.assertEqual(diff['typing'], [first_user.id])
+            # 合并后的一个周期内不会再收到重复的输入提示
+            self.assertTrue(await second.receive_nothing(timeout=0.2))
+
+            await first.send_json_to({'message': '老师好'})
+            self.assertEqual((await second.receive_json_from())['message'], '老师好')
+            self.assertEqual((await next_presence(second))['stopped_typing'], [first_user.id])
+
+            await second.disconnect()
+            diff = await next_presence(first)
+            while not diff['left']:
+                diff = await next_presence(first)
+            self.assertEqual(diff['left'], [second_user.id])
+            await first.disconnect()
+
+        with mock.patch.object(presence, 'interval', 0.05):
+            async_to_sync(run)()
+
+    def test_non_member_is_rejected(self):
+        """没有选这门课的学生不能加入课程聊天"""
+        outsider = User.objects.create_user(username='outsider')
+        async def run():
+            path = f'/ws/chat/{self.course.course_id}/?token={AccessToken.for_user(outsider)}'
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            self.assertEqual((await communicator.receive_json_from())['type'], 'error')
+            self.assertEqual((await communicator.receive_output())['type'], 'websocket.close')
+        async_to_sync(run)()
+
+    def test_membership_is_revalidated(self):
+        """缓存的成员身份过期后重新校验，退课后断开连接"""
+        async def run():
+            communicator = await self._connect(self.users[0])
+            await communicator.send_json_to({'message': '你好'})
+            self.assertEqual((await communicator.receive_json_from())['message'], '你好')
+
+            await database_sync_to_async(StudentCourse.objects.filter(student__user=self.users[0]).delete)()
+            # 缓存有效期内不再查询成员身份
+            await communicator.send_json_to({'message': '还在吗'})
+            self.assertEqual((await communicator.receive_json_from())['message'], '还在吗')
+
+            with mock.patch('chat.consumers.MEMBERSHIP_REVALIDATE_SECONDS', -1):
+                await communicator.send_json_to({'message': '再见'})
+                self.assertEqual((await communicator.receive_json_from())['type'], 'error')
+        async_to_sync(run)()
+
+
+class ChatWriteBufferTests(TransactionTestCase):
+    def setUp(self):
+        """测试数据初始化"""
+        self.user = User.objects.create_user(username='testuser')
+        self.course = Course.objects.create(title='Test Course', description='Test Course Description')
+
+    def test_batches_keep_order_and_flush_on_stop(self):
+        """按加入顺序分批写入，停止时写入剩余的消息"""
+        buffer = ChatWriteBuffer(batch_size=3, interval_ms=50)
+        messages = [ChatMessage(sender=self.user, course=self.course, text=f'消息 {i}') for i in range(7)]
+        for message in messages:
+            buffer.add(message)
+        buffer.stop()
+        
+        saved = list(ChatMessage.objects.order_by('id'))
+        self.assertEqual([m.text for m in saved], [m.text for m in messages])
+        self.assertEqual([m.uid for m in saved], [m.uid for m in messages])
+
+    def test_late_insert_is_after_polling_cursor(self):
+        """延迟写入的消息保留广播时的时间戳，轮询游标之后仍然能取到"""
+        buffer = ChatWriteBuffer(batch_size=10, interval_ms=20)
+        buffered = ChatMessage(sender=self.user, course=self.course, text='先广播后写入')
+        broadcast_at = buffered.timestamp
+        direct = ChatMessage.objects.create(sender=self.user, course=self.course, text='直接写入')
+        self.assertLess(broadcast_at, direct.timestamp)
+
+        buffer.add(buffered)
+        buffer.stop()
+        self.assertEqual(ChatMessage.objects.get(uid=buffered.uid).timestamp, broadcast_at)
+        queryset = ChatMessage.objects.filter(course=self.course)
+        newer, has_more = inserted_page(newer_than(queryset, encode_cursor(direct)), 10)
+        self.assertEqual(([m.text for m in newer], has_more), (['先广播后写入'], False))
+        # 按时间排序的历史中消息的位置与广播时一致
+        self.assertEqual([m.text for m in queryset.order_by('timestamp', 'id')], ['先广播后写入', '直接写入'])
+        # 再次轮询不会重复返回
+        self.assertFalse(newer_than(queryset, cursor_headers(newer, has_more)['X-After-Cursor']).exists())
+
+    def test_late_insert_before_read_cursor_is_not_unread(self):
+        """延迟写入的消息时间戳早于已读游标时不计入未读数，与 has_read() 一致"""
+        reader = User.objects.create_user(username='reader')
+        buffer = ChatWriteBuffer(batch_size=10, interval_ms=20)
+        buffered = ChatMessage(sender=self.user, course=self.course, text='先广播后写入')
+        direct = ChatMessage.objects.create(sender=self.user, course=self.course, text='直接写入')
+        mark_read(reader, self.course.course_id, direct)
+
+        buffer.add(buffered)
+        buffer.add(ChatMessage(sender=self.user, course=self.course, text='之后的消息'))
+        buffer.stop()
+        state = get_read_state(reader, self.course.course_id)
+        self.assertEqual(state.unread_count, 1)
+        self.assertTrue(state.has_read(ChatMessage.objects.get(uid=buffered.uid)))
+
+    def test_receipt_by_uid_waits_for_buffered_message(self):
+        """尚未写入的消息可以用 uid 标记已读，写入后不会再计入未读数"""
+        reader = User.objects.create_user(username='reader')
+        StudentCourse.objects.create(student=reader.student_profile, course=self.course)
+        get_read_state(reader, self.course.course_id)
+        buffered = ChatMessage(sender=self.user, course=self.course, text='还在缓冲区中')
+        write_buffer.add(buffered)
+
+        client = APIClient()
+        client.force_authenticate(user=reader)
+        response = client.post('/api/chat/messages/mark_as_read/', {'message_uids': [str(buffered.uid)]}, format='json')
+        self.assertEqual(response.data, {'marked_as_read': 1, 'unread_count': 0})
+        state = get_read_state(reader, self.course.course_id)
+        self.assertTrue(state.has_read(ChatMessage.objects.get(uid=buffered.uid)))
+
+        response = client.post('/api/chat/messages/mark_as_read/', {'message_uids': ['invalid']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,3 +1,4 @@
+import uuid
 from django.shortcuts import render
 from rest_framework import viewsets, status, mixins
 from rest_framework.permissions import IsAuthenticated
@@ -5,7 +6,14 @@ from rest_framework.response import Response
 from rest_framework.decorators import action
 from django.utils import timezone
 from django.db.models import Q
-from .models import ChatMessage
+from .auth import get_course_membership
+from .broadcast import broadcast_message
+from .models import ChatMessage, ChatReadState
+from .receipts import count_new_messages, get_read_state, mark_read, messages_for_receipt
+from .pagination import (
+    MAX_PAGE_SIZE, PAGE_SIZE, InvalidCursor, cursor_headers, earliest_page, inserted_page, latest_page,
+    newer_than, older_than, page_size
+)
 from .serializers import ChatMessageSerializer
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
@@ -22,6 +30,18 @@ class ChatMessageViewSet(mixins.ListModelMixin,
     serializer_class = ChatMessageSerializer
     permission_classes = [IsAuthenticated]
 
+    def check_course_access(self, course_id):
+        """课程不存在时返回 404，不是课程成员时返回 403，可以访问时返回 (课程, None)"""
+        course, membership = get_course_membership(self.request.user, course_id)
+        if course is None:
+            return None, Response({"detail": "Course not found."}, status=status.HTTP_404_NOT_FOUND)
+        if membership is None:
+            return None, Response(
+                {"detail": "You are not a member of this course."},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        return course, None
+
     @swagger_auto_schema(
         manual_parameters=[
             openapi.Parameter(
@@ -37,6 +57,27 @@ class ChatMessageViewSet(mixins.ListModelMixin,
                 description='获取此时间戳之后的消息（ISO格式）',
                 type=openapi.TYPE_STRING,
                 required=False
+            ),
+            openapi.Parameter(
+                'before',
+                openapi.IN_QUERY,
+                description='加载此游标之前的更早消息（响应头 X-Before-Cursor）',
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+            openapi.Parameter(
+                'after',
+                openapi.IN_QUERY,
+                description='获取此游标之后写入的新消息（响应头 X-After-Cursor），包括稍后才写入的 WebSocket 消息',
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+            openapi.Parameter(
+                'limit',
+                openapi.IN_QUERY,
+                description=f'每页条数，默认 {PAGE_SIZE}，最大 {MAX_PAGE_SIZE}',
+                type=openapi.TYPE_INTEGER,
+                required=False
             )
         ],
         responses={
@@ -45,9 +86,15 @@ class ChatMessageViewSet(mixins.ListModelMixin,
         }
     )
     def list(self, request, *args, **kwargs):
-        """获取指定课程的聊天消息列表"""
+        """
+        获取指定课程的聊天消息列表
+        默认返回最新的一页；before 向前翻页，after/since 获取新消息，分页游标见响应头
+        """
         course_id = request.query_params.get('course_id')
         since = request.query_params.get('since')
+        before = request.query_params.get('before')
+        after = request.query_params.get('after')
+        size = page_size(request.query_params.get('limit'))
         
         if not course_id:
             return Response(
@@ -57,19 +104,32 @@ class ChatMessageViewSet(mixins.ListModelMixin,
         
         queryset = self.get_queryset()
         
-        if since:
-            try:
-                since_dt = timezone.datetime.fromisoformat(since)
-                queryset = queryset.filter(timestamp__gt=since_dt)
-            except ValueError:
-                return Response(
-                    {"detail": "Invalid timestamp format. Use ISO format."}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        try:
+            if after:
+                messages, has_more = inserted_page(newer_than(queryset, after), size)
+            elif since:
+                try:
+                    since_dt = timezone.datetime.fromisoformat(since)
+                except ValueError:
+                    return Response(
+                        {"detail": "Invalid timestamp format. Use ISO format."}, 
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                # 与游标分页使用同一个 (course, timestamp, id) 索引
+                messages, has_more = earliest_page(queryset.filter(timestamp__gt=since_dt), size)
+            elif before:
+                messages, has_more = latest_page(older_than(queryset, before), size)
+            else:
+                messages, has_more = latest_page(queryset, size)
+        except InvalidCursor:
+            return Response(
+                {"detail": "Invalid cursor."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         # 移除404检查，直接序列化并返回结果（可能是空列表）
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        serializer = self.get_serializer(messages, many=True)
+        return Response(serializer.data, headers=cursor_headers(messages, has_more))
 
     @swagger_auto_schema(
         request_body=ChatMessageSerializer,
@@ -100,10 +160,12 @@ class ChatMessageViewSet(mixins.ListModelMixin,
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        unread_count = ChatMessage.objects.filter(
-            course_id=course_id,
-            is_read=False
-        ).exclude(sender=request.user).count()
+        course, error = self.check_course_access(course_id)
+        if error is not None:
+            return error
+        
+        # 读取缓存的未读数，不再统计整个课程的聊天记录
+        unread_count = get_read_state(request.user, course.course_id).unread_count
         
         return Response({"unread_count": unread_count})
 
@@ -113,27 +175,72 @@ class ChatMessageViewSet(mixins.ListModelMixin,
             properties={
                 'message_ids': openapi.Schema(
                     type=openapi.TYPE_ARRAY,
-                    items=openapi.Schema(type=openapi.TYPE_INTEGER)
+                    items=openapi.Schema(type=openapi.TYPE_INTEGER),
+                    description='已读到的消息，已读位置前进到其中最新的一条'
+                ),
+                'message_uids': openapi.Schema(
+                    type=openapi.TYPE_ARRAY,
+                    items=openapi.Schema(type=openapi.TYPE_STRING, format=openapi.FORMAT_UUID),
+                    description='按 uid 引用已读到的消息，用于 WebSocket 广播时尚未写入数据库的消息'
+                ),
+                'course_id': openapi.Schema(
+                    type=openapi.TYPE_INTEGER,
+                    description='不提供 message_ids 和 message_uids 时，把该课程的消息全部标记为已读'
                 )
             }
         )
     )
     @action(detail=False, methods=['post'])
     def mark_as_read(self, request):
-        """标记消息为已读"""
+        """
+        标记消息为已读
+        已读状态按用户记录，只影响当前用户；已读位置之前的消息都视为已读
+        WebSocket 广播的消息可能还没有写入数据库（id 为 null），可以用 message_uids 引用
+        """
         message_ids = request.data.get('message_ids', [])
-        if not message_ids:
+        message_uids = request.data.get('message_uids', [])
+        course_id = request.data.get('course_id')
+        if not message_ids and not message_uids and not course_id:
             return Response(
-                {"detail": "message_ids is required."}, 
+                {"detail": "message_ids, message_uids or course_id is required."}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        updated = ChatMessage.objects.filter(
-            id__in=message_ids,
-            is_read=False
-        ).exclude(sender=request.user).update(is_read=True)
+        if not message_ids and not message_uids:
+            course, error = self.check_course_access(course_id)
+            if error is not None:
+                return error
+            state = mark_read(request.user, course.course_id)
+            return Response({"marked_as_read": None, "unread_count": state.unread_count})
         
-        return Response({"marked_as_read": updated})
+        try:
+            message_ids = [int(message_id) for message_id in message_ids]
+            message_uids = [uuid.UUID(str(uid)) for uid in message_uids]
+        except (TypeError, ValueError):
+            return Response(
+                {"detail": "Invalid message_ids or message_uids."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        messages = messages_for_receipt(request.user, message_ids, message_uids)
+        # 每门课程的已读位置前进到其中最新的一条消息
+        latest = {}
+        for chat_message in messages:
+            current = latest.get(chat_message.course_id)
+            if current is None or (chat_message.timestamp, chat_message.id) > (current.timestamp, current.id):
+                latest[chat_message.course_id] = chat_message
+        for message_course_id in latest:
+            _, error = self.check_course_access(message_course_id)
+            if error is not None:
+                return error
+        unread_count = None
+        for message_course_id, up_to in latest.items():
+            unread_count = mark_read(request.user, message_course_id, up_to).unread_count
+        
+        return Response({
+            "marked_as_read": len(messages),
+            # 只涉及一门课程时返回该课程剩余的未读数
+            "unread_count": unread_count if len(latest) == 1 else None
+        })
 
     def get_queryset(self):
         course_id = self.request.query_params.get('course_id')
@@ -142,5 +249,16 @@ class ChatMessageViewSet(mixins.ListModelMixin,
             
         return ChatMessage.objects.filter(course_id=course_id).select_related('sender')
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        course_id = self.request.query_params.get('course_id')
+        if course_id and self.request.user.is_authenticated:
+            # 消息的 is_read 按当前用户的已读位置判断
+            context['read_state'] = ChatReadState.objects.filter(user=self.request.user, course_id=course_id).first()
+        return context
+
     def perform_create(self, serializer):
-        serializer.save(sender=self.request.user)
+        chat_message = serializer.save(sender=self.request.user)
+        count_new_messages([chat_message])
+        # 推送给正在连接的客户端，不必等待轮询
+        broadcast_message(chat_message)
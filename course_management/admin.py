@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Course, CourseTime, StudentCourse, ClassCourse, CourseResource, UserAvatar, UserBackground
+from .models import Course, CourseTime, StudentCourse, ClassCourse, CourseResource, UserAvatar, UserBackground, RecordingUploadSession
 
 @admin.register(Course)
 class CourseAdmin(admin.ModelAdmin):
@@ -13,6 +13,12 @@ class CourseTimeAdmin(admin.ModelAdmin):
     list_filter = ['begin_time', 'end_time']
     search_fields = ['course__title']
 
+@admin.register(RecordingUploadSession)
+class RecordingUploadSessionAdmin(admin.ModelAdmin):
+    list_display = ['original_name', 'course_time', 'uploader', 'received_size', 'total_size', 'status', 'created_at']
+    list_filter = ['status', 'created_at']
+    readonly_fields = ['upload_id', 'received_size', 'sha256', 'created_at', 'updated_at']
+
 @admin.register(StudentCourse)
 class StudentCourseAdmin(admin.ModelAdmin):
     list_display = ['student', 'course']
@@ -0,0 +1,175 @@
+"""
+录像的 HLS 切片
+
+把处理后的录像（以及可选的原始录像）转码为一到两个码率的 H.264 HLS 切片，
+切片和播放列表作为静态文件保存在 MEDIA_ROOT/hls/<course_time_id>/<source>/ 下。
+依赖外部 ffmpeg 程序，未安装时跳过切片。
+"""
+import logging
+import os
+import shutil
+import subprocess
+import threading
+
+import cv2
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+FFMPEG_BINARY = getattr(settings, 'FFMPEG_BINARY', 'ffmpeg')
+HLS_SEGMENT_SECONDS = getattr(settings, 'HLS_SEGMENT_SECONDS', 6)
+HLS_RENDITIONS = getattr(settings, 'HLS_RENDITIONS', [
+    {'name': '720p', 'height': 720, 'video_bitrate': '2500k', 'audio_bitrate': '128k'},
+    {'name': '360p', 'height': 360, 'video_bitrate': '800k', 'audio_bitrate': '96k'},
+])
+
+MASTER_PLAYLIST_NAME = 'master.m3u8'
+VARIANT_PLAYLIST_NAME = 'index.m3u8'
+
+# CourseTime 字段 -> HLS 来源名称
+HLS_SOURCES = {
+    'processed': 'processed_recording_path',
+    'raw': 'recording_path',
+}
+
+
+def ffmpeg_available():
+    return shutil.which(FFMPEG_BINARY) is not None
+
+
+def _parse_bitrate(value):
+    """'2500k' -> 2500000"""
+    value = str(value).lower()
+    if value.endswith('k'):
+        return int(float(value[:-1]) * 1000)
+    if value.endswith('m'):
+        return int(float(value[:-1]) * 1000 * 1000)
+    return int(value)
+
+
+def _source_size(path):
+    cap = cv2.VideoCapture(path)
+    try:
+        return int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        cap.release()
+
+
+def _select_renditions(source_height):
+    """不放大视频：只保留不高于原始分辨率的码率，至少保留最低的一档"""
+    renditions = sorted(HLS_RENDITIONS, key=lambda r: r['height'], reverse=True)
+    if not source_height:
+        return renditions
+    selected = [r for r in renditions if r['height'] <= source_height]
+    return selected or renditions[-1:]
+
+
+def _segment_rendition(source_path, output_dir, rendition):
+    os.makedirs(output_dir, exist_ok=True)
+    bitrate = _parse_bitrate(rendition['video_bitrate'])
+    command = [
+        FFMPEG_BINARY, '-y', '-loglevel', 'error',
+        '-i', source_path,
+        '-map', '0:v:0', '-map', '0:a:0?',
+        '-vf', f"scale=-2:{rendition['height']}",
+        '-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'main',
+        '-b:v', rendition['video_bitrate'],
+        '-maxrate', str(int(bitrate * 1.07)),
+        '-bufsize', str(bitrate * 2),
+        # 按时间在每个切片边界强制插入关键帧，与录像帧率无关，保证每个切片都从关键帧开始且时长一致
+        '-force_key_frames', f'expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})', '-sc_threshold', '0',
+        '-c:a', 'aac', '-b:a', rendition['audio_bitrate'],
+        '-f', 'hls',
+        '-hls_time', str(HLS_SEGMENT_SECONDS),
+        '-hls_playlist_type', 'vod',
+        '-hls_segment_filename', os.path.join(output_dir, 'seg_%05d.ts'),
+        os.path.join(output_dir, VARIANT_PLAYLIST_NAME),
+    ]
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def _write_master_playlist(output_dir, variants):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for rendition, width, height in variants:
+        bandwidth = _parse_bitrate(rendition['video_bitrate']) + _parse_bitrate(rendition['audio_bitrate'])
+        lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={width}x{height}')
+        lines.append(f"{rendition['name']}/{VARIANT_PLAYLIST_NAME}")
+    with open(os.path.join(output_dir, MASTER_PLAYLIST_NAME), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def generate_hls(course_time, source='processed'):
+    """
+    为课次的录像生成 HLS 切片，返回主播放列表的存储路径（相对 MEDIA_ROOT）
+    录像不存在或 ffmpeg 不可用时返回 None
+    """
+    field_file = getattr(course_time, HLS_SOURCES[source])
+    if not field_file or not os.path.exists(field_file.path):
+        return None
+    if not ffmpeg_available():
+        logger.warning("未找到 ffmpeg，跳过课次 %s 的 HLS 切片", course_time.id)
+        return None
+    
+    relative_dir = f'hls/{course_time.id}/{source}'
+    output_dir = default_storage.path(relative_dir)
+    # 重新切片时清理旧文件
+    shutil.rmtree(output_dir, ignore_errors=True)
+    
+    source_width, source_height = _source_size(field_file.path)
+    variants = []
+    for rendition in _select_renditions(source_height):
+        _segment_rendition(field_file.path, os.path.join(output_dir, rendition['name']), rendition)
+        if source_height:
+            width = int(round(source_width * rendition['height'] / source_height / 2)) * 2
+        else:
+            width = 0
+        variants.append((rendition, width, rendition['height']))
+    
+    _write_master_playlist(output_dir, variants)
+    return f'{relative_dir}/{MASTER_PLAYLIST_NAME}'
+
+
+def generate_course_time_hls(course_time, include_raw=False):
+    """切片处理后的录像（可选地也切片原始录像），并保存到 CourseTime.hls_playlists"""
+    sources = ['processed', 'raw'] if include_raw else ['processed']
+    playlists = dict(course_time.hls_playlists or {})
+    
+    for source in sources:
+        try:
+            playlist = generate_hls(course_time, source)
+        except (subprocess.CalledProcessError, OSError) as e:
+            stderr = getattr(e, 'stderr', b'') or b''
+            logger.error("课次 %s 的 %s 录像 HLS 切片失败: %s %s", course_time.id, source, e, stderr.decode(errors='ignore'))
+            continue
+        if playlist:
+            playlists[source] = playlist
+    
+    if playlists != (course_time.hls_playlists or {}):
+        type(course_time).objects.filter(pk=course_time.pk).update(hls_playlists=playlists)
+        course_time.hls_playlists = playlists
+    return playlists
+
+
+def _generate_in_thread(course_time, include_raw):
+    try:
+        generate_course_time_hls(course_time, include_raw)
+    except Exception:
+        logger.exception("课次 %s 的 HLS 切片失败", course_time.id)
+    finally:
+        # 后台线程使用独立的数据库连接，结束时关闭
+        connection.close()
+
+
+def generate_course_time_hls_async(course_time, include_raw=False):
+    """在后台线程中切片，不阻塞当前请求"""
+    if not getattr(settings, 'HLS_AUTO_GENERATE', True) or not ffmpeg_available():
+        return None
+    thread = threading.Thread(
+        target=_generate_in_thread,
+        args=(course_time, include_raw),
+        daemon=True
+    )
+    thread.start()
+    return thread
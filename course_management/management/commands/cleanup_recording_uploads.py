@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from course_management.uploads import expire_stale_uploads
+
+
+class Command(BaseCommand):
+    help = '删除过期的未完成录像上传会话及其文件'
+
+    def handle(self, *args, **options):
+        count = expire_stale_uploads()
+        self.stdout.write(self.style.SUCCESS(f'已删除 {count} 个过期的上传会话'))
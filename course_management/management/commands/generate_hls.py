@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from course_management.models import CourseTime
+from course_management.hls import generate_course_time_hls, ffmpeg_available
+
+
+class Command(BaseCommand):
+    help = '为课程录像生成HLS切片'
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_time_ids', nargs='*', type=int, help='课程时间ID，不指定时处理所有未切片的处理后录像')
+        parser.add_argument('--include-raw', action='store_true', help='同时切片原始录像')
+
+    def handle(self, *args, **options):
+        if not ffmpeg_available():
+            raise CommandError('未找到 ffmpeg，无法生成HLS切片')
+        
+        course_times = CourseTime.objects.exclude(processed_recording_path='').exclude(processed_recording_path__isnull=True)
+        if options['course_time_ids']:
+            course_times = CourseTime.objects.filter(id__in=options['course_time_ids'])
+        else:
+            course_times = course_times.filter(hls_playlists__isnull=True)
+        
+        for course_time in course_times:
+            playlists = generate_course_time_hls(course_time, include_raw=options['include_raw'])
+            if playlists:
+                self.stdout.write(self.style.SUCCESS(f'课程时间 {course_time.id}: {", ".join(sorted(playlists))}'))
+            else:
+                self.stdout.write(self.style.WARNING(f'课程时间 {course_time.id}: 没有可切片的录像'))
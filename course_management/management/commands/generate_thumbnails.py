@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from course_management.models import CourseTime
+from course_management.thumbnails import generate_thumbnails
+
+
+class Command(BaseCommand):
+    help = '为课程录像生成封面和时间轴雪碧图'
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_time_ids', nargs='*', type=int, help='课程时间ID，不指定时处理所有还没有缩略图的录像')
+
+    def handle(self, *args, **options):
+        if options['course_time_ids']:
+            course_times = CourseTime.objects.filter(id__in=options['course_time_ids'])
+        else:
+            course_times = CourseTime.objects.filter(thumbnails__isnull=True)
+        
+        for course_time in course_times:
+            # 优先使用原始录像，没有时使用处理后的录像
+            source = 'recording_path' if course_time.recording_path else 'processed_recording_path'
+            thumbnails = generate_thumbnails(course_time, source)
+            if thumbnails:
+                count = thumbnails.get('sprite', {}).get('count', 0)
+                self.stdout.write(self.style.SUCCESS(f'课程时间 {course_time.id}: 封面和 {count} 张缩略图'))
+            else:
+                self.stdout.write(self.style.WARNING(f'课程时间 {course_time.id}: 没有可用的录像'))
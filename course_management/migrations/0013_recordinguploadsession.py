@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:19
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course_management', '0012_coursetime_emotion_analysis_json_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecordingUploadSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('upload_id', models.UUIDField(default=uuid.uuid4, editable=False, unique=True, verbose_name='上传ID')),
+                ('original_name', models.CharField(max_length=255, verbose_name='原始文件名')),
+                ('file_name', models.CharField(max_length=255, verbose_name='存储路径')),
+                ('total_size', models.BigIntegerField(verbose_name='文件总大小')),
+                ('received_size', models.BigIntegerField(default=0, verbose_name='已接收大小')),
+                ('sha256', models.CharField(blank=True, default='', max_length=64, verbose_name='SHA256')),
+                ('status', models.CharField(choices=[('uploading', '上传中'), ('completed', '已完成')], default='uploading', max_length=20, verbose_name='状态')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('course_time', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='course_management.coursetime', verbose_name='课程时间')),
+                ('uploader', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='recording_uploads', to=settings.AUTH_USER_MODEL, verbose_name='上传者')),
+            ],
+            options={
+                'verbose_name': '录像上传会话',
+                'verbose_name_plural': '录像上传会话',
+            },
+        ),
+    ]
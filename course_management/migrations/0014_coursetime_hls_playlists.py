@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course_management', '0013_recordinguploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coursetime',
+            name='hls_playlists',
+            field=models.JSONField(blank=True, null=True, verbose_name='HLS播放列表'),
+        ),
+    ]
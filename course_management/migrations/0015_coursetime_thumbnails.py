@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course_management', '0014_coursetime_hls_playlists'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coursetime',
+            name='thumbnails',
+            field=models.JSONField(blank=True, null=True, verbose_name='封面和缩略图'),
+        ),
+    ]
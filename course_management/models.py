@@ -1,3 +1,4 @@
+import uuid
 from django.db import models
 from django.utils import timezone
 
@@ -24,6 +25,8 @@ class CourseTime(models.Model):
     recording_path = models.FileField(upload_to='course_recordings/%Y/%m/%d/', verbose_name='课程录像', blank=True, null=True)
     processed_recording_path = models.FileField(upload_to='processed_recordings/%Y/%m/%d/', verbose_name='处理后的录像', blank=True, null=True)
     emotion_analysis_json = models.JSONField(verbose_name='情绪分析数据', blank=True, null=True)
+    hls_playlists = models.JSONField(verbose_name='HLS播放列表', blank=True, null=True)
+    thumbnails = models.JSONField(verbose_name='封面和缩略图', blank=True, null=True)
     
     class Meta:
         app_label = 'course_management'
@@ -36,6 +39,36 @@ class CourseTime(models.Model):
         end = self.end_time.strftime('%Y-%m-%d %H:%M') if self.end_time else "未设置"
         return f"{course_title}: {begin} - {end}"
 
+class RecordingUploadSession(models.Model):
+    """
+    录像分块上传会话
+    分块直接写入最终存储位置（file_name），received_size 为已确认写入的字节数
+    """
+    STATUS_CHOICES = (
+        ('uploading', '上传中'),
+        ('completed', '已完成'),
+    )
+    
+    upload_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False, verbose_name='上传ID')
+    course_time = models.ForeignKey(CourseTime, on_delete=models.CASCADE, related_name='upload_sessions', verbose_name='课程时间')
+    uploader = models.ForeignKey('user_management.User', on_delete=models.SET_NULL, null=True, related_name='recording_uploads', verbose_name='上传者')
+    original_name = models.CharField(max_length=255, verbose_name='原始文件名')
+    file_name = models.CharField(max_length=255, verbose_name='存储路径')
+    total_size = models.BigIntegerField(verbose_name='文件总大小')
+    received_size = models.BigIntegerField(default=0, verbose_name='已接收大小')
+    sha256 = models.CharField(max_length=64, blank=True, default='', verbose_name='SHA256')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading', verbose_name='状态')
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='创建时间')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+    
+    class Meta:
+        app_label = 'course_management'
+        verbose_name = '录像上传会话'
+        verbose_name_plural = verbose_name
+    
+    def __str__(self):
+        return f"{self.original_name} ({self.received_size}/{self.total_size})"
+
 class StudentCourse(models.Model):
     student = models.ForeignKey('user_management.Student', on_delete=models.SET_NULL, null=True, blank=True, related_name='student_courses')
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='student_courses')
@@ -1,4 +1,6 @@
 from rest_framework import serializers
+from django.urls import reverse
+from .thumbnails import thumbnail_urls
 from .models import Course, CourseResource, CourseTime
 
 class CourseListSerializer(serializers.ModelSerializer):
@@ -52,12 +54,16 @@ class CourseTimeSerializer(serializers.ModelSerializer):
     has_processed_recording = serializers.SerializerMethodField()
     # 检查是否有情感分析数据的计算字段
     has_emotion_analysis = serializers.SerializerMethodField()
+    # 检查是否已生成HLS切片的计算字段
+    has_hls = serializers.SerializerMethodField()
+    # 录像封面图URL的计算字段
+    poster_url = serializers.SerializerMethodField()
     
     class Meta:
         model = CourseTime
         fields = ['id', 'begin_time', 'end_time', 'course_id', 'course_title', 
                   'teacher_name', 'has_recording', 'has_processed_recording', 
-                  'has_emotion_analysis']
+                  'has_emotion_analysis', 'has_hls', 'poster_url']
     
     def get_has_recording(self, obj):
         """判断是否存在录制文件"""
@@ -70,6 +76,14 @@ class CourseTimeSerializer(serializers.ModelSerializer):
     def get_has_emotion_analysis(self, obj):
         """判断是否存在情感分析数据"""
         return bool(obj.emotion_analysis_json)
+    
+    def get_has_hls(self, obj):
+        """判断是否已生成HLS切片"""
+        return bool(obj.hls_playlists)
+    
+    def get_poster_url(self, obj):
+        """获取录像封面图的URL，没有封面时返回None"""
+        return thumbnail_urls(obj.thumbnails, self.context.get('request'))['poster_url']
 
 class RecordingSerializer(serializers.ModelSerializer):
     """
@@ -84,12 +98,17 @@ class RecordingSerializer(serializers.ModelSerializer):
     recording_url = serializers.SerializerMethodField()
     # 处理后录制视频URL的计算字段
     processed_recording_url = serializers.SerializerMethodField()
+    # HLS主播放列表URL的计算字段
+    hls_url = serializers.SerializerMethodField()
+    # 封面图URL和时间轴雪碧图的计算字段
+    poster_url = serializers.SerializerMethodField()
+    thumbnail_sprite = serializers.SerializerMethodField()
     
     class Meta:
         model = CourseTime
         fields = ['id', 'begin_time', 'end_time', 'course_id', 'course_title', 
                   'teacher_name', 'recording_url', 'processed_recording_url', 
-                  'emotion_analysis_json']
+                  'hls_url', 'poster_url', 'thumbnail_sprite', 'emotion_analysis_json']
     
     def get_recording_url(self, obj):
         """
@@ -113,4 +132,28 @@ class RecordingSerializer(serializers.ModelSerializer):
             if request:
                 return request.build_absolute_uri(obj.processed_recording_path.url)
             return obj.processed_recording_path.url
-        return None 
\ No newline at end of file
+        return None 
+    
+    def get_hls_url(self, obj):
+        """
+        获取HLS主播放列表的URL
+        只有生成过切片的录像才返回，如果存在请求上下文，则构建绝对URL
+        """
+        if not (obj.hls_playlists or {}).get('processed'):
+            return None
+        url = reverse('recording-hls', kwargs={'course_time_id': obj.id})
+        request = self.context.get('request')
+        if request:
+            return request.build_absolute_uri(url)
+        return url
+    
+    def get_poster_url(self, obj):
+        """获取录像封面图的URL，没有封面时返回None"""
+        return thumbnail_urls(obj.thumbnails, self.context.get('request'))['poster_url']
+    
+    def get_thumbnail_sprite(self, obj):
+        """
+        获取时间轴雪碧图
+        包含图片URL、缩略图间隔秒数、单张尺寸和网格列数，前端据此计算拖动预览的位置
+        """
+        return thumbnail_urls(obj.thumbnails, self.context.get('request'))['sprite']
@@ -0,0 +1,192 @@
+"""
+录像文件的 HTTP 范围请求（Range）支持
+
+- 单个范围：206 + Content-Range，只读取请求的文件窗口
+- 多个范围：206 + multipart/byteranges
+- If-Range：校验器不匹配时返回完整文件
+- 可选地交给前端服务器发送文件（X-Sendfile / X-Accel-Redirect），字节不经过 Python
+"""
+import os
+import re
+import secrets
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+
+# 每次从文件读取的块大小
+STREAM_BLOCK_SIZE = 64 * 1024
+
+# 单个请求最多接受的范围数，超过时忽略 Range 返回完整文件
+MAX_RANGES = 16
+
+_RANGE_SPEC_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+def parse_range_header(header, size):
+    """
+    解析 Range 请求头
+    返回 None 表示忽略该请求头（不存在或格式不正确），
+    返回空列表表示所有范围都无法满足，否则返回合并后的 [(start, end), ...]（闭区间）
+    """
+    if not header:
+        return None
+    units, _, specs = header.partition('=')
+    if units.strip().lower() != 'bytes' or not specs:
+        return None
+    
+    ranges = []
+    for spec in specs.split(','):
+        match = _RANGE_SPEC_RE.match(spec)
+        if not match:
+            return None
+        first, last = match.groups()
+        if not first and not last:
+            return None
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if last and end < start:
+                return None
+        else:
+            # 后缀范围：最后 N 个字节
+            suffix = int(last)
+            if suffix == 0:
+                continue
+            start = max(size - suffix, 0)
+            end = size - 1
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+    
+    if len(ranges) > MAX_RANGES:
+        return None
+    
+    # 合并重叠或相邻的范围
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def file_etag(stat_result):
+    return '"{:x}-{:x}"'.format(int(stat_result.st_mtime), stat_result.st_size)
+
+
+def if_range_matches(if_range, etag, mtime):
+    """If-Range 中的 ETag 或日期与当前文件一致时返回 True"""
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # If-Range 只允许强校验器
+        return if_range == etag
+    date = parse_http_date_safe(if_range)
+    return date is not None and date == int(mtime)
+
+
+def iter_file_range(path, start, end, block_size=STREAM_BLOCK_SIZE):
+    """按块读取文件的 [start, end] 窗口"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = f.read(min(block_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def _multipart_parts(ranges, size, content_type, boundary):
+    parts = []
+    for start, end in ranges:
+        header = (
+            f'\r\n--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        ).encode('ascii')
+        parts.append((header, start, end))
+    closing = f'\r\n--{boundary}--\r\n'.encode('ascii')
+    return parts, closing
+
+
+def _iter_multipart(path, parts, closing):
+    for header, start, end in parts:
+        yield header
+        yield from iter_file_range(path, start, end)
+    yield closing
+
+
+def _offload_response(path, content_type):
+    """根据 RECORDING_STREAM_OFFLOAD 设置生成交给前端服务器发送的响应，未启用时返回 None"""
+    mode = getattr(settings, 'RECORDING_STREAM_OFFLOAD', None)
+    if not mode:
+        return None
+    
+    response = HttpResponse(content_type=content_type)
+    if mode == 'x-sendfile':
+        response['X-Sendfile'] = path
+    elif mode == 'x-accel-redirect':
+        prefix = getattr(settings, 'RECORDING_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+        relative_path = os.path.relpath(path, default_storage.location).replace(os.sep, '/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + relative_path
+    else:
+        return None
+    return response
+
+
+def ranged_file_response(request, path, content_type):
+    """为本地文件生成支持 Range / If-Range 的响应"""
+    stat_result = os.stat(path)
+    size = stat_result.st_size
+    etag = file_etag(stat_result)
+    last_modified = http_date(stat_result.st_mtime)
+    
+    response = _offload_response(path, content_type)
+    if response is not None:
+        # 范围请求由前端服务器处理
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        return response
+    
+    ranges = None
+    if request.method in ('GET', 'HEAD') and if_range_matches(request.META.get('HTTP_IF_RANGE'), etag, stat_result.st_mtime):
+        ranges = parse_range_header(request.META.get('HTTP_RANGE', ''), size)
+    
+    if ranges == []:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif ranges and len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(
+            iter_file_range(path, start, end),
+            status=206,
+            content_type=content_type
+        )
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    elif ranges:
+        boundary = secrets.token_hex(16)
+        parts, closing = _multipart_parts(ranges, size, content_type, boundary)
+        length = sum(len(header) + end - start + 1 for header, start, end in parts) + len(closing)
+        response = StreamingHttpResponse(
+            _iter_multipart(path, parts, closing),
+            status=206,
+            content_type=f'multipart/byteranges; boundary={boundary}'
+        )
+        response['Content-Length'] = str(length)
+    else:
+        response = StreamingHttpResponse(
+            iter_file_range(path, 0, size - 1),
+            content_type=content_type
+        )
+        response['Content-Length'] = str(size)
+    
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    return response
@@ -1,11 +1,24 @@
-from django.test import TestCase
+import hashlib
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
+import numpy as np
+from django.test import TestCase, override_settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.urls import reverse
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from django.contrib.auth import get_user_model
 from user_management.models import Teacher, Student
 from class_management.models import Class
-from .models import Course, StudentCourse
+from django.utils import timezone
+from . import hls, uploads
+from .models import Course, StudentCourse, CourseTime, RecordingUploadSession
+from .streaming import parse_range_header
+from .thumbnails import ThumbnailCollector
+from .serializers import RecordingSerializer
 
 class CourseStudentInfoViewTests(APITestCase):
     def setUp(self):
@@ -144,3 +157,319 @@ class CourseStudentInfoViewTests(APITestCase):
         
         # 验证响应（应该返回404）
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class RecordingChunkedUploadTests(APITestCase):
+    def setUp(self):
+        """测试数据初始化"""
+        User = get_user_model()
+        self.teacher_user = User.objects.create_user(
+            username='teacher1',
+            password='testpass123',
+            role='teacher'
+        )
+        self.teacher = Teacher.objects.get(user=self.teacher_user)
+        self.course = Course.objects.create(title='测试课程', teacher=self.teacher)
+        self.course_time = CourseTime.objects.create(course=self.course, teacher=self.teacher)
+        
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.teacher_user)
+        self.content = os.urandom(200 * 1024)
+    
+    def _create_session(self):
+        url = reverse('recording-upload-create', kwargs={'course_time_id': self.course_time.id})
+        response = self.client.post(url, {'file_name': 'lecture.webm', 'total_size': len(self.content)}, format='json')
+        self.assertEqual(response.data['code'], 200)
+        return response.data['data']['upload_id']
+    
+    def _patch_chunk(self, upload_id, offset, chunk):
+        url = reverse('recording-upload-session', kwargs={'upload_id': upload_id})
+        return self.client.generic(
+            'PATCH', url, chunk,
+            content_type='application/octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset)
+        )
+    
+    def test_chunked_upload_and_complete(self):
+        """测试分块上传并完成后关联到课程时间记录"""
+        upload_id = self._create_session()
+        
+        middle = 120 * 1024
+        response = self._patch_chunk(upload_id, 0, self.content[:middle])
+        self.assertEqual(response.data['data']['offset'], middle)
+        response = self._patch_chunk(upload_id, middle, self.content[middle:])
+        self.assertEqual(response.data['data']['offset'], len(self.content))
+        
+        url = reverse('recording-upload-complete', kwargs={'upload_id': upload_id})
+        sha256 = hashlib.sha256(self.content).hexdigest()
+        response = self.client.post(url, {'sha256': sha256}, format='json')
+        self.assertEqual(response.data['code'], 200)
+        self.assertEqual(response.data['data']['sha256'], sha256)
+        
+        self.course_time.refresh_from_db()
+        with self.course_time.recording_path.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+    
+    def test_offset_mismatch_returns_current_offset(self):
+        """测试偏移量不一致时返回服务器当前偏移量，便于断点续传"""
+        upload_id = self._create_session()
+        self._patch_chunk(upload_id, 0, self.content[:1024])
+        
+        response = self._patch_chunk(upload_id, 4096, self.content[4096:8192])
+        self.assertEqual(response.data['code'], 409)
+        self.assertEqual(response.data['data']['offset'], 1024)
+    
+    def test_complete_before_all_chunks(self):
+        """测试未上传完成时不能完成会话"""
+        upload_id = self._create_session()
+        self._patch_chunk(upload_id, 0, self.content[:1024])
+        
+        url = reverse('recording-upload-complete', kwargs={'upload_id': upload_id})
+        response = self.client.post(url, {}, format='json')
+        self.assertEqual(response.data['code'], 400)
+
+    
+    def test_cross_origin_chunk_preflight(self):
+        """跨域上传分块时预检请求允许 Upload-Offset 请求头"""
+        upload_id = self._create_session()
+        url = reverse('recording-upload-session', kwargs={'upload_id': upload_id})
+        response = self.client.options(
+            url, HTTP_ORIGIN='http://localhost:8080',
+            HTTP_ACCESS_CONTROL_REQUEST_METHOD='PATCH',
+            HTTP_ACCESS_CONTROL_REQUEST_HEADERS='authorization, content-type, upload-offset'
+        )
+        allowed = {h.strip() for h in response['Access-Control-Allow-Headers'].split(',')}
+        self.assertIn('upload-offset', allowed)
+    
+    def test_stale_upload_expires(self):
+        """测试过期的上传会话连同文件和进程内的哈希状态一起删除"""
+        upload_id = self._create_session()
+        self._patch_chunk(upload_id, 0, self.content[:1024])
+        upload = RecordingUploadSession.objects.get(upload_id=upload_id)
+        self.assertIn(str(upload_id), uploads._hashers)
+        
+        RecordingUploadSession.objects.filter(pk=upload.pk).update(updated_at=timezone.now() - timedelta(days=2))
+        with mock.patch.object(uploads, 'UPLOAD_EXPIRE_HOURS', 0):
+            self.assertEqual(uploads.expire_stale_uploads(), 1)
+        
+        self.assertFalse(RecordingUploadSession.objects.filter(pk=upload.pk).exists())
+        self.assertFalse(default_storage.exists(upload.file_name))
+        self.assertNotIn(str(upload_id), uploads._hashers)
+
+class RangeHeaderParsingTests(TestCase):
+    def test_single_and_suffix_ranges(self):
+        """测试单个范围与后缀范围解析"""
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), [(0, 99)])
+        self.assertEqual(parse_range_header('bytes=900-', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=-100', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=500-5000', 1000), [(500, 999)])
+    
+    def test_multiple_ranges_are_merged(self):
+        """测试重叠的多个范围会被合并"""
+        self.assertEqual(
+            parse_range_header('bytes=0-99, 50-149, 300-399', 1000),
+            [(0, 149), (300, 399)]
+        )
+    
+    def test_unsatisfiable_and_invalid(self):
+        """测试无法满足与格式错误的范围"""
+        self.assertEqual(parse_range_header('bytes=2000-', 1000), [])
+        self.assertIsNone(parse_range_header('bytes=abc', 1000))
+        self.assertIsNone(parse_range_header('items=0-1', 1000))
+        self.assertIsNone(parse_range_header('', 1000))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class StreamRecordingViewTests(APITestCase):
+    def setUp(self):
+        """测试数据初始化"""
+        User = get_user_model()
+        self.teacher_user = User.objects.create_user(
+            username='teacher1',
+            password='testpass123',
+            role='teacher'
+        )
+        self.teacher = Teacher.objects.get(user=self.teacher_user)
+        self.course = Course.objects.create(title='测试课程', teacher=self.teacher)
+        self.course_time = CourseTime.objects.create(course=self.course, teacher=self.teacher)
+        
+        self.content = bytes(range(256)) * 40
+        self.course_time.recording_path.save('lecture.webm', ContentFile(self.content))
+        
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.teacher_user)
+        self.url = reverse('stream-recording', kwargs={'course_time_id': self.course_time.id})
+    
+    def test_single_range_returns_window(self):
+        """测试单个范围只返回请求的字节"""
+        response = self.client.get(self.url, {'type': 'raw'}, HTTP_RANGE='bytes=100-199')
+        
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+    
+    def test_multiple_ranges_return_multipart(self):
+        """测试多个范围返回 multipart/byteranges"""
+        response = self.client.get(self.url, {'type': 'raw'}, HTTP_RANGE='bytes=0-9,1000-1009')
+        
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges'))
+        body = b''.join(response.streaming_content)
+        self.assertEqual(len(body), int(response['Content-Length']))
+        self.assertIn(self.content[1000:1010], body)
+    
+    def test_if_range_mismatch_returns_full_file(self):
+        """测试 If-Range 不匹配时返回完整文件"""
+        response = self.client.get(self.url, {'type': 'raw'}, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+    
+    def test_unsatisfiable_range(self):
+        """测试超出文件大小的范围返回416"""
+        response = self.client.get(self.url, {'type': 'raw'}, HTTP_RANGE=f'bytes={len(self.content) + 10}-')
+        
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+    
+    @override_settings(RECORDING_STREAM_OFFLOAD='x-accel-redirect')
+    def test_accel_redirect_offload(self):
+        """测试交给前端服务器发送文件"""
+        response = self.client.get(self.url, {'type': 'raw'})
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['X-Accel-Redirect'].startswith('/protected-media/course_recordings/'))
+        self.assertEqual(response.content, b'')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class HlsPlaylistViewTests(APITestCase):
+    def setUp(self):
+        """测试数据初始化"""
+        User = get_user_model()
+        self.teacher_user = User.objects.create_user(
+            username='teacher1',
+            password='testpass123',
+            role='teacher'
+        )
+        self.teacher = Teacher.objects.get(user=self.teacher_user)
+        self.course = Course.objects.create(title='测试课程', teacher=self.teacher)
+        self.course_time = CourseTime.objects.create(course=self.course, teacher=self.teacher)
+        
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.teacher_user)
+        self.url = reverse('recording-hls', kwargs={'course_time_id': self.course_time.id})
+    
+    def test_missing_playlist_returns_404(self):
+        """未生成切片时返回404"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['code'], 404)
+    
+    def test_master_playlist_uses_media_urls(self):
+        """主播放列表中的子播放列表改写为媒体URL"""
+        master = f'hls/{self.course_time.id}/processed/master.m3u8'
+        default_storage.save(master, ContentFile(
+            b'#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=928000,RESOLUTION=640x360\n360p/index.m3u8\n'
+        ))
+        CourseTime.objects.filter(id=self.course_time.id).update(hls_playlists={'processed': master})
+        
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/vnd.apple.mpegurl')
+        lines = response.content.decode().splitlines()
+        self.assertEqual(lines[0], '#EXTM3U')
+        self.assertTrue(lines[2].startswith('http://testserver/'))
+        self.assertTrue(lines[2].endswith(f'hls/{self.course_time.id}/processed/360p/index.m3u8'))
+    
+    def test_keyframes_follow_segment_time(self):
+        """关键帧按时间对齐到切片边界，不依赖录像帧率"""
+        rendition = {'name': '360p', 'height': 360, 'video_bitrate': '800k', 'audio_bitrate': '96k'}
+        with mock.patch('course_management.hls.subprocess.run') as run:
+            hls._segment_rendition('input.mp4', tempfile.mkdtemp(), rendition)
+        command = run.call_args[0][0]
+        self.assertNotIn('-g', command)
+        self.assertEqual(
+            command[command.index('-force_key_frames') + 1],
+            f'expr:gte(t,n_forced*{hls.HLS_SEGMENT_SECONDS})'
+        )
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ThumbnailCollectorTests(TestCase):
+    def setUp(self):
+        """测试数据初始化"""
+        User = get_user_model()
+        teacher_user = User.objects.create_user(
+            username='teacher1',
+            password='testpass123',
+            role='teacher'
+        )
+        teacher = Teacher.objects.get(user=teacher_user)
+        course = Course.objects.create(title='测试课程', teacher=teacher)
+        self.course_time = CourseTime.objects.create(course=course, teacher=teacher)
+    
+    def test_sprite_layout_and_serializer_urls(self):
+        """每隔固定秒数取一张缩略图，拼成网格并通过序列化器返回"""
+        collector = ThumbnailCollector(fps=2, interval=10, tile_width=80)
+        for index in range(50):
+            frame = np.full((240, 320, 3), index, dtype=np.uint8)
+            collector.add_frame(index, frame)
+        
+        # 25秒的视频在 0、10、20 秒各取一张
+        self.assertEqual(len(collector.tiles), 3)
+        self.assertEqual(collector.tiles[1][0, 0, 0], 20)
+        # 封面取第1秒的画面
+        self.assertEqual(collector.poster[0, 0, 0], 2)
+        
+        sprite, meta = collector.build_sprite()
+        self.assertEqual(sprite.shape, (60, 240, 3))
+        self.assertEqual(meta['count'], 3)
+        
+        collector.save(self.course_time)
+        self.course_time.refresh_from_db()
+        data = RecordingSerializer(self.course_time).data
+        self.assertTrue(data['poster_url'].endswith(f'thumbnails/{self.course_time.id}/poster.jpg'))
+        self.assertEqual(data['thumbnail_sprite']['tile_width'], 80)
+        self.assertEqual(data['thumbnail_sprite']['columns'], 3)
+        self.assertTrue(default_storage.exists(self.course_time.thumbnails['sprite']['path']))
+
+
+class EndClassLiveFlushTests(APITestCase):
+    def setUp(self):
+        """测试数据初始化"""
+        User = get_user_model()
+        self.teacher_user = User.objects.create_user(
+            username='teacher1',
+            password='testpass123',
+            role='teacher'
+        )
+        self.teacher = Teacher.objects.get(user=self.teacher_user)
+        self.course = Course.objects.create(title='测试课程', teacher=self.teacher)
+        
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.teacher_user)
+    
+    def test_end_class_flushes_live_sessions(self):
+        """结束上课时立即写入正在推流的实时分析统计"""
+        from face_recognition.realtime import AnalysisSession, register_live_session, unregister_live_session
+        
+        response = self.client.post(reverse('start-class', kwargs={'course_id': self.course.course_id}))
+        course_time_id = response.data['data']['course_time_id']
+        self.assertEqual(response.data['data']['analysis_ws_path'], f'/ws/analysis/{course_time_id}/')
+        
+        session = AnalysisSession(course_time_id)
+        register_live_session(session)
+        self.addCleanup(unregister_live_session, session)
+        session.aggregator.log_status({'name': '张三', 'main_status': 'Focused'})
+        
+        response = self.client.post(reverse('end-class', kwargs={'course_time_id': course_time_id}))
+        self.assertEqual(response.data['code'], 200)
+        
+        course_time = CourseTime.objects.get(id=course_time_id)
+        self.assertIsNotNone(course_time.end_time)
+        data = course_time.emotion_analysis_json
+        self.assertEqual(data['summary']['张三']['status_counts'], {'Focused': 1})
+        self.assertEqual(sum(bucket['Focused'] for bucket in data['timeline'].values()), 1)
+        # 实时显示的累计统计不受写入影响
+        self.assertIn('张三', session.aggregator.get_status_stats()['summary'])
@@ -0,0 +1,175 @@
+"""
+录像的封面图和时间轴雪碧图
+
+封面图和雪碧图保存在 MEDIA_ROOT/thumbnails/<course_time_id>/ 下，元数据保存在
+CourseTime.thumbnails 中，列表页和拖动预览只需要读取这两张图片，不需要访问视频本身。
+情绪分析时在解码循环中顺带采集缩略图（ThumbnailCollector），
+没有经过分析的录像可以用 generate_thumbnails 单独生成。
+"""
+import logging
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_INTERVAL_SECONDS = getattr(settings, 'THUMBNAIL_INTERVAL_SECONDS', 10)
+THUMBNAIL_TILE_WIDTH = getattr(settings, 'THUMBNAIL_TILE_WIDTH', 160)
+THUMBNAIL_SPRITE_COLUMNS = getattr(settings, 'THUMBNAIL_SPRITE_COLUMNS', 10)
+# 封面取第几秒的画面（开头往往是黑屏）
+POSTER_OFFSET_SECONDS = getattr(settings, 'POSTER_OFFSET_SECONDS', 1)
+POSTER_MAX_WIDTH = 640
+JPEG_QUALITY = 80
+
+POSTER_NAME = 'poster.jpg'
+SPRITE_NAME = 'sprite.jpg'
+
+
+def _resize_to_width(frame, width):
+    height, frame_width = frame.shape[:2]
+    if frame_width <= width:
+        return frame.copy()
+    new_height = max(int(round(height * width / frame_width)), 1)
+    return cv2.resize(frame, (width, new_height), interpolation=cv2.INTER_AREA)
+
+
+def _encode_jpeg(image):
+    ok, buffer = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY])
+    if not ok:
+        raise ValueError("JPEG 编码失败")
+    return buffer.tobytes()
+
+
+class ThumbnailCollector:
+    """
+    在逐帧解码的循环中采集封面和时间轴缩略图
+    每帧调用 add_frame，只在需要的帧上做一次缩放，不会额外解码视频
+    """
+
+    def __init__(self, fps, interval=THUMBNAIL_INTERVAL_SECONDS, tile_width=THUMBNAIL_TILE_WIDTH):
+        self.fps = fps if fps and fps > 0 else 25
+        self.interval = interval
+        self.tile_width = tile_width
+        self.poster = None
+        self._poster_final = False
+        self.tiles = []
+        self._next_tile_time = 0.0
+
+    def add_frame(self, frame_index, frame):
+        """传入原始帧（在绘制标注之前）"""
+        timestamp = frame_index / self.fps
+        # 先用第一帧兜底，视频够长时换成封面偏移处的画面
+        if self.poster is None or (not self._poster_final and timestamp >= POSTER_OFFSET_SECONDS):
+            self.poster = _resize_to_width(frame, POSTER_MAX_WIDTH)
+            self._poster_final = timestamp >= POSTER_OFFSET_SECONDS
+        if timestamp >= self._next_tile_time:
+            self.tiles.append(_resize_to_width(frame, self.tile_width))
+            self._next_tile_time += self.interval
+
+    def build_sprite(self):
+        """把缩略图拼接成网格，返回 (图像, 元数据)"""
+        if not self.tiles:
+            return None, None
+        tile_height, tile_width = self.tiles[0].shape[:2]
+        columns = min(THUMBNAIL_SPRITE_COLUMNS, len(self.tiles))
+        rows = (len(self.tiles) + columns - 1) // columns
+        sprite = np.zeros((rows * tile_height, columns * tile_width, 3), dtype=np.uint8)
+        for index, tile in enumerate(self.tiles):
+            row, column = divmod(index, columns)
+            # 分辨率中途变化的视频统一到第一张缩略图的尺寸
+            if tile.shape[:2] != (tile_height, tile_width):
+                tile = cv2.resize(tile, (tile_width, tile_height), interpolation=cv2.INTER_AREA)
+            sprite[row * tile_height:(row + 1) * tile_height,
+                   column * tile_width:(column + 1) * tile_width] = tile
+        meta = {
+            'interval': self.interval,
+            'tile_width': tile_width,
+            'tile_height': tile_height,
+            'columns': columns,
+            'rows': rows,
+            'count': len(self.tiles),
+        }
+        return sprite, meta
+
+    def save(self, course_time):
+        """保存封面和雪碧图，并更新 CourseTime.thumbnails"""
+        if self.poster is None:
+            return None
+        relative_dir = f'thumbnails/{course_time.id}'
+        thumbnails = {}
+
+        poster_name = f'{relative_dir}/{POSTER_NAME}'
+        default_storage.delete(poster_name)
+        thumbnails['poster'] = default_storage.save(poster_name, ContentFile(_encode_jpeg(self.poster)))
+
+        sprite, meta = self.build_sprite()
+        if sprite is not None:
+            sprite_name = f'{relative_dir}/{SPRITE_NAME}'
+            default_storage.delete(sprite_name)
+            meta['path'] = default_storage.save(sprite_name, ContentFile(_encode_jpeg(sprite)))
+            thumbnails['sprite'] = meta
+
+        type(course_time).objects.filter(pk=course_time.pk).update(thumbnails=thumbnails)
+        course_time.thumbnails = thumbnails
+        return thumbnails
+
+
+def generate_thumbnails(course_time, source='recording_path'):
+    """
+    为没有经过情绪分析的录像单独生成缩略图
+    按时间间隔跳转读取，只解码需要的帧
+    """
+    field_file = getattr(course_time, source)
+    if not field_file:
+        return None
+    cap = cv2.VideoCapture(field_file.path)
+    if not cap.isOpened():
+        logger.warning("无法打开课次 %s 的录像，跳过缩略图生成", course_time.id)
+        return None
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        collector = ThumbnailCollector(fps)
+        frame_total = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        duration = frame_total / collector.fps if frame_total > 0 else None
+
+        ret, frame = cap.read()
+        if not ret:
+            return None
+        collector.add_frame(0, frame)
+
+        cap.set(cv2.CAP_PROP_POS_MSEC, POSTER_OFFSET_SECONDS * 1000)
+        ret, frame = cap.read()
+        if ret:
+            collector.poster = _resize_to_width(frame, POSTER_MAX_WIDTH)
+
+        position = collector.interval
+        while duration is None or position < duration:
+            cap.set(cv2.CAP_PROP_POS_MSEC, position * 1000)
+            ret, frame = cap.read()
+            if not ret:
+                break
+            collector.tiles.append(_resize_to_width(frame, collector.tile_width))
+            position += collector.interval
+    finally:
+        cap.release()
+    return collector.save(course_time)
+
+
+def thumbnail_urls(thumbnails, request=None):
+    """把 CourseTime.thumbnails 中的存储路径转换为 URL"""
+    def build(path):
+        url = default_storage.url(path)
+        return request.build_absolute_uri(url) if request else url
+
+    thumbnails = thumbnails or {}
+    result = {'poster_url': None, 'sprite': None}
+    if thumbnails.get('poster'):
+        result['poster_url'] = build(thumbnails['poster'])
+    sprite = thumbnails.get('sprite')
+    if sprite and sprite.get('path'):
+        result['sprite'] = {key: value for key, value in sprite.items() if key != 'path'}
+        result['sprite']['url'] = build(sprite['path'])
+    return result
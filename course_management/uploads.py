@@ -0,0 +1,144 @@
+"""
+录像分块上传
+
+分块按偏移量直接写入最终存储位置，每次只在内存中保留一个固定大小的缓冲区。
+上传过程中以增量方式计算 SHA256：哈希状态保存在当前进程中，
+若请求落在其他进程或进程重启导致状态丢失，完成时会从磁盘流式重新计算。
+超过 RECORDING_UPLOAD_EXPIRE_HOURS 没有新分块的会话视为过期：进程内的哈希状态在下一次访问时清理，
+会话本身由 expire_stale_uploads（cleanup_recording_uploads 命令）删除。
+"""
+import hashlib
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .models import CourseTime, RecordingUploadSession
+
+# 单次从请求流读取/写入磁盘的缓冲区大小
+STREAM_BUFFER_SIZE = 64 * 1024
+
+# 客户端建议分块大小与单个录像的最大尺寸
+DEFAULT_CHUNK_SIZE = getattr(settings, 'RECORDING_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)
+MAX_RECORDING_SIZE = getattr(settings, 'RECORDING_UPLOAD_MAX_SIZE', 4 * 1024 * 1024 * 1024)
+# 没有新分块超过这个时间的上传会话视为过期
+UPLOAD_EXPIRE_HOURS = getattr(settings, 'RECORDING_UPLOAD_EXPIRE_HOURS', 24)
+
+# upload_id -> (已计入哈希的字节数, hashlib 对象, 最后使用时间)
+_hashers = {}
+_hashers_lock = threading.Lock()
+
+
+class UploadOffsetMismatch(Exception):
+    """分块偏移量与服务器已接收的字节数不一致"""
+
+
+class UploadSizeExceeded(Exception):
+    """分块超出了会话声明的文件总大小"""
+
+
+def reserve_recording_file(course_time, original_name):
+    """按 CourseTime.recording_path 的 upload_to 规则生成存储路径，并创建空文件占位"""
+    field = CourseTime._meta.get_field('recording_path')
+    name = field.generate_filename(course_time, os.path.basename(original_name))
+    name = default_storage.get_available_name(name, max_length=field.max_length)
+    
+    path = default_storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'xb'):
+        pass
+    return name
+
+
+def append_chunk(upload, stream, offset, length):
+    """
+    把请求流中的 length 字节写到文件的 offset 处
+    返回新的已接收字节数
+    """
+    if offset != upload.received_size:
+        raise UploadOffsetMismatch()
+    if offset + length > upload.total_size:
+        raise UploadSizeExceeded()
+    
+    key = str(upload.upload_id)
+    with _hashers_lock:
+        _prune_hashers()
+        hasher_state = _hashers.pop(key, None)
+    if hasher_state is None and offset == 0:
+        hasher_state = (0, hashlib.sha256(), None)
+    hasher = hasher_state[1] if hasher_state and hasher_state[0] == offset else None
+    
+    written = 0
+    with open(default_storage.path(upload.file_name), 'r+b') as f:
+        f.seek(offset)
+        while written < length:
+            buffer = stream.read(min(STREAM_BUFFER_SIZE, length - written))
+            if not buffer:
+                break
+            f.write(buffer)
+            if hasher is not None:
+                hasher.update(buffer)
+            written += len(buffer)
+    
+    new_size = offset + written
+    # 以已接收字节数作为条件更新，防止并发请求重复推进偏移量
+    updated = RecordingUploadSession.objects.filter(
+        pk=upload.pk, received_size=offset, status='uploading'
+    ).update(received_size=new_size)
+    if not updated:
+        raise UploadOffsetMismatch()
+    upload.received_size = new_size
+    
+    if hasher is not None:
+        with _hashers_lock:
+            _hashers[key] = (new_size, hasher, time.monotonic())
+    
+    return new_size
+
+
+def _prune_hashers():
+    """清理过期会话的哈希状态（调用方持有 _hashers_lock）"""
+    deadline = time.monotonic() - UPLOAD_EXPIRE_HOURS * 3600
+    for key in [key for key, state in _hashers.items() if state[2] < deadline]:
+        del _hashers[key]
+
+
+def finalize_sha256(upload):
+    """返回完整文件的 SHA256，进程内哈希状态不可用时从磁盘流式计算"""
+    key = str(upload.upload_id)
+    with _hashers_lock:
+        hasher_state = _hashers.pop(key, None)
+    if hasher_state and hasher_state[0] == upload.received_size:
+        return hasher_state[1].hexdigest()
+    
+    hasher = hashlib.sha256()
+    with open(default_storage.path(upload.file_name), 'rb') as f:
+        for buffer in iter(lambda: f.read(STREAM_BUFFER_SIZE), b''):
+            hasher.update(buffer)
+    return hasher.hexdigest()
+
+
+def discard_upload(upload):
+    """放弃上传：删除已写入的文件和进程内的哈希状态"""
+    with _hashers_lock:
+        _hashers.pop(str(upload.upload_id), None)
+    if upload.file_name and default_storage.exists(upload.file_name):
+        default_storage.delete(upload.file_name)
+
+
+def expire_stale_uploads():
+    """删除过期的未完成上传会话及其文件，返回删除的会话数"""
+    deadline = timezone.now() - timedelta(hours=UPLOAD_EXPIRE_HOURS)
+    expired = RecordingUploadSession.objects.filter(status='uploading', updated_at__lt=deadline)
+    count = 0
+    for upload in expired:
+        discard_upload(upload)
+        upload.delete()
+        count += 1
+    with _hashers_lock:
+        _prune_hashers()
+    return count
@@ -11,9 +11,13 @@ urlpatterns = [
     path('courses/<int:course_id>/start/', views.StartClassView.as_view(), name='start-class'),
     path('course-times/<int:course_time_id>/end/', views.EndClassView.as_view(), name='end-class'),
     path('course-times/<int:course_time_id>/upload-recording/', views.UploadCourseRecordingView.as_view(), name='upload-course-recording'),
+    path('course-times/<int:course_time_id>/recording-uploads/', views.RecordingUploadSessionCreateView.as_view(), name='recording-upload-create'),
+    path('recording-uploads/<uuid:upload_id>/', views.RecordingUploadSessionView.as_view(), name='recording-upload-session'),
+    path('recording-uploads/<uuid:upload_id>/complete/', views.RecordingUploadCompleteView.as_view(), name='recording-upload-complete'),
     
     # 新增路由
     path('courses/<int:course_id>/course-times/', views.CourseTimesListView.as_view(), name='course-times-list'),
     path('course-times/<int:course_time_id>/recording/', views.RecordingDetailView.as_view(), name='recording-detail'),
     path('course-times/<int:course_time_id>/stream/', views.StreamRecordingView.as_view(), name='stream-recording'),
+    path('course-times/<int:course_time_id>/hls/', views.HlsPlaylistView.as_view(), name='recording-hls'),
 ] 
\ No newline at end of file
@@ -1,7 +1,7 @@
 from django.shortcuts import render, get_object_or_404
 from django.http import HttpResponse, FileResponse
 from urllib.parse import quote
-from django.db.models import Q
+from django.db.models import Q, Case, When
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.pagination import PageNumberPagination
@@ -11,13 +11,24 @@ from rest_framework.response import Response
 from rest_framework import status
 from django.utils import timezone
 from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.conf import settings
+import logging
 import mimetypes
-import re
 
-from .models import Course, StudentCourse, CourseResource, CourseTime
+from .models import Course, StudentCourse, CourseResource, CourseTime, RecordingUploadSession
+from .uploads import (
+    reserve_recording_file, append_chunk, finalize_sha256, discard_upload,
+    UploadOffsetMismatch, UploadSizeExceeded, DEFAULT_CHUNK_SIZE, MAX_RECORDING_SIZE
+)
+from .streaming import ranged_file_response
+from .hls import HLS_SOURCES
 from .serializers import CourseListSerializer, CourseDetailSerializer, CourseResourceSerializer, CourseResourceDetailSerializer, CourseTimeSerializer, RecordingSerializer
 from user_management.utils import api_response
+from search.backends import search
+from search.models import SearchDocument
+
+logger = logging.getLogger(__name__)
 
 
 class StandardResultsSetPagination(PageNumberPagination):
@@ -178,10 +189,16 @@ class CourseResourceListView(APIView):
             resources = resources.filter(type=resource_type)
         
         if search_query:
-            resources = resources.filter(
-                Q(name__icontains=search_query) |
-                Q(description__icontains=search_query)
+            # 使用全文索引检索名称和描述，按相关度排序
+            matches = search(
+                SearchDocument.objects.filter(kind='resource', course=course), search_query, limit=None
             )
+            ranked_ids = [match['document'].object_id for match in matches]
+            resources = resources.filter(id__in=ranked_ids)
+            if ranked_ids:
+                resources = resources.order_by(
+                    Case(*[When(id=pk, then=rank) for rank, pk in enumerate(ranked_ids)])
+                )
         
         # 分页
         paginator = self.pagination_class()
@@ -597,7 +614,9 @@ class StartClassView(APIView):
                 "course_time_id": course_time.id,
                 "begin_time": course_time.begin_time,
                 "course_id": course.course_id,
-                "course_title": course.title
+                "course_title": course.title,
+                # 实时分析的推流地址，统计会写入本次课程时间记录
+                "analysis_ws_path": f"/ws/analysis/{course_time.id}/"
             }
         )
 
@@ -655,9 +674,19 @@ class EndClassView(APIView):
                 data=None
             )
         
-        # 更新结束时间
+        # 把正在推流的实时分析统计写入，下课后报告即可使用：
+        # 本进程中的连接立即写入，其他进程或节点上的连接通过 channel layer 通知后各自写入并断开
+        try:
+            from face_recognition.realtime import flush_live_sessions, notify_class_ended
+            flush_live_sessions(course_time.id)
+            notify_class_ended(course_time.id)
+            course_time.refresh_from_db(fields=['emotion_analysis_json'])
+        except Exception as e:
+            logger.error(f"写入实时分析统计失败: {e}")
+        
+        # 更新结束时间；只更新 end_time，不覆盖其他连接同时写入的分析结果
         course_time.end_time = timezone.now()
-        course_time.save()
+        course_time.save(update_fields=['end_time'])
         
         return api_response(
             code=200,
@@ -744,6 +773,267 @@ class UploadCourseRecordingView(APIView):
         )
 
 
+class RecordingUploadSessionCreateView(APIView):
+    """
+    创建录像分块上传会话API
+    大文件先创建会话，再用 PATCH 按偏移量逐块上传，最后调用 complete 完成
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request, course_time_id):
+        """创建分块上传会话"""
+        user = request.user
+        
+        # 检查用户是否为教师
+        if user.role != 'teacher':
+            return api_response(
+                code=403,
+                message="只有教师可以上传课程录像",
+                data=None
+            )
+        
+        # 获取课程时间记录
+        try:
+            course_time = CourseTime.objects.get(id=course_time_id)
+        except CourseTime.DoesNotExist:
+            return api_response(
+                code=404,
+                message="课程时间记录不存在",
+                data=None
+            )
+        
+        # 检查是否为该课程的教师
+        try:
+            teacher = user.teacher_profile
+            if course_time.teacher != teacher:
+                return api_response(
+                    code=403,
+                    message="您不是该课程的授课教师",
+                    data=None
+                )
+        except:
+            return api_response(
+                code=403,
+                message="教师信息获取失败",
+                data=None
+            )
+        
+        file_name = request.data.get('file_name')
+        try:
+            total_size = int(request.data.get('total_size'))
+        except (TypeError, ValueError):
+            total_size = None
+        
+        if not file_name or total_size is None or total_size <= 0:
+            return api_response(
+                code=400,
+                message="需要提供 file_name 和有效的 total_size",
+                data=None
+            )
+        
+        if total_size > MAX_RECORDING_SIZE:
+            return api_response(
+                code=400,
+                message="录像文件超过大小限制",
+                data={"max_size": MAX_RECORDING_SIZE}
+            )
+        
+        upload = RecordingUploadSession.objects.create(
+            course_time=course_time,
+            uploader=user,
+            original_name=os.path.basename(file_name),
+            file_name=reserve_recording_file(course_time, file_name),
+            total_size=total_size
+        )
+        
+        return api_response(
+            code=200,
+            message="上传会话创建成功",
+            data=self._session_data(upload)
+        )
+    
+    @staticmethod
+    def _session_data(upload):
+        return {
+            "upload_id": str(upload.upload_id),
+            "course_time_id": upload.course_time_id,
+            "offset": upload.received_size,
+            "total_size": upload.total_size,
+            "chunk_size": DEFAULT_CHUNK_SIZE,
+            "status": upload.status
+        }
+
+
+class RecordingUploadSessionView(APIView):
+    """
+    录像分块上传会话API
+    GET 查询已接收的偏移量（断点续传），PATCH 上传一个分块，DELETE 取消上传
+    PATCH 请求体为原始字节（application/octet-stream），请求头 Upload-Offset 为该分块的起始偏移量
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def _get_upload(self, request, upload_id):
+        upload = get_object_or_404(RecordingUploadSession, upload_id=upload_id)
+        if upload.uploader_id != request.user.id:
+            return None, api_response(
+                code=403,
+                message="您没有权限访问此上传会话",
+                data=None
+            )
+        return upload, None
+    
+    def get(self, request, upload_id):
+        """查询上传进度"""
+        upload, error_response = self._get_upload(request, upload_id)
+        if error_response:
+            return error_response
+        
+        return api_response(
+            code=200,
+            message="获取成功",
+            data=RecordingUploadSessionCreateView._session_data(upload)
+        )
+    
+    def patch(self, request, upload_id):
+        """上传一个分块"""
+        upload, error_response = self._get_upload(request, upload_id)
+        if error_response:
+            return error_response
+        
+        if upload.status != 'uploading':
+            return api_response(
+                code=400,
+                message="该上传会话已完成",
+                data=None
+            )
+        
+        try:
+            offset = int(request.META.get('HTTP_UPLOAD_OFFSET', ''))
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return api_response(
+                code=400,
+                message="需要提供有效的 Upload-Offset 请求头",
+                data=None
+            )
+        
+        if length <= 0:
+            return api_response(
+                code=400,
+                message="分块内容为空",
+                data=None
+            )
+        
+        try:
+            # 直接读取请求流，不经过 request.data，避免把分块整体读入内存
+            new_offset = append_chunk(upload, request.stream, offset, length)
+        except UploadOffsetMismatch:
+            upload.refresh_from_db(fields=['received_size'])
+            return api_response(
+                code=409,
+                message="分块偏移量与已上传大小不一致",
+                data={"offset": upload.received_size}
+            )
+        except UploadSizeExceeded:
+            return api_response(
+                code=400,
+                message="分块超出了声明的文件大小",
+                data={"offset": upload.received_size, "total_size": upload.total_size}
+            )
+        
+        return api_response(
+            code=200,
+            message="分块上传成功",
+            data={
+                "upload_id": str(upload.upload_id),
+                "offset": new_offset,
+                "total_size": upload.total_size
+            }
+        )
+    
+    def delete(self, request, upload_id):
+        """取消上传并删除已上传的数据"""
+        upload, error_response = self._get_upload(request, upload_id)
+        if error_response:
+            return error_response
+        
+        if upload.status == 'completed':
+            return api_response(
+                code=400,
+                message="已完成的上传不能取消",
+                data=None
+            )
+        
+        discard_upload(upload)
+        upload.delete()
+        
+        return api_response(
+            code=200,
+            message="上传已取消",
+            data=None
+        )
+
+
+class RecordingUploadCompleteView(APIView):
+    """
+    完成录像分块上传API
+    校验文件大小（及可选的 sha256），并将文件关联到 CourseTime.recording_path
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request, upload_id):
+        """完成上传"""
+        upload = get_object_or_404(
+            RecordingUploadSession.objects.select_related('course_time__course'),
+            upload_id=upload_id
+        )
+        if upload.uploader_id != request.user.id:
+            return api_response(
+                code=403,
+                message="您没有权限访问此上传会话",
+                data=None
+            )
+        
+        if upload.status == 'uploading':
+            if upload.received_size != upload.total_size:
+                return api_response(
+                    code=400,
+                    message="文件尚未上传完成",
+                    data={"offset": upload.received_size, "total_size": upload.total_size}
+                )
+            
+            sha256 = finalize_sha256(upload)
+            expected_sha256 = (request.data.get('sha256') or '').lower()
+            if expected_sha256 and expected_sha256 != sha256:
+                return api_response(
+                    code=400,
+                    message="文件校验失败",
+                    data={"sha256": sha256}
+                )
+            
+            upload.sha256 = sha256
+            upload.status = 'completed'
+            upload.save(update_fields=['sha256', 'status', 'updated_at'])
+            
+            # 文件已在最终位置，只需更新字段指向的路径
+            course_time = upload.course_time
+            course_time.recording_path.name = upload.file_name
+            course_time.save()
+        
+        course_time = upload.course_time
+        return api_response(
+            code=200,
+            message="课程录像上传成功",
+            data={
+                "course_time_id": course_time.id,
+                "recording_path": course_time.recording_path.url if course_time.recording_path else None,
+                "sha256": upload.sha256,
+                "course_id": course_time.course.course_id,
+                "course_title": course_time.course.title
+            }
+        )
+
+
 class CourseTimesListView(APIView):
     """
     课程时间列表视图
@@ -938,43 +1228,13 @@ class StreamRecordingView(APIView):
                 data=None
             )
         
-        # 获取文件大小
-        file_size = os.path.getsize(recording_path)
-        
         # 获取文件类型
         content_type, _ = mimetypes.guess_type(recording_path)
         if not content_type:
             content_type = 'application/octet-stream'
         
-        # 支持范围请求（用于视频播放）
-        range_header = request.META.get('HTTP_RANGE', '').strip()
-        range_match = re.search(r'bytes=(\d+)-(\d*)', range_header)
-        
-        if range_match:
-            start_byte = int(range_match.group(1))
-            end_byte = int(range_match.group(2)) if range_match.group(2) else file_size - 1
-            end_byte = min(end_byte, file_size - 1)
-            length = end_byte - start_byte + 1
-            
-            response = FileResponse(
-                open(recording_path, 'rb'),
-                status=206,
-                content_type=content_type
-            )
-            
-            response['Content-Length'] = str(length)
-            response['Content-Range'] = f'bytes {start_byte}-{end_byte}/{file_size}'
-            response.stream = True
-            response.start_byte = start_byte
-            
-        else:
-            # 完整文件请求
-            response = FileResponse(
-                open(recording_path, 'rb'),
-                content_type=content_type
-            )
-            response['Content-Length'] = str(file_size)
-            response.stream = True
+        # 支持范围请求（用于视频播放拖动），包括多范围和 If-Range
+        response = ranged_file_response(request, recording_path, content_type)
         
         # 设置Content-Disposition为inline以便在浏览器中直接播放
         response['Content-Disposition'] = 'inline; filename="{}"'.format(
@@ -985,3 +1245,73 @@ class StreamRecordingView(APIView):
         response['Accept-Ranges'] = 'bytes'
         
         return response
+
+
+class HlsPlaylistView(APIView):
+    """
+    HLS主播放列表视图
+    返回录像的主播放列表，其中的子播放列表和切片以静态文件方式提供
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, course_time_id):
+        """获取HLS主播放列表"""
+        # 查找课程时间记录
+        course_time = get_object_or_404(CourseTime, id=course_time_id)
+        
+        # 检查用户权限（必须是课程的教师或学生）
+        user = request.user
+        has_permission = False
+        
+        if user.role == 'teacher':
+            try:
+                teacher = user.teacher_profile
+                has_permission = (course_time.teacher == teacher or course_time.course.teacher == teacher)
+            except:
+                has_permission = False
+        elif user.role == 'student':
+            try:
+                student = user.student_profile
+                has_permission = StudentCourse.objects.filter(
+                    student=student, course=course_time.course
+                ).exists()
+            except:
+                has_permission = False
+        
+        if not has_permission:
+            return api_response(
+                code=403,
+                message="您没有权限播放此录像",
+                data=None
+            )
+        
+        source = request.query_params.get('type', 'processed')
+        if source not in HLS_SOURCES:
+            return api_response(
+                code=400,
+                message="type 只能是 processed 或 raw",
+                data=None
+            )
+        
+        playlist_name = (course_time.hls_playlists or {}).get(source)
+        if not playlist_name or not default_storage.exists(playlist_name):
+            return api_response(
+                code=404,
+                message="该录像尚未生成HLS切片",
+                data=None
+            )
+        
+        with default_storage.open(playlist_name, 'rb') as f:
+            lines = f.read().decode('utf-8').splitlines()
+        
+        # 把子播放列表的相对路径改写为媒体文件的绝对URL
+        playlist_dir = os.path.dirname(playlist_name)
+        rewritten = []
+        for line in lines:
+            if line and not line.startswith('#'):
+                line = request.build_absolute_uri(default_storage.url(f'{playlist_dir}/{line}'))
+            rewritten.append(line)
+        
+        response = HttpResponse('\n'.join(rewritten) + '\n', content_type='application/vnd.apple.mpegurl')
+        response['Cache-Control'] = 'private, max-age=60'
+        return response
@@ -1,8 +1,13 @@
 from django.contrib import admin
-from .models import Face
+from .models import Face, FaceGalleryChange
 
 # Register your models here.
 @admin.register(Face)
 class FaceAdmin(admin.ModelAdmin):
     list_display = ('id', 'name')
     search_fields = ('name',)
+
+@admin.register(FaceGalleryChange)
+class FaceGalleryChangeAdmin(admin.ModelAdmin):
+    list_display = ('id', 'face_id', 'action', 'created_at')
+    list_filter = ('action',)
@@ -8,6 +8,9 @@ class FaceRecognitionConfig(AppConfig):
     name = 'face_recognition'
     
     def ready(self):
+        # 注册人脸库变更信号
+        import face_recognition.signals
+        
         # 避免在管理命令中运行
         if 'runserver' not in sys.argv and 'uwsgi' not in sys.argv and 'gunicorn' not in sys.argv:
             return
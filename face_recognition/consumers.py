@@ -0,0 +1,143 @@
+import json
+import logging
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.db import database_sync_to_async
+from chat.auth import JWTAuthMixin
+from .pipeline import (
+    LatestFrameSlot, _flush_in_executor, finish_session, handle_text_message, run_inference, start_frame_workers,
+    stop_frame_workers
+)
+from .realtime import AnalysisSession, authorized_course_time_id, course_time_group_name
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisConsumer(JWTAuthMixin, AsyncWebsocketConsumer):
+    """
+    课堂摄像头的实时分析
+    与聊天相同的 JWT 认证，只有课程的教师可以推流；推理在共享线程池中执行，
+    协议与 websocket_server.py 相同（JSON 的 video_frame 或二进制帧）；
+    连接加入课程时间的群组，下课时（EndClassView）无论连接在哪个进程都会收到通知并写入统计
+    """
+
+    async def connect(self):
+        self.user = None
+        self.session = None
+        self.workers = []
+        self.group_name = None
+        self.course_time_id = self.scope['url_route']['kwargs']['course_time_id']
+
+        token = self.get_query_token()
+        if token:
+            if not await self.authenticate(token):
+                logger.error("Authentication failed via URL parameter")
+                await self.close()  # 拒绝连接
+                return
+            await self.accept()
+            await self.start_session()
+            return
+
+        # 如果没有 token，接受连接但等待认证消息
+        await self.accept()
+
+    async def start_session(self):
+        """认证成功后检查权限并创建分析会话"""
+        course_time_id = await self.bind_course_time(self.course_time_id)
+        if course_time_id is None:
+            await self.send(json.dumps({'type': 'error', 'message': '您没有权限分析此课程'}))
+            await self.close(code=4403)
+            return
+
+        # 每个连接一个会话，接收循环只把帧放进帧槽，由固定数量的处理任务取最新的帧
+        # 多个摄像头推流到同一课堂时用 ?camera= 区分，统计按摄像头融合
+        self.session = AnalysisSession(course_time_id, camera=self.get_query_param('camera'))
+        self.slot = LatestFrameSlot()
+        self.workers = start_frame_workers(self.session, self.slot, self.send_result)
+        await self.join_course_time_group()
+        await self.send(json.dumps({
+            'type': 'authentication_successful',
+            'message': '认证成功',
+            'course_time_id': course_time_id
+        }))
+
+    async def disconnect(self, close_code):
+        if self.group_name is not None:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        await stop_frame_workers(self.workers)
+        if self.session is None:
+            return
+        # 把本连接的统计写入课程时间记录
+        try:
+            await database_sync_to_async(finish_session)(self.session)
+        except Exception as e:
+            logger.error(f"写入课程时间记录失败: {e}")
+
+    async def receive(self, text_data=None, bytes_data=None):
+        # 二进制消息：头 + 元数据 + 原始JPEG
+        if bytes_data is not None:
+            if self.session is None:
+                await self.close(code=4401)
+                return
+            self.slot.put(('binary', bytes_data, None))
+            return
+
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            await self.send(json.dumps({'type': 'error', 'message': '无效的JSON格式'}))
+            return
+
+        # 如果用户未认证，只接受认证消息
+        if self.session is None:
+            if self.user is None and data.get('type') == 'authentication':
+                token = data.get('token', '').replace('Bearer ', '')
+                if await self.authenticate(token):
+                    await self.start_session()
+                    return
+                await self.send(json.dumps({'type': 'authentication_failed', 'message': '认证失败'}))
+            else:
+                await self.send(json.dumps({'type': 'error', 'message': '未认证'}))
+            await self.close()
+            return
+
+        try:
+            reply = await handle_text_message(self.session, self.slot, data, self.bind_course_time)
+        except Exception as e:
+            logger.error(f"Error in receive: {str(e)}")
+            reply = {'error': str(e)}
+        if reply is not None:
+            await self.send(json.dumps(reply))
+        # hello 消息可能把会话绑定到另一个课程时间
+        await self.join_course_time_group()
+
+    async def join_course_time_group(self):
+        """加入会话当前绑定的课程时间的群组，以接收下课通知"""
+        group_name = course_time_group_name(self.session.course_time_id)
+        if group_name == self.group_name:
+            return
+        if self.group_name is not None:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        self.group_name = group_name
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+
+    async def analysis_class_ended(self, event):
+        """课程已结束：立即写入本连接的统计，通知客户端后断开"""
+        if self.session is None or self.session.course_time_id != event['course_time_id']:
+            return
+        try:
+            await run_inference(_flush_in_executor, self.session)
+        except Exception as e:
+            logger.error(f"写入课程时间记录失败: {e}")
+        await self.send(json.dumps({'type': 'class_ended', 'course_time_id': event['course_time_id']}))
+        await self.close()
+
+    async def send_result(self, result):
+        if isinstance(result, bytes):
+            await self.send(bytes_data=result)
+        else:
+            await self.send(text_data=json.dumps(result))
+
+    @database_sync_to_async
+    def bind_course_time(self, course_time_id):
+        """当前用户是该课程时间对应课程的教师时返回课程时间ID，否则返回 None"""
+        return authorized_course_time_id(self.user, course_time_id)
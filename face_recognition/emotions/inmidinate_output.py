@@ -247,7 +247,8 @@ class StatusLogger:
         if hasattr(self, 'log_file') and self.log_file:
             self.log_file.close()
 
-def process_frame(frame, target_feats, target_names, student_name, similarity_threshold=0.40):
+def process_frame(frame, target_feats, target_names, student_name, similarity_threshold=0.40,
+                  detections=None, draw=True, status_logger=None, collector=None, target_ids=None):
     """
     处理视频帧，检测人脸并实时输出匹配结果。
 
@@ -257,11 +258,19 @@ def process_frame(frame, target_feats, target_names, student_name, similarity_th
         target_names (list): 目标人脸名字列表。
         student_name (set): 用于收集识别到的学生名称的集合。
         similarity_threshold (float): 相似度阈值，默认 0.40 (降低阈值以提高匹配概率)。
+        detections (list): 可选，传入时追加每张人脸的结构化结果（人脸框、名字、相似度、状态）。
+        draw (bool): 是否在帧上绘制人脸框和标签，由客户端自己绘制时传 False。
+        status_logger / collector: 可选，替代模块级的日志记录器和数据收集器，实时分析时每个连接各用一份。
+        target_ids (list): 可选，与 target_names 对应的人脸库ID，匹配到时以 face_id 写入状态和结构化结果，
+            重名的学生靠它区分。
 
     返回:
-        frame (np.ndarray): 绘制了人脸框和标签的视频帧。
+        frame (np.ndarray): 绘制了人脸框和标签的视频帧（draw 为 False 时是原帧）。
     """
 
+    status_logger = status_logger or logger
+    collector = collector or data_collector
+
     # 如果 frame 为 None，直接返回原帧
     if frame is None:
         print("警告：frame 为 None")
@@ -289,7 +298,8 @@ def process_frame(frame, target_feats, target_names, student_name, similarity_th
         if not faces:
             print("未检测到人脸")
             # 在帧上添加提示文字
-            cv2.putText(frame, "No Face Detected", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+            if draw:
+                cv2.putText(frame, "No Face Detected", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
             
             # 在日志中添加一个默认记录，确保有统计数据
             status_data = {
@@ -297,7 +307,7 @@ def process_frame(frame, target_feats, target_names, student_name, similarity_th
                 'name': '未识别',
                 'main_status': 'No Face Detected'
             }
-            logger.log_status(status_data)
+            status_logger.log_status(status_data)
             
             return frame  # 如果没有检测到人脸，直接返回原帧
 
@@ -309,7 +319,8 @@ def process_frame(frame, target_feats, target_names, student_name, similarity_th
         if len(target_feats) == 0 or len(target_names) == 0:
             print("警告：目标特征为空，无法进行匹配")
             # 在帧上添加提示文字
-            cv2.putText(frame, "No target features", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+            if draw:
+                cv2.putText(frame, "No target features", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
             
             # 强制添加默认人脸，确保有日志
             status_data = {
@@ -317,12 +328,13 @@ def process_frame(frame, target_feats, target_names, student_name, similarity_th
                 'name': '数据库为空',  # 这个名称会被记录
                 'main_status': 'No Target Features'
             }
-            logger.log_status(status_data)
+            status_logger.log_status(status_data)
             student_name.add('数据库为空')
             
             # 仍然继续处理，但不进行匹配
             target_feats = []
             target_names = []
+            target_ids = None
         
         # 提取检测到的人脸特征向量
         feats = np.array([face.normed_embedding for face in faces], dtype=np.float32)
@@ -330,24 +342,25 @@ def process_frame(frame, target_feats, target_names, student_name, similarity_th
         # 初始化匹配标志
         matched = False
 
-        # 将 OpenCV 图像转换为 PIL 图像
-        frame_pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        draw = ImageDraw.Draw(frame_pil)
+        if draw:
+            # 将 OpenCV 图像转换为 PIL 图像
+            frame_pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            pil_draw = ImageDraw.Draw(frame_pil)
 
-        # 加载中文字体
-        font_path = os.path.join(os.path.dirname(__file__), "simsun.ttc")  # 替换为你的中文字体文件路径
-        # 如果字体文件不存在，使用默认字体
-        if not os.path.exists(font_path):
-            # 尝试使用系统字体
-            try:
-                font = ImageFont.truetype("simhei.ttf", 12)  # 尝试使用黑体
-            except:
+            # 加载中文字体
+            font_path = os.path.join(os.path.dirname(__file__), "simsun.ttc")  # 替换为你的中文字体文件路径
+            # 如果字体文件不存在，使用默认字体
+            if not os.path.exists(font_path):
+                # 尝试使用系统字体
                 try:
-                    font = ImageFont.truetype("kaiti.ttf", 12)  # 尝试使用楷体
+                    font = ImageFont.truetype("simhei.ttf", 12)  # 尝试使用黑体
                 except:
-                    font = ImageFont.load_default()  # 最后使用默认字体
-        else:
-            font = ImageFont.truetype(font_path, 12)  # 字体大小
+                    try:
+                        font = ImageFont.truetype("kaiti.ttf", 12)  # 尝试使用楷体
+                    except:
+                        font = ImageFont.load_default()  # 最后使用默认字体
+            else:
+                font = ImageFont.truetype(font_path, 12)  # 字体大小
 
         # 遍历所有检测到的人脸
         for i, face in enumerate(faces):
@@ -387,6 +400,7 @@ def process_frame(frame, target_feats, target_names, student_name, similarity_th
                 # 初始化匹配信息
                 match_found = False
                 target_name = "unknown"
+                target_id = None
                 max_similarity = 0.40  # 降低初始阈值
                 
                 # 如果有目标特征，进行对比
@@ -400,6 +414,7 @@ def process_frame(frame, target_feats, target_names, student_name, similarity_th
                             if max_similarity > similarity_threshold:
                                 match_found = True
                                 target_name = target_names[j]
+                                target_id = target_ids[j] if target_ids is not None else None
                                 matched = True  # 标记为找到匹配项
                 
                 # 检测到存在于数据库中的人脸，即阈值大于similarity_threshold的人脸
@@ -412,11 +427,12 @@ def process_frame(frame, target_feats, target_names, student_name, similarity_th
                 status_data = {
                     'id': i,
                     'name': target_name,
+                    'face_id': target_id,
                     'main_status': status_emotions['main_status']
                 }
                 
                 # 更新数据收集器
-                data_collector.update_status(status_data)
+                collector.update_status(status_data)
                 
                 # 强制记录日志 - 即使是未知人脸也记录
                 if status_data['name'] == 'unknown':
@@ -427,28 +443,42 @@ def process_frame(frame, target_feats, target_names, student_name, similarity_th
                 # 强制将每个处理过的人脸写入日志，不管之前是否记录过
                 print(f"强制记录人脸{i}的日志 - 名称:{status_data['name']}, 状态:{status_data['main_status']}")
                 try:
-                    logger.log_status(status_data)
+                    status_logger.log_status(status_data)
                 except Exception as e:
                     print(f"记录人脸{i}日志失败: {str(e)}")
                     # 尝试直接写入日志
                     try:
-                        if hasattr(logger, 'log_file') and logger.log_file and not logger.log_file.closed:
+                        if hasattr(status_logger, 'log_file') and status_logger.log_file and not status_logger.log_file.closed:
                             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
                             log_entry = (f"{timestamp} - "
                                         f"ID: {i} | "
                                         f"Name: {status_data['name']} | "
                                         f"Status: {status_data['main_status']}\n")
-                            logger.log_file.write(log_entry)
-                            logger.log_file.flush()
+                            status_logger.log_file.write(log_entry)
+                            status_logger.log_file.flush()
                             print(f"直接写入日志成功: {log_entry.strip()}")
                     except Exception as nested_e:
                         print(f"直接写入日志也失败: {str(nested_e)}")
+                
+                # 结构化结果，供客户端自行绘制
+                if detections is not None:
+                    detections.append({
+                        'id': i,
+                        'bbox': [x1, y1, x2, y2],
+                        'name': target_name if match_found else None,
+                        'face_id': target_id,
+                        'similarity': round(float(max_similarity), 4),
+                        'status': status_emotions['main_status'],
+                    })
+                
+                if not draw:
+                    continue
                     
                 # 绘制人脸框
                 frame = app.draw_on(frame, [face])
         
                 # 在人脸框上方添加名字和相似度
-                draw.text(
+                pil_draw.text(
                     (bbox[0], bbox[1] - 40),  # 文字位置
                     label,  # 名字和相似度
                     font=font,  # 字体
@@ -459,12 +489,14 @@ def process_frame(frame, target_feats, target_names, student_name, similarity_th
                 continue
 
         # 将 PIL 图像转换回 OpenCV 图像
-        frame = cv2.cvtColor(np.array(frame_pil), cv2.COLOR_RGB2BGR)
+        if draw:
+            frame = cv2.cvtColor(np.array(frame_pil), cv2.COLOR_RGB2BGR)
 
     except Exception as e:
         print(f"处理视频帧时出错: {str(e)}")
         # 在帧上添加错误信息
-        cv2.putText(frame, f"Error: {str(e)}", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+        if draw:
+            cv2.putText(frame, f"Error: {str(e)}", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
     
     return frame
 
@@ -0,0 +1,85 @@
+"""
+多摄像头课堂的录像分析
+
+大教室有两三个摄像头时，每个摄像头的录像分别分析，观测结果按摄像头写入同一个 CourseTime，
+由 realtime.fuse_cameras 按人脸库身份（face_id）和时间段融合，同一个学生不会被重复统计。
+录像内的时间以录像开始时间为起点换算成绝对时间，与实时推流和其他摄像头的时间段对齐。
+开启推理进程池（REALTIME_WORKER_PROCESSES）时识别交给推理进程并行执行，否则在本进程中由 inference_lock 串行。
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from .realtime import AnalysisSession, StatusAggregator
+
+logger = logging.getLogger(__name__)
+
+# 每隔几帧识别一次，与 process_emotion_recognition 保持一致
+FRAME_STEP = 2
+
+
+def analyze_recording(course_time, camera, path, started_at=None, frame_step=FRAME_STEP):
+    """
+    分析一个摄像头的录像，观测结果按该摄像头写入课程时间记录
+    没有指定录像开始时间（started_at）时以课程开始时间对齐，返回识别的帧数
+    """
+    from .pipeline import _fit_slot, _infer_local
+    from .worker_pool import get_worker_pool
+
+    started_at = started_at or course_time.begin_time
+    if started_at is None:
+        raise ValueError(f"摄像头 {camera} 的录像没有开始时间，课程也没有开始时间")
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError(f"无法打开视频文件: {path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+
+    # 状态记录的时间取录像内的时间
+    frame_index = 0
+    origin = started_at.timestamp()
+    aggregator = StatusAggregator(clock=lambda: origin + frame_index / fps)
+    session = AnalysisSession(course_time.id, camera=camera, aggregator=aggregator)
+    pool = get_worker_pool()
+    analyzed = 0
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if frame_index % frame_step == 0:
+                if pool is not None:
+                    # 推理进程中的统计以录像内的时间记录，结束时取回
+                    pool.infer(session.key, _fit_slot(frame), True, timestamp=origin + frame_index / fps)
+                else:
+                    _infer_local(session, frame, True)
+                analyzed += 1
+            frame_index += 1
+    finally:
+        cap.release()
+        if pool is not None:
+            session.aggregator.restore(pool.close(session.key))
+
+    session.flush()
+    logger.info(f"摄像头 {camera} 的录像分析完成，识别了 {analyzed} 帧")
+    return analyzed
+
+
+def analyze_recordings(course_time, recordings):
+    """
+    并行分析同一课堂多个摄像头的录像，recordings 为 [(camera, path, started_at), ...]，返回 {camera: 识别的帧数}
+    每个摄像头一个线程，解码和跟踪并行执行；模型推理在开启推理进程池时由各推理进程并行执行，
+    否则由 pipeline.inference_lock 串行
+    """
+    from django.db import connection
+
+    def run(recording):
+        try:
+            return analyze_recording(course_time, *recording)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=len(recordings) or 1, thread_name_prefix='camera') as executor:
+        results = executor.map(run, recordings)
+        return {recording[0]: analyzed for recording, analyzed in zip(recordings, results)}
@@ -0,0 +1,75 @@
+"""
+可热更新的人脸库
+
+Gallery 是某个版本的人脸库快照（只读），包含特征矩阵和对应的名字。
+refresh_gallery 根据 FaceGalleryChange 增量读取变化的人脸，返回新的快照；
+调用方只需替换对快照的引用，正在处理的帧继续使用旧快照，不受影响。
+注意：QuerySet.update()、bulk_create() 等批量操作不会触发信号，需要手动调用 record_gallery_change。
+"""
+import numpy as np
+
+from .models import Face, FaceGalleryChange
+
+
+class Gallery:
+    """某个版本的人脸库快照"""
+
+    def __init__(self, version, entries):
+        self.version = version
+        # face_id -> (name, feat)
+        self.entries = entries
+        ids = sorted(entries)
+        self.face_ids = ids
+        self.names = [entries[face_id][0] for face_id in ids]
+        if ids:
+            self.feats = np.vstack([entries[face_id][1] for face_id in ids]).astype(np.float32)
+        else:
+            self.feats = np.zeros((0, 0), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.face_ids)
+
+
+def _feat(face):
+    return np.frombuffer(bytes(face.feat), dtype=np.float32)
+
+
+def current_gallery_version():
+    """人脸库当前的版本号"""
+    latest = FaceGalleryChange.objects.order_by('-id').values_list('id', flat=True).first()
+    return latest or 0
+
+
+def load_gallery():
+    """全量加载人脸库"""
+    # 先取版本号再读人脸：读取期间发生的变更会在下次刷新时重新应用
+    version = current_gallery_version()
+    entries = {face.id: (face.name, _feat(face)) for face in Face.objects.all()}
+    return Gallery(version, entries)
+
+
+def refresh_gallery(gallery):
+    """
+    增量刷新人脸库
+    没有变化时原样返回，有变化时只读取变化的人脸并返回新的快照
+    """
+    changes = list(
+        FaceGalleryChange.objects.filter(id__gt=gallery.version).values_list('id', 'face_id')
+    )
+    if not changes:
+        return gallery
+
+    version = max(change_id for change_id, _ in changes)
+    changed_ids = {face_id for _, face_id in changes}
+    entries = {face_id: entry for face_id, entry in gallery.entries.items() if face_id not in changed_ids}
+    # 以数据库中的当前状态为准：仍存在的是新增或更新，不存在的是删除
+    for face in Face.objects.filter(id__in=changed_ids):
+        entries[face.id] = (face.name, _feat(face))
+    return Gallery(version, entries)
+
+
+def record_gallery_change(face_ids, action=FaceGalleryChange.ACTION_UPSERT):
+    """批量操作后手动记录人脸库变更"""
+    FaceGalleryChange.objects.bulk_create([
+        FaceGalleryChange(face_id=face_id, action=action) for face_id in face_ids
+    ])
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+from course_management.models import CourseTime
+from face_recognition.fusion import analyze_recordings
+
+
+class Command(BaseCommand):
+    help = (
+        '并行分析同一课堂多个摄像头的录像，按人脸身份和时间融合为一份统计。'
+        '开启 REALTIME_WORKER_PROCESSES 时识别在推理进程池中并行执行，否则在本进程中串行推理'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_time_id', type=int, help='课程时间ID')
+        parser.add_argument(
+            'recordings', nargs='+',
+            help='摄像头录像，格式为 camera=路径 或 camera=路径@开始时间（ISO格式，不指定时使用课程开始时间）'
+        )
+
+    def handle(self, *args, **options):
+        course_time = CourseTime.objects.filter(id=options['course_time_id']).first()
+        if course_time is None:
+            raise CommandError(f"课程时间 {options['course_time_id']} 不存在")
+        
+        recordings = []
+        for value in options['recordings']:
+            camera, sep, path = value.partition('=')
+            if not sep or not camera or not path:
+                raise CommandError(f'无效的录像参数: {value}')
+            started_at = None
+            if '@' in path:
+                path, started = path.rsplit('@', 1)
+                started_at = parse_datetime(started)
+                if started_at is None:
+                    raise CommandError(f'无效的开始时间: {started}')
+                if timezone.is_naive(started_at):
+                    started_at = timezone.make_aware(started_at)
+            recordings.append((camera, path, started_at))
+        
+        for camera, analyzed in analyze_recordings(course_time, recordings).items():
+            self.stdout.write(self.style.SUCCESS(f'摄像头 {camera}: 识别了 {analyzed} 帧'))
+        
+        course_time.refresh_from_db()
+        attendance = (course_time.emotion_analysis_json or {}).get('attendance', {})
+        self.stdout.write(self.style.SUCCESS(f'课程时间 {course_time.id}: 融合后共 {len(attendance)} 名学生'))
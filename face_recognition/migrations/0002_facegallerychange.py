@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('face_recognition', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaceGalleryChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('face_id', models.IntegerField(db_index=True, verbose_name='人脸ID')),
+                ('action', models.CharField(choices=[('upsert', '新增或更新'), ('delete', '删除')], max_length=10, verbose_name='操作')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='变更时间')),
+            ],
+            options={
+                'verbose_name': '人脸库变更',
+                'verbose_name_plural': '人脸库变更',
+                'ordering': ['id'],
+            },
+        ),
+    ]
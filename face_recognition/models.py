@@ -11,3 +11,30 @@ class Face(models.Model):
         
     def __str__(self):
         return self.name
+
+
+class FaceGalleryChange(models.Model):
+    """
+    人脸库变更记录
+    每次新增、更新或删除人脸都会追加一条记录，自增ID即人脸库的版本号，
+    实时分析服务据此增量加载变化的人脸，无需重启
+    """
+    ACTION_UPSERT = 'upsert'
+    ACTION_DELETE = 'delete'
+    ACTION_CHOICES = (
+        (ACTION_UPSERT, '新增或更新'),
+        (ACTION_DELETE, '删除'),
+    )
+    
+    id = models.BigAutoField(primary_key=True)
+    face_id = models.IntegerField(verbose_name='人脸ID', db_index=True)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES, verbose_name='操作')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='变更时间')
+    
+    class Meta:
+        verbose_name = '人脸库变更'
+        verbose_name_plural = verbose_name
+        ordering = ['id']
+    
+    def __str__(self):
+        return f"v{self.id} {self.action} #{self.face_id}"
@@ -0,0 +1,503 @@
+"""
+实时分析的推理流水线
+
+独立的 websocket_server.py 和 Channels 的 AnalysisConsumer 共用这里的代码：
+共享的推理线程池、人脸库快照、只保留最新帧的帧槽，以及单帧的解码、识别和编码。
+情绪识别模块在第一次推理时才导入，避免 ASGI 进程启动时就加载模型。
+
+采集参数协商：hello 的回复和每帧结果中的 capture 字段给出建议的采集宽度、JPEG质量、帧率和实测处理耗时，
+客户端据此调整摄像头采集和编码参数。
+"""
+import asyncio
+import base64
+import logging
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+
+from .frame_protocol import KIND_FRAME, FrameProtocolError, pack_result, protocol_info, unpack_message
+from .gallery import Gallery, load_gallery, refresh_gallery
+from .realtime import (
+    RESULT_MODE_IMAGE, RESULT_MODE_METADATA, RESULT_MODES, register_live_session, unregister_live_session
+)
+from .worker_pool import SLOT_BYTES, get_worker_pool
+
+logger = logging.getLogger(__name__)
+
+# 推理线程池大小：解码、推理和编码都在这里执行，避免阻塞事件循环
+INFERENCE_WORKERS = getattr(settings, 'REALTIME_INFERENCE_WORKERS', None) or min(4, os.cpu_count() or 1)
+# 每个连接同时在处理中的帧数上限，处理不过来时只保留最新的一帧，其余丢弃
+MAX_IN_FLIGHT_PER_CONNECTION = getattr(settings, 'REALTIME_MAX_IN_FLIGHT_PER_CONNECTION', 2)
+# 是否在结果中建议客户端的发送帧率，以及建议帧率的上限
+ADVISE_TARGET_FPS = getattr(settings, 'REALTIME_ADVISE_TARGET_FPS', True)
+MAX_ADVISED_FPS = getattr(settings, 'REALTIME_MAX_ADVISED_FPS', 15)
+# 单帧处理耗时的目标（毫秒），超过时建议客户端降低采集宽度和JPEG质量，明显低于时再逐级恢复
+TARGET_LATENCY_MS = getattr(settings, 'REALTIME_TARGET_LATENCY_MS', 200)
+# 建议的采集档位，从高到低排列
+CAPTURE_PROFILES = getattr(settings, 'REALTIME_CAPTURE_PROFILES', [
+    {'width': 640, 'jpeg_quality': 80},
+    {'width': 480, 'jpeg_quality': 70},
+    {'width': 320, 'jpeg_quality': 60},
+])
+# 上课期间统计写入课程时间记录的间隔（秒）
+FLUSH_SECONDS = getattr(settings, 'REALTIME_FLUSH_SECONDS', 30)
+# 人脸库版本的检查间隔（秒）
+GALLERY_POLL_SECONDS = getattr(settings, 'REALTIME_GALLERY_POLL_SECONDS', 5)
+# 送入识别的最大宽度
+MAX_FRAME_WIDTH = 640
+JPEG_QUALITY = 75
+
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix='inference')
+# 人脸网格检测器是全局共享的，不是线程安全的，推理本身串行执行；解码、缩放和编码仍在多个线程中并行
+inference_lock = threading.Lock()
+
+
+def _detect_cuda():
+    try:
+        if cv2.cuda.getCudaEnabledDeviceCount() > 0:
+            cv2.cuda.setDevice(0)
+            return cv2.cuda.Stream()
+    except Exception as e:
+        logger.warning(f"CUDA不可用，将使用CPU模式: {e}")
+    return None
+
+
+cuda_stream = _detect_cuda()
+
+
+def _process_frame(*args, **kwargs):
+    # 延迟导入：导入时会加载 insightface 模型
+    from .emotions.inmidinate_output import process_frame
+    return process_frame(*args, **kwargs)
+
+
+class GalleryHolder:
+    """
+    持有当前的人脸库快照
+    get() 超过检查间隔时增量刷新，有变化时整体替换引用，正在处理的帧继续使用旧快照
+    """
+
+    def __init__(self, poll_seconds=GALLERY_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self.gallery = None
+        self._checked_at = float('-inf')
+        self._lock = threading.Lock()
+
+    def get(self):
+        if time.monotonic() - self._checked_at >= self.poll_seconds:
+            # 只让一个线程去查询，其他线程直接使用当前快照
+            if self._lock.acquire(blocking=self.gallery is None):
+                try:
+                    self.reload()
+                finally:
+                    self._lock.release()
+        return self.gallery or EMPTY_GALLERY
+
+    def reload(self):
+        """立即检查人脸库版本，返回当前快照"""
+        # 推理线程长期存在，查询前清理失效的数据库连接
+        close_old_connections()
+        try:
+            if self.gallery is None:
+                self.gallery = load_gallery()
+                logger.info(f"加载了 {len(self.gallery)} 个人脸特征向量，人脸库版本 {self.gallery.version}")
+            else:
+                refreshed = refresh_gallery(self.gallery)
+                if refreshed is not self.gallery:
+                    logger.info(f"人脸库已更新到版本 {refreshed.version}，共 {len(refreshed)} 个人脸")
+                    self.gallery = refreshed
+        except Exception as e:
+            # 加载失败时沿用当前快照（或空的人脸库），下次检查时重试
+            logger.error(f"加载人脸库失败: {e}")
+        self._checked_at = time.monotonic()
+        return self.gallery or EMPTY_GALLERY
+
+
+EMPTY_GALLERY = Gallery(0, {})
+gallery_holder = GalleryHolder()
+
+
+async def run_inference(func, *args):
+    """把解码、推理和编码放到共享线程池执行，事件循环只负责收发消息"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(inference_executor, func, *args)
+
+
+def _resize(frame):
+    """缩小图像尺寸以提高处理速度，优先使用CUDA"""
+    height, width = frame.shape[:2]
+    if width <= MAX_FRAME_WIDTH:
+        return frame
+    size = (MAX_FRAME_WIDTH, int(height * MAX_FRAME_WIDTH / width))
+    if cuda_stream is not None:
+        try:
+            gpu_frame = cv2.cuda_GpuMat()
+            gpu_frame.upload(frame)
+            return cv2.cuda.resize(gpu_frame, size, interpolation=cv2.INTER_AREA, stream=cuda_stream).download()
+        except Exception as e:
+            logger.warning(f"CUDA图像缩放失败，回退到CPU: {e}")
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+
+def _fit_slot(frame):
+    """竖屏等特别高的图像超过推理进程的帧槽容量时继续缩小"""
+    if frame.nbytes <= SLOT_BYTES:
+        return frame
+    scale = (SLOT_BYTES / frame.nbytes) ** 0.5
+    size = (max(1, int(frame.shape[1] * scale)), max(1, int(frame.shape[0] * scale)))
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+
+def _infer_local(session, frame, metadata_only):
+    """在当前进程中识别，跟踪器和统计记录到连接自己的会话中"""
+    # 整帧使用同一个人脸库快照，刷新时不受影响
+    gallery = gallery_holder.get()
+    student_set = set()
+    detections = []
+    with inference_lock:
+        processed_frame = _process_frame(
+            frame, gallery.feats, gallery.names, student_set, similarity_threshold=0.45,
+            detections=detections, draw=not metadata_only,
+            status_logger=session.aggregator, collector=session.aggregator, target_ids=gallery.face_ids
+        )
+
+    # 更新会话的跟踪器、识别到的学生和统计，每3帧附带一次完整统计
+    result = {
+        "face_count": len(student_set),
+        "students_detected": list(student_set),
+    }
+    if session.record_frame(detections, student_set):
+        result["all_recognized_students"] = list(session.recognized_students)
+        result["emotion_stats"] = session.last_emotion_stats
+    # 每张人脸的结构化结果
+    result["faces"] = detections
+    return result, processed_frame
+
+
+def analyze_frame(session, img_data, result_mode=RESULT_MODE_IMAGE):
+    """
+    识别一帧JPEG图像，识别结果记录到连接自己的会话中
+    返回 (结果字典, 处理后的JPEG字节)；出错或只返回结构化结果时JPEG字节为None
+    """
+    try:
+        frame = cv2.imdecode(np.frombuffer(img_data, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            logger.error("无法解码图像数据")
+            return {"error": "无法解码图像数据"}, None
+        frame = _resize(frame)
+
+        metadata_only = result_mode == RESULT_MODE_METADATA
+        pool = get_worker_pool()
+        try:
+            if pool is not None:
+                # 帧通过共享内存交给该连接所在的推理进程，跟踪器和统计也保存在那里
+                frame = _fit_slot(frame)
+                result, processed_frame = pool.infer(session.key, frame, metadata_only)
+            else:
+                result, processed_frame = _infer_local(session, frame, metadata_only)
+        except Exception as e:
+            logger.error(f"处理图像时出错: {e}")
+            logger.error(traceback.format_exc())
+            return {"error": f"处理图像失败: {str(e)}"}, None
+
+        # 人脸框坐标对应 frame_size 尺寸的图像
+        result["frame_size"] = [frame.shape[1], frame.shape[0]]
+
+        # 只返回结构化结果时由客户端在原始画面上绘制，省去编码和回传图像
+        if metadata_only or processed_frame is None:
+            return result, None
+
+        _, buffer = cv2.imencode('.jpg', processed_frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        return result, buffer.tobytes()
+    except Exception as e:
+        logger.error(f"处理视频帧时发生错误: {e}")
+        logger.error(traceback.format_exc())
+        return {"error": str(e)}, None
+
+
+def reset_session(session):
+    """清空连接的会话数据，包括推理进程中的跟踪器和统计"""
+    session.reset()
+    pool = get_worker_pool()
+    if pool is not None:
+        pool.reset(session.key)
+
+
+def flush_session(session):
+    """把会话中尚未写入的统计（包括推理进程中的）合并写入课程时间记录，返回是否写入"""
+    pool = get_worker_pool()
+    if pool is not None:
+        session.aggregator.restore(pool.drain(session.key))
+    return session.flush()
+
+
+def finish_session(session):
+    """
+    连接结束：取回推理进程中尚未写入的统计，再合并写入课程时间记录
+    返回是否写入
+    """
+    unregister_live_session(session)
+    pool = get_worker_pool()
+    if pool is not None:
+        session.aggregator.restore(pool.close(session.key))
+    return session.flush()
+
+
+def process_json_frame(session, frame_data, extra=None):
+    """处理JSON协议的视频帧（图像为base64文本），在线程池中执行"""
+    try:
+        img_data = base64.b64decode(frame_data)
+    except Exception as e:
+        logger.error(f"Base64解码失败: {e}")
+        return {"error": "无法解码图像数据"}
+
+    result, jpeg_bytes = analyze_frame(session, img_data, session.result_mode)
+    if jpeg_bytes is not None:
+        result["processed_frame"] = base64.b64encode(jpeg_bytes).decode('utf-8')
+    result.update(extra or {})
+    return result
+
+
+def process_binary_frame(session, message, extra=None):
+    """
+    处理二进制协议的视频帧，在线程池中执行
+    返回二进制结果消息；消息格式错误时返回错误字典
+    """
+    try:
+        kind, seq, meta, payload = unpack_message(message)
+    except FrameProtocolError as e:
+        logger.error(f"二进制消息格式错误: {e}")
+        return {"error": f"无效的二进制消息: {e}"}
+
+    if kind != KIND_FRAME:
+        return {"error": f"未知的二进制消息类型: {kind}"}
+    if not payload:
+        return pack_result(seq, meta={"error": "未提供视频帧数据"})
+
+    # 帧的元数据可以单独指定结果模式
+    result, jpeg_bytes = analyze_frame(session, payload, meta.get("result_mode", session.result_mode))
+    result.update(extra or {})
+    return pack_result(seq, jpeg_bytes or b'', meta=result)
+
+
+class LatestFrameSlot:
+    """
+    每个连接的帧槽：只保留最新一帧未处理的数据
+    客户端发送速度超过处理速度时，旧帧直接丢弃，结果的延迟不会持续累积
+    """
+
+    def __init__(self):
+        self._frame = None
+        self._ready = asyncio.Event()
+        self.dropped = 0  # 自上次回传以来丢弃的帧数
+        self.total_dropped = 0
+
+    def put(self, frame):
+        if self._frame is not None:
+            self.dropped += 1
+            self.total_dropped += 1
+        self._frame = frame
+        self._ready.set()
+
+    async def get(self):
+        while self._frame is None:
+            self._ready.clear()
+            await self._ready.wait()
+        frame, self._frame = self._frame, None
+        return frame
+
+    def take_dropped(self):
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class CaptureAdvisor:
+    """
+    根据最近的处理耗时和丢帧情况，建议客户端的采集宽度、JPEG质量和帧率
+    采集档位只由单帧处理耗时决定：耗时高时逐级降档，恢复后逐级升档，相邻两次换档之间至少间隔 cooldown 帧。
+    丢帧说明客户端发送得比处理得快（帧槽中的帧被覆盖），与单帧开销无关，只降低建议帧率。
+    """
+
+    def __init__(self, workers, profiles=CAPTURE_PROFILES, target_seconds=TARGET_LATENCY_MS / 1000, cooldown=10):
+        self.workers = workers
+        self.profiles = profiles
+        self.target_seconds = target_seconds
+        self.cooldown = cooldown
+        self.level = 0
+        self.avg_seconds = None
+        self._since_change = 0
+        self.dropping = False
+
+    def record(self, seconds, dropped=0):
+        if self.avg_seconds is None:
+            self.avg_seconds = seconds
+        else:
+            self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * seconds
+        self.dropping = dropped > 0
+        self._since_change += 1
+        if self._since_change < self.cooldown:
+            return
+        # 处理超时时降一档，耗时不到目标的一半时升一档
+        if self.avg_seconds > self.target_seconds and self.level < len(self.profiles) - 1:
+            self.level += 1
+            self._since_change = 0
+        elif self.avg_seconds < self.target_seconds / 2 and self.level > 0:
+            self.level -= 1
+            self._since_change = 0
+
+    def advised_fps(self):
+        if not self.avg_seconds:
+            return MAX_ADVISED_FPS
+        fps = self.workers / self.avg_seconds
+        if self.dropping:
+            # 仍在丢帧时留出余量，让客户端的发送速度降到处理能力以下
+            fps *= 0.8
+        return round(min(MAX_ADVISED_FPS, fps), 1)
+
+    def capture_settings(self):
+        """建议的采集参数，以及实测的单帧处理耗时"""
+        profile = self.profiles[self.level]
+        return {
+            'width': profile['width'],
+            'jpeg_quality': profile['jpeg_quality'],
+            'fps': self.advised_fps(),
+            'latency_ms': round(self.avg_seconds * 1000) if self.avg_seconds is not None else None,
+        }
+
+
+async def frame_worker(session, slot, advisor, send):
+    """
+    从帧槽中取最新的帧处理，并通过 send(结果) 发送
+    结果是 bytes（二进制协议）或字典（JSON 协议）
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        kind, payload, seq = await slot.get()
+        # 回传自上次结果以来被丢弃的帧数、建议帧率和建议的采集参数
+        dropped = slot.take_dropped()
+        extra = {"dropped_frames": dropped, "total_dropped_frames": slot.total_dropped}
+        if ADVISE_TARGET_FPS:
+            extra["advised_fps"] = advisor.advised_fps()
+            extra["capture"] = advisor.capture_settings()
+        started = loop.time()
+        try:
+            if kind == "binary":
+                result = await run_inference(process_binary_frame, session, payload, extra)
+            else:
+                result = await run_inference(process_json_frame, session, payload, extra)
+                # 同一连接可能有多帧同时在处理，回传客户端的序号以便对应
+                if seq is not None:
+                    result["seq"] = seq
+            advisor.record(loop.time() - started, dropped)
+            await send(result)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"处理视频帧时发生错误: {e}")
+            logger.error(traceback.format_exc())
+
+
+def _flush_in_executor(session):
+    # 推理线程长期存在，写入前清理失效的数据库连接
+    close_old_connections()
+    return flush_session(session)
+
+
+async def periodic_flush(session):
+    """上课期间定期把统计批量写入课程时间记录"""
+    while True:
+        await asyncio.sleep(FLUSH_SECONDS)
+        try:
+            await run_inference(_flush_in_executor, session)
+        except Exception as e:
+            # 写入失败的计数已放回会话，下次重试
+            logger.error(f"定期写入课程时间记录失败: {e}")
+
+
+def start_frame_workers(session, slot, send):
+    """为一个连接启动固定数量的处理任务，以及定期写入统计的任务"""
+    advisor = CaptureAdvisor(MAX_IN_FLIGHT_PER_CONNECTION)
+    # 登记后 EndClassView 可以立即写入本连接的统计
+    register_live_session(session, flush=lambda: flush_session(session))
+    workers = [
+        asyncio.ensure_future(frame_worker(session, slot, advisor, send))
+        for _ in range(MAX_IN_FLIGHT_PER_CONNECTION)
+    ]
+    workers.append(asyncio.ensure_future(periodic_flush(session)))
+    return workers
+
+
+async def stop_frame_workers(workers):
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+
+
+async def handle_text_message(session, slot, data, bind_course_time=None):
+    """
+    处理一条JSON文本消息，返回要回复的字典；视频帧放入帧槽后返回 None
+    bind_course_time(course_time_id) 是可选的异步函数，校验后返回可绑定的课程时间ID，不允许时返回 None
+    """
+    message_type = data.get("type")
+
+    if message_type == "video_frame":
+        frame_data = data.get("data", "")
+        if not frame_data:
+            return {"error": "未提供视频帧数据"}
+        slot.put(("json", frame_data, data.get("seq")))
+        return None
+
+    if message_type == "reset":
+        # 只重置本连接的会话数据
+        await run_inference(reset_session, session)
+        return {"status": "reset_complete"}
+
+    if message_type in ("hello", "set_result_mode"):
+        # 设置结果模式，并告知客户端支持的二进制帧协议
+        result_mode = data.get("result_mode", session.result_mode)
+        if result_mode not in RESULT_MODES:
+            return {"error": f"未知的结果模式: {result_mode}"}
+        course_time_id, camera = session.course_time_id, session.camera
+        # hello 时也可以绑定课程时间
+        if message_type == "hello" and data.get("course_time_id") and bind_course_time:
+            course_time_id = await bind_course_time(data["course_time_id"])
+            if course_time_id is None:
+                return {"error": "未找到该课程时间记录或没有权限"}
+        # 同一课堂的多个摄像头用不同的名称区分
+        if message_type == "hello" and data.get("camera"):
+            camera = str(data["camera"])[:64]
+        if session.course_time_id and (course_time_id, camera) != (session.course_time_id, session.camera):
+            # 重新绑定前先写入已有的统计，不计入新的课程时间或摄像头
+            try:
+                await run_inference(_flush_in_executor, session)
+            except Exception as e:
+                logger.error(f"重新绑定前写入课程时间记录失败: {e}")
+                return {"error": "写入当前课程时间的统计失败，请稍后重试"}
+        session.course_time_id, session.camera = course_time_id, camera
+        session.result_mode = result_mode
+        info = protocol_info() if message_type == "hello" else {"type": "result_mode"}
+        if message_type == "hello" and ADVISE_TARGET_FPS:
+            # 客户端从最高档开始采集，不必发送超过识别宽度的原始分辨率，之后按结果中的 capture 调整
+            info["capture"] = CaptureAdvisor(MAX_IN_FLIGHT_PER_CONNECTION).capture_settings()
+        info["result_mode"] = result_mode
+        info["course_time_id"] = session.course_time_id
+        info["camera"] = session.camera
+        return info
+
+    if message_type == "reload_gallery":
+        # 人脸库变更后可以主动通知刷新，不必等待下一次检查
+        current = await run_inference(gallery_holder.reload)
+        return {"type": "gallery", "version": current.version, "faces": len(current)}
+
+    if message_type == "ping":
+        return {"type": "pong"}
+
+    logger.warning(f"未知消息类型: {message_type}")
+    return {"error": "未知消息类型"}
@@ -0,0 +1,418 @@
+"""
+实时分析的连接会话
+
+每个 WebSocket 连接对应一个 AnalysisSession，绑定到一个课程时间（course_time_id），
+持有自己的人脸跟踪器、状态统计和识别到的学生集合。不同教室之间互不影响，
+某个连接的 reset 只清空它自己的数据。
+
+上课期间统计定期增量写入 CourseTime.emotion_analysis_json（按学生的状态计数，以及按时间段的全班状态计数），
+连接断开和教师结束上课（EndClassView）时再写入一次，下课后报告立即可用，不需要再离线分析录像。
+一个课堂可以有多个摄像头，原始观测按摄像头、身份和时间段保存在 cameras 中，summary 等结果由 fuse_cameras 融合得到。
+身份是 identity_key：人脸库中的人脸为“姓名|face_id”（姓名可能重名），其他（未知人脸、旧数据）只有姓名。
+"""
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+
+# 与 StatusAnalyzer.analyze_log_file 输出的状态列保持一致
+STATUS_COLUMNS = ['Distracted', 'Focused', 'Confused', 'Head Down',
+                  'Turning LEFT', 'Turning RIGHT', 'No Face Detected', 'Error']
+
+# 不计入统计的名称
+IGNORED_NAMES = {'unknown'}
+
+# 时间线的分段长度（秒），也是多摄像头融合时的对齐粒度
+TIMELINE_BUCKET_SECONDS = 60
+
+# 客户端没有指定摄像头时使用的名称；没有摄像头信息的旧数据归入 LEGACY_CAMERA
+DEFAULT_CAMERA = 'default'
+LEGACY_CAMERA = 'legacy'
+
+# 结果模式：image 回传绘制了人脸框的图像，metadata 只回传结构化结果，由客户端绘制
+RESULT_MODE_IMAGE = 'image'
+RESULT_MODE_METADATA = 'metadata'
+RESULT_MODES = (RESULT_MODE_IMAGE, RESULT_MODE_METADATA)
+
+
+def identity_key(name, face_id=None):
+    """观测记录的身份；姓名中的 | 在记录前已被替换，可以安全地拆分"""
+    return f'{name}|{face_id}' if face_id is not None else name
+
+
+def identity_name(key):
+    return key.split('|', 1)[0]
+
+
+def _iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    if not inter:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return inter / float(area_a + area_b - inter)
+
+
+class FaceTracker:
+    """
+    基于人脸框重叠度的简单跟踪器，为相邻帧中的同一张人脸分配稳定的 track_id
+    超过 max_missed 帧没有匹配到的轨迹会被移除
+    """
+
+    def __init__(self, iou_threshold=0.3, max_missed=15):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.tracks = {}  # track_id -> {'bbox', 'missed', 'name'}
+        self._next_id = 1
+
+    def update(self, detections):
+        """为每个检测结果写入 track_id，返回同一个列表"""
+        candidates = sorted(
+            ((_iou(track['bbox'], det['bbox']), track_id, index)
+             for track_id, track in self.tracks.items()
+             for index, det in enumerate(detections)),
+            reverse=True
+        )
+        assigned_tracks, assigned_dets = set(), set()
+        for iou, track_id, index in candidates:
+            if iou < self.iou_threshold:
+                break
+            if track_id in assigned_tracks or index in assigned_dets:
+                continue
+            assigned_tracks.add(track_id)
+            assigned_dets.add(index)
+            detections[index]['track_id'] = track_id
+
+        for index, det in enumerate(detections):
+            if index not in assigned_dets:
+                det['track_id'] = self._next_id
+                self._next_id += 1
+
+        for det in detections:
+            track = self.tracks.setdefault(det['track_id'], {})
+            track['bbox'] = det['bbox']
+            track['missed'] = 0
+            # 识别过的轨迹记住名字，短暂识别失败时沿用
+            if det.get('name'):
+                track['name'] = det['name']
+            elif track.get('name'):
+                det['name'] = track['name']
+
+        seen = {det['track_id'] for det in detections}
+        for track_id in list(self.tracks):
+            if track_id not in seen:
+                self.tracks[track_id]['missed'] += 1
+                if self.tracks[track_id]['missed'] > self.max_missed:
+                    del self.tracks[track_id]
+        return detections
+
+    def reset(self):
+        self.tracks.clear()
+        self._next_id = 1
+
+
+def _observations():
+    # identity_key -> 时间段起点（秒） -> {status: count, 'Total': n}
+    return defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+
+
+class StatusAggregator:
+    """
+    按学生统计状态次数
+    实现 log_status / update_status 接口，可以直接作为 process_frame 的日志记录器和数据收集器
+    totals 是本连接按姓名的累计统计，用于实时显示；pending 是按身份和时间段记录、尚未写入数据库的计数，写入时取出清空
+
+    clock 返回记录的时间（秒），录像分析时换成录像内的时间，与其他摄像头对齐；
+    forward 是可选的另一个日志记录器，状态同时转发给它
+    """
+
+    def __init__(self, clock=time.time, forward=None):
+        self.clock = clock
+        self.forward = forward
+        self.totals = defaultdict(lambda: defaultdict(int))
+        self.pending = _observations()
+        self.current_status = {}
+        # process_frame 在推理线程中调用 log_status
+        self._lock = threading.Lock()
+
+    def log_status(self, status_data):
+        if self.forward is not None:
+            self.forward.log_status(status_data)
+        name = (status_data.get('name') or '').replace('|', '_').strip()
+        status = status_data.get('main_status')
+        if not name or not status or name in IGNORED_NAMES:
+            return
+        bucket = int(self.clock()) // TIMELINE_BUCKET_SECONDS * TIMELINE_BUCKET_SECONDS
+        key = identity_key(name, status_data.get('face_id'))
+        with self._lock:
+            for stats in (self.totals[name], self.pending[key][bucket]):
+                stats[status] += 1
+                stats['Total'] += 1
+
+    def update_status(self, status_data):
+        self.current_status = dict(status_data)
+        self.current_status['timestamp'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+
+    def get_status_stats(self):
+        """返回与 emotion_analysis_json 相同格式的累计统计"""
+        with self._lock:
+            return build_summary(self.totals)
+
+    def drain(self):
+        """取出尚未写入数据库的计数并清空，返回 {identity_key: {时间段起点: {status: count}}}"""
+        with self._lock:
+            pending, self.pending = self.pending, _observations()
+        return pending
+
+    def restore(self, observations):
+        """写入失败时把取出的计数加回来"""
+        with self._lock:
+            for name, buckets in observations.items():
+                for start, stats in buckets.items():
+                    for status, count in stats.items():
+                        self.pending[name][start][status] += count
+
+    def reset(self):
+        """清空实时显示的统计；已经产生但尚未写入的计数仍会写入课程时间记录"""
+        with self._lock:
+            self.totals.clear()
+            self.current_status = {}
+
+
+def build_summary(counts):
+    """把 {name: {status: count, 'Total': n}} 转换为 {'summary': ...} 格式"""
+    summary = {}
+    for name, stats in counts.items():
+        total = stats.get('Total', 0)
+        if not total:
+            continue
+        status_counts = {status: stats[status] for status in STATUS_COLUMNS if stats.get(status, 0) > 0}
+        summary[name] = {
+            'total_records': total,
+            'status_counts': status_counts,
+            'status_percentages': {
+                status: round(count / total * 100, 2) for status, count in status_counts.items()
+            },
+        }
+    return {'summary': summary}
+
+
+def bucket_key(start):
+    """时间段起点（秒）转换为写入数据库的 ISO 时间"""
+    return datetime.fromtimestamp(start, tz=timezone.utc).isoformat()
+
+
+def fuse_cameras(cameras):
+    """
+    融合多个摄像头的观测结果
+    cameras 为 {camera: {identity_key: {时间段: {status: count, 'Total': n}}}}，同一个身份在同一时间段被多个摄像头拍到时，
+    只取记录最多（画面最清楚）的那个摄像头，避免重复计数；重名的不同学生按 face_id 分开融合。
+    返回按姓名的 summary、按时间段的全班 timeline 和按身份的出勤 attendance。
+    """
+    best = {}
+    seen_by = defaultdict(set)
+    for camera, students in cameras.items():
+        for key, buckets in students.items():
+            seen_by[key].add(camera)
+            for start, stats in buckets.items():
+                current = best.get((key, start))
+                if current is None or stats.get('Total', 0) > current.get('Total', 0):
+                    best[(key, start)] = stats
+
+    counts = defaultdict(lambda: defaultdict(int))
+    timeline = defaultdict(lambda: defaultdict(int))
+    seen_at = defaultdict(list)
+    for (key, start), stats in best.items():
+        for status, count in stats.items():
+            counts[identity_name(key)][status] += count
+            # 没有时间信息的旧数据（时间段为空）只计入 summary
+            if start and status != 'Total':
+                timeline[start][status] += count
+        if start:
+            seen_at[key].append(start)
+
+    fused = build_summary(counts)
+    fused['timeline'] = {start: dict(timeline[start]) for start in sorted(timeline)}
+    fused['attendance'] = {
+        key: {
+            'name': identity_name(key),
+            'cameras': sorted(seen_by[key]),
+            'first_seen': min(seen_at[key]) if seen_at[key] else None,
+            'last_seen': max(seen_at[key]) if seen_at[key] else None,
+        }
+        for key in seen_by if identity_name(key) in fused['summary']
+    }
+    return fused
+
+
+def merge_emotion_summary(existing, addition):
+    """
+    合并两份 emotion_analysis_json：按摄像头累加原始观测，再融合得到 summary、timeline 和 attendance
+    没有 cameras 的旧数据（离线分析结果）作为一个没有时间信息的摄像头保留
+    """
+    cameras = defaultdict(_observations)
+    for data in (existing, addition):
+        data = data or {}
+        if 'cameras' in data:
+            for camera, students in data['cameras'].items():
+                for name, buckets in students.items():
+                    for start, stats in buckets.items():
+                        for status, count in stats.items():
+                            cameras[camera][name][start][status] += count
+        else:
+            for name, item in (data.get('summary') or {}).items():
+                stats = cameras[LEGACY_CAMERA][name]['']
+                for status, count in (item.get('status_counts') or {}).items():
+                    stats[status] += count
+                stats['Total'] += item.get('total_records', 0)
+
+    merged = dict(existing or {})
+    merged['cameras'] = {
+        camera: {
+            name: {start: dict(stats) for start, stats in sorted(buckets.items())}
+            for name, buckets in students.items()
+        }
+        for camera, students in cameras.items()
+    }
+    merged.update(fuse_cameras(merged['cameras']))
+    return merged
+
+
+class AnalysisSession:
+    """一个 WebSocket 连接的分析会话"""
+
+    def __init__(self, course_time_id=None, camera=DEFAULT_CAMERA, aggregator=None):
+        self.course_time_id = course_time_id
+        # 同一课堂可以有多个摄像头推流，统计按摄像头分别记录后融合
+        self.camera = str(camera or DEFAULT_CAMERA)[:64]
+        # 开启推理进程池时，用于把连接固定路由到同一个推理进程
+        self.key = uuid.uuid4().hex
+        self.tracker = FaceTracker()
+        self.aggregator = aggregator or StatusAggregator()
+        self.recognized_students = set()
+        self.frame_count = 0
+        self.last_emotion_stats = None
+        self.result_mode = RESULT_MODE_IMAGE
+        # 同一连接可能有多帧在不同线程中处理
+        self.lock = threading.Lock()
+
+    def record_frame(self, detections, students):
+        """记录一帧的识别结果，返回本帧是否需要附带完整统计"""
+        with self.lock:
+            self.tracker.update(detections)
+            self.recognized_students.update(students)
+            self.frame_count += 1
+            # 每3帧更新一次情绪统计
+            if self.frame_count % 3 == 0:
+                self.last_emotion_stats = self.aggregator.get_status_stats()
+                return True
+            return False
+
+    def reset(self):
+        with self.lock:
+            self.tracker.reset()
+            self.aggregator.reset()
+            self.recognized_students.clear()
+            self.frame_count = 0
+            self.last_emotion_stats = None
+
+    def flush(self):
+        """
+        把本会话的统计合并写入 CourseTime.emotion_analysis_json
+        没有绑定课程时间或没有统计数据时不写入，返回是否写入
+        """
+        from django.db import transaction
+        from course_management.models import CourseTime
+
+        if not self.course_time_id:
+            return False
+        observations = self.aggregator.drain()
+        if not observations:
+            return False
+        addition = {'cameras': {self.camera: {
+            name: {bucket_key(start): dict(stats) for start, stats in buckets.items()}
+            for name, buckets in observations.items()
+        }}}
+
+        try:
+            with transaction.atomic():
+                course_time = CourseTime.objects.select_for_update().filter(id=self.course_time_id).first()
+                if course_time is None:
+                    return False
+                course_time.emotion_analysis_json = merge_emotion_summary(course_time.emotion_analysis_json, addition)
+                course_time.save(update_fields=['emotion_analysis_json'])
+        except Exception:
+            self.aggregator.restore(observations)
+            raise
+        return True
+
+
+# 当前进程中正在推流的会话：session.key -> (会话, 写入函数)
+_live_sessions = {}
+_live_sessions_lock = threading.Lock()
+
+
+def register_live_session(session, flush=None):
+    """登记正在推流的会话，flush 为写入统计的函数，默认为 session.flush"""
+    with _live_sessions_lock:
+        _live_sessions[session.key] = (session, flush or session.flush)
+
+
+def unregister_live_session(session):
+    with _live_sessions_lock:
+        _live_sessions.pop(session.key, None)
+
+
+def flush_live_sessions(course_time_id):
+    """立即写入当前进程中绑定到该课程时间的所有会话的统计，返回写入的会话数"""
+    with _live_sessions_lock:
+        targets = [flush for session, flush in _live_sessions.values() if session.course_time_id == course_time_id]
+    return sum(1 for flush in targets if flush())
+
+
+def authorized_course_time_id(user, course_time_id):
+    """
+    用户可以为该课程时间推流分析（管理员，或课程时间/课程的教师）时返回整数ID，否则返回 None
+    AnalysisConsumer 和 websocket_server.py 绑定课程时间前都用它检查权限
+    """
+    from course_management.models import CourseTime
+
+    if user is None:
+        return None
+    try:
+        course_time = CourseTime.objects.select_related('course').get(id=int(course_time_id))
+    except (CourseTime.DoesNotExist, TypeError, ValueError):
+        return None
+    if user.is_superuser:
+        return course_time.id
+    teacher = getattr(user, 'teacher_profile', None)
+    if teacher is None:
+        return None
+    if course_time.teacher_id == teacher.pk or course_time.course.teacher_id == teacher.pk:
+        return course_time.id
+    return None
+
+
+def course_time_group_name(course_time_id):
+    """绑定到同一课程时间的实时分析连接所在的 channel layer 群组"""
+    return f'analysis_course_time_{course_time_id}'
+
+
+def notify_class_ended(course_time_id):
+    """
+    通知所有进程（包括其他节点）中绑定到该课程时间的分析连接：课程已结束
+    各连接收到后写入自己的统计并断开（见 AnalysisConsumer.analysis_class_ended）
+    """
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(
+        course_time_group_name(course_time_id),
+        {'type': 'analysis.class_ended', 'course_time_id': course_time_id}
+    )
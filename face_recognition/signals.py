@@ -0,0 +1,13 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Face, FaceGalleryChange
+
+@receiver(post_save, sender=Face)
+def record_face_saved(sender, instance, **kwargs):
+    """人脸新增或更新后，人脸库版本加一"""
+    FaceGalleryChange.objects.create(face_id=instance.id, action=FaceGalleryChange.ACTION_UPSERT)
+
+@receiver(post_delete, sender=Face)
+def record_face_deleted(sender, instance, **kwargs):
+    """人脸删除后，人脸库版本加一"""
+    FaceGalleryChange.objects.create(face_id=instance.id, action=FaceGalleryChange.ACTION_DELETE)
@@ -1,3 +1,393 @@
-from django.test import TestCase
+import queue
+import time
+from datetime import datetime, timezone as dt_timezone
+from unittest import mock
+import numpy as np
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from course_management.models import Course, CourseTime
+from user_management.models import Teacher
+from .frame_protocol import (
+    HEADER_SIZE, KIND_FRAME, KIND_RESULT, FrameProtocolError,
+    pack_frame, pack_result, unpack_message
+)
+from .fusion import analyze_recording
+from .gallery import load_gallery, refresh_gallery
+from .models import Face
+from .pipeline import CaptureAdvisor, LatestFrameSlot, _fit_slot, handle_text_message
+from .realtime import AnalysisSession, FaceTracker, StatusAggregator, notify_class_ended
+from .routing import websocket_urlpatterns
+from .worker_pool import SLOT_BYTES, SLOTS_PER_WORKER, InferenceWorkerPool, WorkerTimeout
+
+
+class FrameProtocolTests(SimpleTestCase):
+    def test_frame_round_trip(self):
+        """JPEG字节原样传输，不经过base64"""
+        jpeg = b'\xff\xd8' + bytes(range(256)) + b'\xff\xd9'
+        message = pack_frame(7, jpeg)
+        self.assertEqual(len(message), HEADER_SIZE + len(jpeg))
+        
+        kind, seq, meta, payload = unpack_message(message)
+        self.assertEqual((kind, seq, meta), (KIND_FRAME, 7, {}))
+        self.assertEqual(bytes(payload), jpeg)
+    
+    def test_result_carries_metadata(self):
+        """结果消息的元数据包含统计信息"""
+        message = pack_result(3, b'jpeg', meta={'face_count': 2, 'students_detected': ['张三']})
+        kind, seq, meta, payload = unpack_message(message)
+        self.assertEqual(kind, KIND_RESULT)
+        self.assertEqual(meta['students_detected'], ['张三'])
+        self.assertEqual(bytes(payload), b'jpeg')
+    
+    def test_rejects_malformed_messages(self):
+        """格式错误的消息抛出 FrameProtocolError"""
+        with self.assertRaises(FrameProtocolError):
+            unpack_message(b'short')
+        with self.assertRaises(FrameProtocolError):
+            unpack_message(b'XX' + pack_frame(1, b'data')[2:])
+        truncated = pack_result(1, meta={'face_count': 1})[:HEADER_SIZE + 2]
+        with self.assertRaises(FrameProtocolError):
+            unpack_message(truncated)
+
+
+class FaceTrackerTests(SimpleTestCase):
+    def test_track_ids_follow_overlapping_boxes(self):
+        """相邻帧中重叠的人脸沿用同一个 track_id，并记住识别到的名字"""
+        tracker = FaceTracker()
+        first = tracker.update([
+            {'bbox': [0, 0, 100, 100], 'name': '张三'},
+            {'bbox': [300, 0, 400, 100], 'name': None},
+        ])
+        second = tracker.update([
+            {'bbox': [310, 5, 410, 105], 'name': None},
+            {'bbox': [5, 5, 105, 105], 'name': None},
+        ])
+        self.assertEqual(second[1]['track_id'], first[0]['track_id'])
+        self.assertEqual(second[0]['track_id'], first[1]['track_id'])
+        self.assertEqual(second[1]['name'], '张三')
+
+
+class AnalysisSessionTests(TestCase):
+    def setUp(self):
+        """测试数据初始化"""
+        User = get_user_model()
+        teacher_user = User.objects.create_user(username='teacher1', password='testpass123', role='teacher')
+        teacher = Teacher.objects.get(user=teacher_user)
+        course = Course.objects.create(title='测试课程', teacher=teacher)
+        self.course_time = CourseTime.objects.create(course=course, teacher=teacher)
+    
+    def test_sessions_are_isolated(self):
+        """一个会话的 reset 不影响其他会话"""
+        first, second = AnalysisSession(), AnalysisSession()
+        first.aggregator.log_status({'name': '张三', 'main_status': 'Focused'})
+        second.aggregator.log_status({'name': '李四', 'main_status': 'Confused'})
+        first.reset()
+        self.assertEqual(first.aggregator.get_status_stats(), {'summary': {}})
+        self.assertIn('李四', second.aggregator.get_status_stats()['summary'])
+    
+    def test_flush_merges_into_course_time(self):
+        """断开连接时的统计与已有的分析结果合并"""
+        self.course_time.emotion_analysis_json = {'summary': {'张三': {
+            'total_records': 2,
+            'status_counts': {'Focused': 2},
+            'status_percentages': {'Focused': 100.0},
+        }}}
+        self.course_time.save()
+        
+        session = AnalysisSession(self.course_time.id)
+        session.aggregator.log_status({'name': '张三', 'main_status': 'Distracted'})
+        session.aggregator.log_status({'name': 'unknown', 'main_status': 'Focused'})
+        self.assertTrue(session.flush())
+        
+        self.course_time.refresh_from_db()
+        summary = self.course_time.emotion_analysis_json['summary']
+        self.assertEqual(list(summary), ['张三'])
+        self.assertEqual(summary['张三']['total_records'], 3)
+        self.assertEqual(summary['张三']['status_counts'], {'Focused': 2, 'Distracted': 1})
+        # 已写入的数据不会重复写入
+        self.assertFalse(session.flush())
+    
+    def test_cameras_are_fused_by_identity_and_time(self):
+        """两个摄像头同一时间段拍到同一个学生时只计一次，取记录较多的摄像头"""
+        start = 1700000000 // 60 * 60
+        front = AnalysisSession(self.course_time.id, camera='front', aggregator=StatusAggregator(clock=lambda: start))
+        back = AnalysisSession(self.course_time.id, camera='back', aggregator=StatusAggregator(clock=lambda: start + 5))
+        for _ in range(3):
+            front.aggregator.log_status({'name': '张三', 'main_status': 'Focused'})
+        back.aggregator.log_status({'name': '张三', 'main_status': 'Distracted'})
+        back.aggregator.log_status({'name': '李四', 'main_status': 'Confused'})
+        self.assertTrue(front.flush())
+        self.assertTrue(back.flush())
+        
+        self.course_time.refresh_from_db()
+        data = self.course_time.emotion_analysis_json
+        self.assertEqual(sorted(data['cameras']), ['back', 'front'])
+        self.assertEqual(data['summary']['张三']['status_counts'], {'Focused': 3})
+        self.assertEqual(data['summary']['李四']['total_records'], 1)
+        self.assertEqual(data['attendance']['张三']['cameras'], ['back', 'front'])
+        self.assertEqual(list(data['timeline'].values()), [{'Focused': 3, 'Confused': 1}])
+    
+    def test_same_name_students_are_fused_separately(self):
+        """重名的两个学生按人脸库ID区分，不会被当作同一个人去重"""
+        start = 1700000000 // 60 * 60
+        front = AnalysisSession(self.course_time.id, camera='front', aggregator=StatusAggregator(clock=lambda: start))
+        back = AnalysisSession(self.course_time.id, camera='back', aggregator=StatusAggregator(clock=lambda: start))
+        front.aggregator.log_status({'name': '王五', 'face_id': 1, 'main_status': 'Focused'})
+        back.aggregator.log_status({'name': '王五', 'face_id': 2, 'main_status': 'Distracted'})
+        self.assertTrue(front.flush())
+        self.assertTrue(back.flush())
+        
+        self.course_time.refresh_from_db()
+        data = self.course_time.emotion_analysis_json
+        self.assertEqual(data['summary']['王五']['total_records'], 2)
+        self.assertEqual(sorted(data['attendance']), ['王五|1', '王五|2'])
+        self.assertEqual(data['attendance']['王五|2'], {
+            'name': '王五', 'cameras': ['back'], 'first_seen': data['attendance']['王五|1']['first_seen'],
+            'last_seen': data['attendance']['王五|1']['last_seen'],
+        })
+    
+    def test_recording_analysis_uses_worker_pool(self):
+        """开启推理进程池时录像分析交给推理进程，统计按录像内的时间取回并写入"""
+        start = datetime(2026, 10, 19, 8, 0, tzinfo=dt_timezone.utc)
+        capture = mock.Mock()
+        capture.isOpened.return_value = True
+        capture.get.return_value = 1
+        capture.read.side_effect = [(True, np.zeros((4, 6, 3), dtype=np.uint8))] * 4 + [(False, None)]
+        pool = mock.Mock()
+        pool.infer.return_value = ({}, None)
+        pool.close.return_value = {'张三|1': {int(start.timestamp()): {'Focused': 2, 'Total': 2}}}
+        with mock.patch('face_recognition.fusion.cv2.VideoCapture', return_value=capture), \
+                mock.patch('face_recognition.worker_pool.get_worker_pool', return_value=pool):
+            self.assertEqual(analyze_recording(self.course_time, 'front', 'front.mp4', started_at=start), 2)
+        
+        self.assertEqual([call.kwargs['timestamp'] for call in pool.infer.call_args_list],
+                         [start.timestamp(), start.timestamp() + 2])
+        self.course_time.refresh_from_db()
+        self.assertEqual(self.course_time.emotion_analysis_json['summary']['张三']['total_records'], 2)
+
+
+class GalleryRefreshTests(TestCase):
+    def _face(self, name, value):
+        feat = np.full(4, value, dtype=np.float32)
+        return Face.objects.create(name=name, feat=feat.tobytes())
+    
+    def test_refresh_applies_changes_incrementally(self):
+        """新增、更新和删除都会提升版本号，刷新后得到新的快照"""
+        zhang = self._face('张三', 0.1)
+        li = self._face('李四', 0.2)
+        gallery = load_gallery()
+        self.assertEqual(gallery.names, ['张三', '李四'])
+        self.assertEqual(gallery.feats.shape, (2, 4))
+        
+        # 没有变化时返回同一个快照
+        self.assertIs(refresh_gallery(gallery), gallery)
+        
+        wang = self._face('王五', 0.3)
+        zhang.name = '张三丰'
+        zhang.save()
+        li.delete()
+        
+        refreshed = refresh_gallery(gallery)
+        self.assertGreater(refreshed.version, gallery.version)
+        self.assertEqual(refreshed.face_ids, [zhang.id, wang.id])
+        self.assertEqual(refreshed.names, ['张三丰', '王五'])
+        # 旧快照保持不变，正在处理的帧不受影响
+        self.assertEqual(gallery.names, ['张三', '李四'])
+
+
+class InferenceWorkerPoolTests(SimpleTestCase):
+    def test_connections_stick_to_one_worker(self):
+        """同一个连接始终路由到同一个推理进程，新连接分给连接数最少的进程"""
+        pool = InferenceWorkerPool(2)
+        try:
+            first = pool._worker_for('a')
+            second = pool._worker_for('b')
+            self.assertIsNot(first, second)
+            self.assertIs(pool._worker_for('a'), first)
+            
+            # 帧写入共享内存后可以原样读回
+            frame = np.arange(4 * 6 * 3, dtype=np.uint8).reshape(4, 6, 3)
+            first.slot_view(1, frame.shape)[...] = frame
+            np.testing.assert_array_equal(first.slot_view(1, frame.shape), frame)
+            
+            # 没有处理过帧的连接关闭时没有计数，关闭后释放路由
+            self.assertEqual(pool.close('a'), {})
+            self.assertEqual(first.connections, 0)
+            self.assertEqual(pool.close('unknown'), {})
+        finally:
+            pool.shutdown()
+    
+    def test_timed_out_slot_is_reused_only_after_late_result(self):
+        """超时的帧槽不立即复用，迟到的结果返回后才放回空闲列表"""
+        pool = InferenceWorkerPool(1)
+        try:
+            worker = pool._worker_for('a')
+            # 替换任务队列，模拟推理进程迟迟不返回结果
+            tasks, worker.tasks = worker.tasks, queue.Queue()
+            frame = np.zeros((4, 6, 3), dtype=np.uint8)
+            with mock.patch('face_recognition.worker_pool.RESULT_TIMEOUT', 0.05):
+                with self.assertRaises(WorkerTimeout):
+                    pool.infer('a', frame, True)
+            self.assertEqual(worker.free_slots.qsize(), SLOTS_PER_WORKER - 1)
+            
+            task_id = worker.tasks.get_nowait()[1]
+            pool.results.put((task_id, None, False, None))
+            deadline = time.monotonic() + 5
+            while worker.free_slots.qsize() < SLOTS_PER_WORKER and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(worker.free_slots.qsize(), SLOTS_PER_WORKER)
+            worker.tasks = tasks
+        finally:
+            pool.shutdown()
+    
+    def test_tall_frames_fit_slot(self):
+        """超过帧槽容量的图像会继续缩小"""
+        frame = np.zeros((SLOT_BYTES // (640 * 3) + 100, 640, 3), dtype=np.uint8)
+        fitted = _fit_slot(frame)
+        self.assertLessEqual(fitted.nbytes, SLOT_BYTES)
+        small = np.zeros((10, 10, 3), dtype=np.uint8)
+        self.assertIs(_fit_slot(small), small)
+
+
+class CaptureAdvisorTests(SimpleTestCase):
+    def test_steps_down_under_load_and_recovers(self):
+        """处理耗时超过目标时逐级降档，负载恢复后逐级升档"""
+        profiles = [{'width': 640, 'jpeg_quality': 80}, {'width': 320, 'jpeg_quality': 60}]
+        advisor = CaptureAdvisor(2, profiles=profiles, target_seconds=0.1, cooldown=3)
+        self.assertEqual(advisor.capture_settings()['width'], 640)
+        self.assertIsNone(advisor.capture_settings()['latency_ms'])
+        
+        for _ in range(3):
+            advisor.record(0.3)
+        settings = advisor.capture_settings()
+        self.assertEqual(settings['width'], 320)
+        self.assertEqual(settings['jpeg_quality'], 60)
+        self.assertEqual(settings['latency_ms'], 300)
+        
+        # 已是最低档时不再继续降
+        for _ in range(3):
+            advisor.record(0.3)
+        self.assertEqual(advisor.level, 1)
+        
+        for _ in range(20):
+            advisor.record(0.01)
+        self.assertEqual(advisor.capture_settings()['width'], 640)
+    
+    def test_drops_with_low_latency_only_lower_fps(self):
+        """处理耗时低于目标时丢帧不降档，只降低建议帧率"""
+        profiles = [{'width': 640, 'jpeg_quality': 80}, {'width': 320, 'jpeg_quality': 60}]
+        advisor = CaptureAdvisor(1, profiles=profiles, target_seconds=0.1, cooldown=3)
+        for _ in range(10):
+            advisor.record(0.08)
+        fps = advisor.advised_fps()
+        
+        for _ in range(10):
+            advisor.record(0.08, dropped=3)
+        self.assertEqual(advisor.capture_settings()['width'], 640)
+        self.assertLess(advisor.advised_fps(), fps)
+
+
+class CourseTimeRebindTests(TransactionTestCase):
+    def test_rebinding_flushes_previous_course_time(self):
+        """hello 重新绑定课程时间前先写入已有的统计，每个课程时间只得到自己的计数"""
+        User = get_user_model()
+        teacher_user = User.objects.create_user(username='teacher1', password='testpass123', role='teacher')
+        teacher = Teacher.objects.get(user=teacher_user)
+        course = Course.objects.create(title='测试课程', teacher=teacher)
+        first = CourseTime.objects.create(course=course, teacher=teacher)
+        second = CourseTime.objects.create(course=course, teacher=teacher)
+
+        async def bind(course_time_id):
+            return int(course_time_id)
+
+        session = AnalysisSession()
+        slot = LatestFrameSlot()
+
+        async def run():
+            await handle_text_message(session, slot, {'type': 'hello', 'course_time_id': first.id}, bind)
+            session.aggregator.log_status({'name': '张三', 'main_status': 'Focused'})
+            reply = await handle_text_message(session, slot, {'type': 'hello', 'course_time_id': second.id}, bind)
+            self.assertEqual(reply['course_time_id'], second.id)
+            session.aggregator.log_status({'name': '李四', 'main_status': 'Confused'})
+        async_to_sync(run)()
+        self.assertTrue(session.flush())
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(list(first.emotion_analysis_json['summary']), ['张三'])
+        self.assertEqual(list(second.emotion_analysis_json['summary']), ['李四'])
+
+
+class AnalysisConsumerTests(TransactionTestCase):
+    def setUp(self):
+        """测试数据初始化"""
+        User = get_user_model()
+        self.teacher_user = User.objects.create_user(username='teacher1', password='testpass123', role='teacher')
+        other_user = User.objects.create_user(username='teacher2', password='testpass123', role='teacher')
+        teacher = Teacher.objects.get(user=self.teacher_user)
+        course = Course.objects.create(title='测试课程', teacher=teacher)
+        self.course_time = CourseTime.objects.create(course=course, teacher=teacher)
+        self.token = str(AccessToken.for_user(self.teacher_user))
+        self.other_token = str(AccessToken.for_user(other_user))
+    
+    def _communicator(self, token=None):
+        path = f'/ws/analysis/{self.course_time.id}/'
+        if token:
+            path += f'?token={token}'
+        return WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+    
+    def test_course_teacher_can_connect(self):
+        """课程教师通过 URL 中的 token 认证后可以发送控制消息"""
+        async def run():
+            communicator = self._communicator(self.token)
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            response = await communicator.receive_json_from()
+            self.assertEqual(response['type'], 'authentication_successful')
+            self.assertEqual(response['course_time_id'], self.course_time.id)
+            
+            await communicator.send_json_to({'type': 'ping'})
+            self.assertEqual(await communicator.receive_json_from(), {'type': 'pong'})
+            await communicator.disconnect()
+        async_to_sync(run)()
+    
+    def test_other_teacher_is_rejected(self):
+        """不是该课程的教师时关闭连接"""
+        async def run():
+            communicator = self._communicator()
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.send_json_to({'type': 'authentication', 'token': f'Bearer {self.other_token}'})
+            response = await communicator.receive_json_from()
+            self.assertEqual(response['type'], 'error')
+            output = await communicator.receive_output()
+            self.assertEqual(output, {'type': 'websocket.close', 'code': 4403})
+        async_to_sync(run)()
+    
+    def test_class_ended_event_reaches_connection(self):
+        """下课通知通过 channel layer 发给绑定到该课程时间的连接，连接写入统计后断开"""
+        async def run():
+            communicator = self._communicator(self.token)
+            await communicator.connect()
+            await communicator.receive_json_from()
+            with mock.patch.object(AnalysisSession, 'flush', return_value=True) as flush:
+                await sync_to_async(notify_class_ended)(self.course_time.id)
+                response = await communicator.receive_json_from()
+                self.assertEqual(response, {'type': 'class_ended', 'course_time_id': self.course_time.id})
+                self.assertEqual((await communicator.receive_output())['type'], 'websocket.close')
+                self.assertTrue(flush.called)
+            await communicator.disconnect()
+        async_to_sync(run)()
+    
+    def test_invalid_token_is_refused(self):
+        """无效的 token 拒绝连接"""
+        async def run():
+            communicator = self._communicator('invalid')
+            connected, _ = await communicator.connect()
+            self.assertFalse(connected)
+        async_to_sync(run)()
@@ -659,16 +659,43 @@ def process_emotion_recognition(request):
         student_names = set()
         frame_count = 0
         
+        # 在解码循环中顺带采集封面和时间轴缩略图
+        from course_management.thumbnails import ThumbnailCollector
+        thumbnail_collector = ThumbnailCollector(fps) if course_time else None
+        
+        # 多摄像头课堂：指定 camera 时按摄像头记录带时间的观测，与同一课堂其他摄像头的结果融合而不是覆盖
+        # recorded_at 为录像开始时间（ISO格式），不提供时以课程开始时间对齐
+        camera_session = None
+        camera = request.POST.get('camera') if course_time else None
+        if camera:
+            from django.utils import timezone
+            from django.utils.dateparse import parse_datetime
+            from .realtime import AnalysisSession, StatusAggregator
+            recorded_at = parse_datetime(request.POST.get('recorded_at') or '') or course_time.begin_time or timezone.now()
+            if timezone.is_naive(recorded_at):
+                recorded_at = timezone.make_aware(recorded_at)
+            origin = recorded_at.timestamp()
+            camera_session = AnalysisSession(course_time.id, camera=camera, aggregator=StatusAggregator(
+                clock=lambda: origin + frame_count / (fps or 25), forward=logger
+            ))
+        
         # 处理每一帧
         while cap.isOpened():
             ret, frame = cap.read()
             if not ret:
                 break
             
+            # 缩略图使用绘制标注之前的原始帧
+            if thumbnail_collector:
+                thumbnail_collector.add_frame(frame_count, frame)
+            
             # 每2帧处理一次（之前是5帧，降低跳帧率，提高检测机会）
             if frame_count % 2 == 0:
                 # 处理当前帧，进行人脸识别和情绪检测
-                processed_frame = process_frame(frame, target_feats, target_names, student_names)
+                processed_frame = process_frame(
+                    frame, target_feats, target_names, student_names,
+                    status_logger=camera_session.aggregator if camera_session else None
+                )
                 
                 # 写入处理后的帧
                 out.write(processed_frame)
@@ -744,10 +771,21 @@ def process_emotion_recognition(request):
                     )
                 
                 # 保存JSON数据到emotion_analysis_json字段
-                course_time.emotion_analysis_json = json_data
+                if camera_session:
+                    camera_session.flush()
+                    course_time.refresh_from_db(fields=['emotion_analysis_json'])
+                else:
+                    course_time.emotion_analysis_json = json_data
                 course_time.save()
                 
                 print(f"成功将处理后的视频和JSON数据保存到课程时间记录 {course_time_id}, 记录ID: {course_time.id}, 处理后的视频路径: {course_time.processed_recording_path.path if course_time.processed_recording_path else '未设置'}")
+                
+                # 保存封面和时间轴雪碧图
+                thumbnail_collector.save(course_time)
+                
+                # 在后台为处理后的录像生成HLS切片
+                from course_management.hls import generate_course_time_hls_async
+                generate_course_time_hls_async(course_time)
             except Exception as e:
                 print(f"保存到课程时间记录时出错: {e}")
                 import traceback
@@ -0,0 +1,287 @@
+"""
+实时分析的推理进程池
+
+单个进程里的推理受 GIL 和单个 ONNX 会话限制。开启 REALTIME_WORKER_PROCESSES 后，
+识别交给若干个推理进程执行：
+
+- 每个推理进程有一块 multiprocessing.shared_memory 环形缓冲区，分成若干个帧槽。
+  主进程把解码后的帧直接写入空闲的槽，任务队列里只传槽号、尺寸等小元组，帧数据不经过 pickle；
+  需要回传绘制好的图像时，推理进程把结果写回同一个槽。
+- 推理进程只回传小的结果字典（人脸框、名字、状态和统计）。
+- 每个连接固定路由到同一个推理进程，跟踪器和状态统计保存在该进程中；
+  连接结束时取回统计计数，由主进程写入数据库。
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+WORKER_PROCESSES = getattr(settings, 'REALTIME_WORKER_PROCESSES', 0)
+# 每个推理进程的帧槽数量和单个槽的字节数（默认可容纳 640x960 的 BGR 图像）
+SLOTS_PER_WORKER = getattr(settings, 'REALTIME_WORKER_SLOTS', 4)
+SLOT_BYTES = getattr(settings, 'REALTIME_WORKER_SLOT_BYTES', 640 * 960 * 3)
+# 等待推理结果的超时时间（秒），超时通常意味着推理进程已经退出
+RESULT_TIMEOUT = getattr(settings, 'REALTIME_WORKER_TIMEOUT', 30)
+
+TASK_FRAME = 'frame'
+TASK_RESET = 'reset'
+TASK_DRAIN = 'drain'
+TASK_CLOSE = 'close'
+TASK_STOP = 'stop'
+
+
+class WorkerError(RuntimeError):
+    """推理进程处理失败或没有在超时时间内返回结果"""
+
+
+class WorkerTimeout(WorkerError):
+    """推理进程没有在超时时间内返回结果，帧槽要等迟到的结果返回后才能复用"""
+
+
+def _worker_main(index, shm_name, slot_bytes, tasks, results):
+    """推理进程入口：按顺序处理任务，连接的会话状态保存在本进程中"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zwky_api.settings')
+    import django
+    django.setup()
+    from .pipeline import _infer_local
+    from .realtime import AnalysisSession
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    sessions = {}
+    try:
+        while True:
+            task = tasks.get()
+            kind, task_id, session_key = task[:3]
+            if kind == TASK_STOP:
+                break
+            try:
+                if kind == TASK_FRAME:
+                    slot, shape, metadata_only, timestamp = task[3:]
+                    offset = slot * slot_bytes
+                    frame = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset).copy()
+                    session = sessions.setdefault(session_key, AnalysisSession())
+                    if timestamp is not None:
+                        # 录像分析：状态记录在录像内的时间
+                        session.aggregator.clock = lambda: timestamp
+                    result, processed = _infer_local(session, frame, metadata_only)
+                    wrote_frame = False
+                    if not metadata_only and processed is not None and processed.shape == tuple(shape):
+                        # 绘制好的图像写回同一个槽，由主进程编码
+                        np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset)[...] = processed
+                        wrote_frame = True
+                    results.put((task_id, result, wrote_frame, None))
+                elif kind == TASK_RESET:
+                    if session_key in sessions:
+                        sessions[session_key].reset()
+                    results.put((task_id, None, False, None))
+                elif kind in (TASK_DRAIN, TASK_CLOSE):
+                    # 取回未写入数据库的计数；连接结束时同时移除会话
+                    session = sessions.pop(session_key, None) if kind == TASK_CLOSE else sessions.get(session_key)
+                    observations = session.aggregator.drain() if session else {}
+                    pending = {
+                        name: {start: dict(stats) for start, stats in buckets.items()}
+                        for name, buckets in observations.items()
+                    }
+                    results.put((task_id, pending, False, None))
+            except Exception as e:
+                logger.exception(f"推理进程 {index} 处理任务失败")
+                results.put((task_id, None, False, str(e)))
+    finally:
+        shm.close()
+
+
+class _Worker:
+    """主进程中对一个推理进程的引用"""
+
+    def __init__(self, index, context, results):
+        self.index = index
+        self.context = context
+        self.results = results
+        self.shm = shared_memory.SharedMemory(create=True, size=SLOTS_PER_WORKER * SLOT_BYTES)
+        self.free_slots = queue.Queue()
+        for slot in range(SLOTS_PER_WORKER):
+            self.free_slots.put(slot)
+        self.connections = 0
+        self.start()
+
+    def start(self):
+        self.tasks = self.context.Queue()
+        self.process = self.context.Process(
+            target=_worker_main,
+            args=(self.index, self.shm.name, SLOT_BYTES, self.tasks, self.results),
+            name=f'inference-worker-{self.index}',
+            daemon=True,
+        )
+        self.process.start()
+
+    def slot_view(self, slot, shape):
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * SLOT_BYTES)
+
+    def shutdown(self):
+        try:
+            self.tasks.put((TASK_STOP, None, None))
+            self.process.join(timeout=5)
+        finally:
+            if self.process.is_alive():
+                self.process.terminate()
+            self.shm.close()
+            self.shm.unlink()
+
+
+class InferenceWorkerPool:
+    """推理进程池，线程安全，可以在推理线程池的多个线程中同时调用"""
+
+    def __init__(self, processes):
+        # spawn 启动，避免在已经加载了模型和线程的进程上 fork
+        self.context = multiprocessing.get_context('spawn')
+        self.results = self.context.Queue()
+        self.workers = [_Worker(index, self.context, self.results) for index in range(processes)]
+        self._routes = {}  # session_key -> _Worker
+        self._futures = {}
+        self._late_slots = {}  # 超时任务的 task_id -> (_Worker, 槽号)，结果返回后才放回空闲列表
+        self._task_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._dispatcher = threading.Thread(target=self._dispatch, name='inference-results', daemon=True)
+        self._dispatcher.start()
+
+    def _dispatch(self):
+        """把推理进程返回的结果交给等待中的调用方"""
+        while True:
+            item = self.results.get()
+            if item is None:
+                return
+            task_id = item[0]
+            with self._lock:
+                future = self._futures.pop(task_id, None)
+                late = self._late_slots.pop(task_id, None) if future is None else None
+            if future is not None:
+                future.set_result(item[1:])
+            elif late is not None:
+                # 超时任务的结果终于返回，推理进程不再读写这个槽
+                worker, slot = late
+                worker.free_slots.put(slot)
+
+    def _worker_for(self, session_key):
+        """同一个连接始终路由到同一个推理进程，新连接分给连接数最少的进程"""
+        with self._lock:
+            worker = self._routes.get(session_key)
+            if worker is None:
+                worker = min(self.workers, key=lambda w: w.connections)
+                worker.connections += 1
+                self._routes[session_key] = worker
+            if not worker.process.is_alive():
+                # 推理进程意外退出时重启，该进程上的会话状态会丢失；等待迟到结果的槽不会再被写入，直接收回
+                logger.error(f"推理进程 {worker.index} 已退出，正在重启")
+                for task_id, (late_worker, slot) in list(self._late_slots.items()):
+                    if late_worker is worker:
+                        del self._late_slots[task_id]
+                        worker.free_slots.put(slot)
+                worker.start()
+            return worker
+
+    def _submit(self, worker, task, slot=None):
+        """
+        提交任务并等待结果；任务使用帧槽时传入 slot
+        超时时推理进程可能仍在读写这个槽，槽由结果分发线程在迟到的结果返回后放回，并抛出 WorkerTimeout
+        """
+        task_id = next(self._task_ids)
+        future = Future()
+        with self._lock:
+            self._futures[task_id] = future
+        worker.tasks.put((task[0], task_id) + task[1:])
+        try:
+            result, wrote_frame, error = future.result(timeout=RESULT_TIMEOUT)
+        except Exception:
+            with self._lock:
+                pending = self._futures.pop(task_id, None) is not None
+                if pending and slot is not None:
+                    self._late_slots[task_id] = (worker, slot)
+            if pending:
+                raise WorkerTimeout(f"推理进程 {worker.index} 没有在 {RESULT_TIMEOUT} 秒内返回结果")
+            # 超时的同时结果已经返回
+            result, wrote_frame, error = future.result()
+        if error:
+            raise WorkerError(error)
+        return result, wrote_frame
+
+    def infer(self, session_key, frame, metadata_only, timestamp=None):
+        """
+        识别一帧（已解码的 BGR 图像）；timestamp 是该帧的记录时间（秒），不指定时使用推理进程的当前时间
+        返回 (结果字典, 绘制好的图像)；只返回结构化结果时图像为 None
+        """
+        if frame.nbytes > SLOT_BYTES:
+            raise ValueError(f"帧大小 {frame.shape} 超过了帧槽容量")
+        worker = self._worker_for(session_key)
+        slot = worker.free_slots.get(timeout=RESULT_TIMEOUT)
+        try:
+            worker.slot_view(slot, frame.shape)[...] = frame
+            result, wrote_frame = self._submit(
+                worker, (TASK_FRAME, session_key, slot, frame.shape, metadata_only, timestamp), slot=slot
+            )
+            processed = worker.slot_view(slot, frame.shape).copy() if wrote_frame else None
+        except WorkerTimeout:
+            # 槽仍被推理进程占用，由结果分发线程在结果返回后放回
+            raise
+        except BaseException:
+            worker.free_slots.put(slot)
+            raise
+        worker.free_slots.put(slot)
+        return result, processed
+
+    def reset(self, session_key):
+        with self._lock:
+            worker = self._routes.get(session_key)
+        if worker is not None:
+            self._submit(worker, (TASK_RESET, session_key))
+
+    def drain(self, session_key):
+        """取出该连接尚未写入数据库的计数，格式与 StatusAggregator.drain 相同"""
+        with self._lock:
+            worker = self._routes.get(session_key)
+        if worker is None:
+            return {}
+        pending, _ = self._submit(worker, (TASK_DRAIN, session_key))
+        return pending
+
+    def close(self, session_key):
+        """连接结束，返回该连接尚未写入数据库的计数"""
+        with self._lock:
+            worker = self._routes.pop(session_key, None)
+            if worker is not None:
+                worker.connections -= 1
+        if worker is None:
+            return {}
+        pending, _ = self._submit(worker, (TASK_CLOSE, session_key))
+        return pending
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.shutdown()
+        self.results.put(None)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    """返回推理进程池，未开启 REALTIME_WORKER_PROCESSES 时返回 None"""
+    global _pool
+    if not WORKER_PROCESSES:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            import atexit
+            _pool = InferenceWorkerPool(WORKER_PROCESSES)
+            atexit.register(_pool.shutdown)
+            logger.info(f"已启动 {WORKER_PROCESSES} 个推理进程")
+        return _pool
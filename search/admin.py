@@ -0,0 +1,8 @@
+from django.contrib import admin
+from .models import SearchDocument
+
+@admin.register(SearchDocument)
+class SearchDocumentAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'object_id', 'course', 'title', 'created_at')
+    list_filter = ('kind', 'course')
+    search_fields = ('title', 'body')
@@ -0,0 +1,197 @@
+"""
+全文索引的数据库后端
+
+- SQLite：FTS5 外部内容表（external content）建在 search_searchdocument 上，由触发器同步，
+  优先使用 trigram 分词器，中文也可以按子串检索；按 bm25 排序（标题权重更高），用 highlight/snippet 高亮。
+  trigram 要求每个检索词至少 3 个字符，更短的词退回到普通的子串匹配。
+- MySQL：title、body 上的 FULLTEXT 索引，使用 ngram 分词器支持中文，按 MATCH ... AGAINST 的相关度排序。
+- 其他数据库：子串匹配，按时间倒序，不计算相关度。
+
+高亮标记先用控制字符表示，HTML 转义后再替换为 <mark>，搜索结果中的原文不会被当作 HTML。
+"""
+import html
+import logging
+import re
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'search_searchdocument_fts'
+FULLTEXT_INDEX = 'search_document_fulltext'
+DOCUMENT_TABLE = 'search_searchdocument'
+
+# 高亮标记，渲染时转换为 <mark>
+MARK_START = '\x02'
+MARK_END = '\x03'
+# 摘要的长度（字符数）
+SNIPPET_CHARS = 64
+# 一次检索最多使用的检索词个数
+MAX_TERMS = 10
+
+
+def create_index(schema_editor):
+    """创建全文索引（迁移中调用）"""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+                f"title, body, content='{DOCUMENT_TABLE}', content_rowid='id', tokenize='trigram')"
+            )
+        except Exception:
+            # SQLite 3.34 之前没有 trigram 分词器
+            logger.warning("SQLite 不支持 trigram 分词器，中文检索只能匹配完整的词")
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+                f"title, body, content='{DOCUMENT_TABLE}', content_rowid='id')"
+            )
+        schema_editor.execute(
+            f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {DOCUMENT_TABLE} BEGIN "
+            f"INSERT INTO {FTS_TABLE}(rowid, title, body) VALUES (new.id, new.title, new.body); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {DOCUMENT_TABLE} BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE ON {DOCUMENT_TABLE} BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); "
+            f"INSERT INTO {FTS_TABLE}(rowid, title, body) VALUES (new.id, new.title, new.body); END"
+        )
+        schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    elif vendor == 'mysql':
+        schema_editor.execute(
+            f"ALTER TABLE {DOCUMENT_TABLE} ADD FULLTEXT INDEX {FULLTEXT_INDEX} (title, body) WITH PARSER ngram"
+        )
+
+
+def drop_index(schema_editor):
+    """删除全文索引（迁移回滚时调用）"""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif vendor == 'mysql':
+        schema_editor.execute(f"ALTER TABLE {DOCUMENT_TABLE} DROP INDEX {FULLTEXT_INDEX}")
+
+
+def parse_terms(query):
+    """按空白拆分检索词，去重并保持顺序"""
+    terms = []
+    for term in (query or '').split():
+        if term not in terms:
+            terms.append(term)
+    return terms[:MAX_TERMS]
+
+
+def _sqlite_tokenizer():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sql FROM sqlite_master WHERE name = %s", [FTS_TABLE])
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return 'trigram' if 'trigram' in row[0] else 'unicode61'
+
+
+def search(queryset, query, limit=20, offset=0):
+    """
+    在 queryset（已按课程、类型过滤的 SearchDocument）中检索，按相关度排序
+    返回 [{'document', 'score', 'title', 'snippet'}]，title 和 snippet 是高亮后的 HTML；limit 为 None 时返回全部结果
+    """
+    terms = parse_terms(query)
+    if not terms:
+        return []
+    if connection.vendor == 'sqlite':
+        tokenizer = _sqlite_tokenizer()
+        if tokenizer == 'unicode61' or (tokenizer == 'trigram' and all(len(term) >= 3 for term in terms)):
+            return _search_sqlite(queryset, terms, limit, offset)
+    elif connection.vendor == 'mysql':
+        return _search_mysql(queryset, terms, limit, offset)
+    return _search_substring(queryset, terms, limit, offset)
+
+
+def _search_sqlite(queryset, terms, limit, offset):
+    # 每个检索词作为短语，多个词之间是 AND
+    match = ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+    ids_sql, ids_params = queryset.values('id').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, bm25({FTS_TABLE}, 4.0, 1.0), "
+            f"highlight({FTS_TABLE}, 0, %s, %s), snippet({FTS_TABLE}, 1, %s, %s, '…', 24) "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rowid IN ({ids_sql}) "
+            f"ORDER BY 2 LIMIT %s OFFSET %s",
+            [MARK_START, MARK_END, MARK_START, MARK_END, match, *ids_params,
+             -1 if limit is None else limit, offset]
+        )
+        rows = cursor.fetchall()
+    documents = queryset.in_bulk([row[0] for row in rows])
+    return [
+        {
+            'document': documents[rowid],
+            # bm25 越小越相关，取反后越大越相关
+            'score': -rank,
+            'title': render(title),
+            'snippet': render(snippet),
+        }
+        for rowid, rank, title, snippet in rows if rowid in documents
+    ]
+
+
+def _search_mysql(queryset, terms, limit, offset):
+    # 布尔模式下每个检索词都必须出现
+    against = ' '.join('+"{}"'.format(term.replace('"', ' ')) for term in terms)
+    match = RawSQL(f"MATCH ({DOCUMENT_TABLE}.title, {DOCUMENT_TABLE}.body) AGAINST (%s IN BOOLEAN MODE)", [against])
+    documents = queryset.annotate(score=match).filter(score__gt=0).order_by('-score', '-created_at')
+    return _with_highlights(_slice(documents, limit, offset), terms)
+
+
+def _search_substring(queryset, terms, limit, offset):
+    condition = Q()
+    for term in terms:
+        condition &= Q(title__icontains=term) | Q(body__icontains=term)
+    documents = queryset.filter(condition).order_by('-created_at', '-id')
+    return _with_highlights(_slice(documents, limit, offset), terms, score=False)
+
+
+def _slice(queryset, limit, offset):
+    return queryset[offset:] if limit is None else queryset[offset:offset + limit]
+
+
+def _with_highlights(documents, terms, score=True):
+    return [
+        {
+            'document': document,
+            'score': float(document.score) if score else None,
+            'title': render(mark_terms(document.title, terms)),
+            'snippet': render(mark_terms(snippet_text(document.body, terms), terms)),
+        }
+        for document in documents
+    ]
+
+
+def mark_terms(text, terms):
+    """在文本中标记检索词（不区分大小写）"""
+    if not text:
+        return ''
+    pattern = re.compile('|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    return pattern.sub(lambda m: f'{MARK_START}{m.group(0)}{MARK_END}', text)
+
+
+def snippet_text(text, terms, length=SNIPPET_CHARS):
+    """截取第一个检索词附近的一段文本"""
+    if not text or len(text) <= length:
+        return text or ''
+    lowered = text.lower()
+    positions = [lowered.find(term.lower()) for term in terms]
+    positions = [position for position in positions if position >= 0]
+    start = max(0, min(positions) - length // 4) if positions else 0
+    end = min(len(text), start + length)
+    return ('…' if start > 0 else '') + text[start:end] + ('…' if end < len(text) else '')
+
+
+def render(marked):
+    """转义 HTML，并把高亮标记转换为 <mark>"""
+    return html.escape(marked or '').replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
@@ -0,0 +1,64 @@
+"""
+维护全文索引中的文档
+
+每类数据对应一个 SOURCES 条目：来源模型和把一条数据转换为 (课程ID, 标题, 正文, 创建时间) 的函数。
+单条数据的增删由 signals 调用 index_object/remove_object，聊天消息的批量写入调用 index_objects。
+"""
+from django.apps import apps as django_apps
+
+SOURCES = {
+    'chat': ('chat', 'ChatMessage', lambda m: (m.course_id, '', m.text, m.timestamp)),
+    'resource': ('course_management', 'CourseResource', lambda r: (r.course_id, r.name, r.description or '', r.upload_time)),
+    'announcement': ('advanced_features', 'CourseAnnouncement', lambda a: (a.course_id, a.title, a.content, a.created_at)),
+}
+
+# 重建索引时每批写入的文档数
+REBUILD_BATCH_SIZE = 500
+
+
+def _document_fields(kind, instance):
+    course_id, title, body, created_at = SOURCES[kind][2](instance)
+    return {'course_id': course_id, 'title': title[:255], 'body': body, 'created_at': created_at}
+
+
+def index_object(kind, instance):
+    """新增或更新一条数据的索引"""
+    from .models import SearchDocument
+
+    SearchDocument.objects.update_or_create(
+        kind=kind, object_id=instance.pk, defaults=_document_fields(kind, instance)
+    )
+
+
+def index_objects(kind, instances):
+    """批量索引新写入的数据，已经索引过的跳过"""
+    from .models import SearchDocument
+
+    SearchDocument.objects.bulk_create(
+        [SearchDocument(kind=kind, object_id=instance.pk, **_document_fields(kind, instance)) for instance in instances],
+        ignore_conflicts=True
+    )
+
+
+def remove_object(kind, object_id):
+    from .models import SearchDocument
+
+    SearchDocument.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def rebuild_index(get_model=django_apps.get_model):
+    """清空并重新索引所有数据，返回索引的文档数；迁移中传入历史模型的 get_model"""
+    SearchDocument = get_model('search', 'SearchDocument')
+    SearchDocument.objects.all().delete()
+    total = 0
+    for kind, (app_label, model_name, _) in SOURCES.items():
+        batch = []
+        for instance in get_model(app_label, model_name).objects.all().iterator():
+            batch.append(SearchDocument(kind=kind, object_id=instance.pk, **_document_fields(kind, instance)))
+            if len(batch) >= REBUILD_BATCH_SIZE:
+                SearchDocument.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+        SearchDocument.objects.bulk_create(batch)
+        total += len(batch)
+    return total
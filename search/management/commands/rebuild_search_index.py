@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from search.index import rebuild_index
+
+
+class Command(BaseCommand):
+    help = '根据聊天消息、课程资源和课程公告重新生成全文索引'
+
+    def handle(self, *args, **options):
+        total = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'全文索引已重建，共索引 {total} 条文档'))
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:55
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('course_management', '0015_coursetime_thumbnails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('chat', '聊天消息'), ('resource', '课程资源'), ('announcement', '课程公告')], max_length=20, verbose_name='类型')),
+                ('object_id', models.BigIntegerField(verbose_name='原数据ID')),
+                ('title', models.CharField(blank=True, default='', max_length=255, verbose_name='标题')),
+                ('body', models.TextField(blank=True, default='', verbose_name='正文')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='创建时间')),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_documents', to='course_management.course', verbose_name='所属课程')),
+            ],
+            options={
+                'verbose_name': '搜索文档',
+                'verbose_name_plural': '搜索文档',
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+    ]
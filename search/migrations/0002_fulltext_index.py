@@ -0,0 +1,30 @@
+from django.db import migrations
+
+from search.backends import create_index, drop_index
+from search.index import rebuild_index
+
+
+def forwards(apps, schema_editor):
+    create_index(schema_editor)
+
+
+def backwards(apps, schema_editor):
+    drop_index(schema_editor)
+
+
+def index_existing(apps, schema_editor):
+    rebuild_index(apps.get_model)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0001_initial'),
+        ('advanced_features', '0002_graderecord'),
+        ('chat', '0005_read_state'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+        migrations.RunPython(index_existing, migrations.RunPython.noop),
+    ]
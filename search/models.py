@@ -0,0 +1,30 @@
+from django.db import models
+from django.utils import timezone
+from course_management.models import Course
+
+
+class SearchDocument(models.Model):
+    """
+    全文索引中的一条文档，对应一条聊天消息、课程资源或课程公告
+    由 signals 保持与原数据同步，全文索引建在 title 和 body 上（见 backends）
+    """
+    KIND_CHOICES = [
+        ('chat', '聊天消息'),
+        ('resource', '课程资源'),
+        ('announcement', '课程公告'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name='类型')
+    object_id = models.BigIntegerField(verbose_name='原数据ID')
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='search_documents', verbose_name='所属课程')
+    title = models.CharField(max_length=255, blank=True, default='', verbose_name='标题')
+    body = models.TextField(blank=True, default='', verbose_name='正文')
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='创建时间')
+
+    class Meta:
+        verbose_name = '搜索文档'
+        verbose_name_plural = verbose_name
+        unique_together = ['kind', 'object_id']
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.object_id}: {(self.title or self.body)[:50]}"
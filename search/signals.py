@@ -0,0 +1,36 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from advanced_features.models import CourseAnnouncement
+from chat.models import ChatMessage
+from chat.signals import messages_created
+from course_management.models import CourseResource
+from .index import index_object, index_objects, remove_object
+
+# 来源模型 -> 索引中的类型
+INDEXED_MODELS = {
+    ChatMessage: 'chat',
+    CourseResource: 'resource',
+    CourseAnnouncement: 'announcement',
+}
+
+@receiver(post_save, sender=ChatMessage)
+@receiver(post_save, sender=CourseResource)
+@receiver(post_save, sender=CourseAnnouncement)
+def index_saved_object(sender, instance, raw=False, **kwargs):
+    """聊天消息、课程资源、课程公告保存后更新全文索引"""
+    # 加载 fixture 时不更新索引
+    if raw:
+        return
+    index_object(INDEXED_MODELS[sender], instance)
+
+@receiver(post_delete, sender=ChatMessage)
+@receiver(post_delete, sender=CourseResource)
+@receiver(post_delete, sender=CourseAnnouncement)
+def remove_deleted_object(sender, instance, **kwargs):
+    """删除后从全文索引中移除"""
+    remove_object(INDEXED_MODELS[sender], instance.pk)
+
+@receiver(messages_created, sender=ChatMessage)
+def index_written_messages(sender, messages, **kwargs):
+    """延迟批量写入的聊天消息（bulk_create 不发送 post_save）"""
+    index_objects('chat', messages)
@@ -0,0 +1,134 @@
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from rest_framework.test import APITestCase, APIClient
+from advanced_features.models import CourseAnnouncement
+from chat.models import ChatMessage
+from chat.persistence import ChatWriteBuffer
+from course_management.models import Course, CourseResource, StudentCourse
+from user_management.models import Teacher
+from .backends import mark_terms, render, snippet_text
+from .models import SearchDocument
+
+User = get_user_model()
+
+
+class SearchViewTests(APITestCase):
+    def setUp(self):
+        """测试数据初始化"""
+        self.teacher_user = User.objects.create_user(username='teacher1', password='testpass123', role='teacher')
+        self.teacher = Teacher.objects.get(user=self.teacher_user)
+        self.course = Course.objects.create(title='测试课程', teacher=self.teacher)
+        self.other_course = Course.objects.create(title='其他课程')
+
+        self.student_user = User.objects.create_user(username='student1', password='testpass123', role='student')
+        StudentCourse.objects.create(student=self.student_user.student_profile, course=self.course)
+
+        self.resource = CourseResource.objects.create(
+            name='线性代数期末复习提纲', type='pdf', description='包括矩阵运算和特征值', size='1MB',
+            course=self.course, uploader=self.teacher_user
+        )
+        CourseAnnouncement.objects.create(
+            title='期末考试安排', content='线性代数期末复习课在周五，请带上<笔记>',
+            course=self.course, publisher=self.teacher_user
+        )
+        ChatMessage.objects.create(sender=self.student_user, course=self.course, text='老师，线性代数期末考试范围是什么？')
+        ChatMessage.objects.create(sender=self.student_user, course=self.other_course, text='线性代数期末复习提纲在哪里')
+
+        self.client = APIClient()
+        self.url = reverse('search')
+
+    def test_ranked_and_highlighted_results(self):
+        """检索聊天消息、资源和公告，标题命中的排在前面，命中的部分高亮且原文被转义"""
+        self.client.force_authenticate(user=self.teacher_user)
+        response = self.client.get(self.url, {'q': '线性代数 期末复习'})
+        self.assertEqual(response.data['code'], 200)
+        items = response.data['data']['items']
+
+        self.assertEqual([item['type'] for item in items], ['resource', 'announcement'])
+        self.assertEqual(items[0]['id'], self.resource.id)
+        self.assertIn('<mark>线性代数</mark>', items[0]['title'])
+        self.assertIn('&lt;笔记&gt;', items[1]['snippet'])
+        self.assertGreater(items[0]['score'], items[1]['score'])
+
+    def test_results_limited_to_member_courses(self):
+        """只能检索自己的课程"""
+        self.client.force_authenticate(user=self.student_user)
+        response = self.client.get(self.url, {'q': '线性代数期末', 'type': 'chat'})
+        items = response.data['data']['items']
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0]['course_id'], self.course.course_id)
+
+        response = self.client.get(self.url, {'q': '线性代数', 'course_id': self.other_course.course_id})
+        self.assertEqual(response.data['code'], 403)
+
+    def test_invalid_course_id(self):
+        """course_id 不是数字时返回 400"""
+        superuser = User.objects.create_superuser(username='admin', password='testpass123')
+        self.client.force_authenticate(user=superuser)
+        response = self.client.get(self.url, {'q': '线性代数', 'course_id': 'abc'})
+        self.assertEqual(response.data['code'], 400)
+
+    def test_short_terms_and_index_sync(self):
+        """两个字的检索词也能命中；资源修改和删除后索引同步更新"""
+        self.client.force_authenticate(user=self.teacher_user)
+        response = self.client.get(self.url, {'q': '矩阵'})
+        self.assertEqual([item['id'] for item in response.data['data']['items']], [self.resource.id])
+        self.assertIn('<mark>矩阵</mark>', response.data['data']['items'][0]['snippet'])
+
+        self.resource.description = '包括向量空间'
+        self.resource.save()
+        self.assertEqual(self.client.get(self.url, {'q': '矩阵'}).data['data']['items'], [])
+        self.assertEqual(len(self.client.get(self.url, {'q': '向量空间'}).data['data']['items']), 1)
+
+        self.resource.delete()
+        self.assertFalse(SearchDocument.objects.filter(kind='resource').exists())
+
+    def test_course_resource_search_uses_index(self):
+        """课程资源列表的 search 参数使用全文索引"""
+        CourseResource.objects.create(name='实验报告模板', type='doc', size='1MB', course=self.course)
+        self.client.force_authenticate(user=self.teacher_user)
+        url = reverse('course-resources', kwargs={'course_id': self.course.course_id})
+        response = self.client.get(url, {'search': '复习提纲'})
+        self.assertEqual(response.data['data']['total'], 1)
+        self.assertEqual(response.data['data']['items'][0]['name'], '线性代数期末复习提纲')
+
+
+class SearchHighlightTests(TestCase):
+    def test_snippet_around_first_match(self):
+        """摘要截取第一个命中附近的文本"""
+        text = '前言' * 50 + '特征值分解' + '结尾' * 50
+        snippet = snippet_text(text, ['特征值'])
+        self.assertIn('特征值', snippet)
+        self.assertTrue(snippet.startswith('…') and snippet.endswith('…'))
+        self.assertEqual(render(mark_terms('a<b>特征值', ['特征值'])), 'a&lt;b&gt;<mark>特征值</mark>')
+
+
+class WriteBehindIndexTests(TransactionTestCase):
+    def test_batched_messages_are_indexed(self):
+        """延迟批量写入的聊天消息也进入全文索引"""
+        user = User.objects.create_user(username='testuser')
+        course = Course.objects.create(title='测试课程')
+        buffer = ChatWriteBuffer(batch_size=10, interval_ms=20)
+        for text in ('第一条消息', '第二条消息'):
+            buffer.add(ChatMessage(sender=user, course=course, text=text))
+        buffer.stop()
+
+        documents = SearchDocument.objects.filter(kind='chat').order_by('object_id')
+        self.assertEqual([d.body for d in documents], ['第一条消息', '第二条消息'])
+
+    def test_batched_messages_are_indexed_without_returned_ids(self):
+        """bulk_create 不回填主键（如 MySQL）时按 uid 重新读取后建立索引"""
+        user = User.objects.create_user(username='testuser')
+        course = Course.objects.create(title='测试课程')
+        buffer = ChatWriteBuffer(batch_size=10, interval_ms=20)
+        features = type(connection.features)
+        with mock.patch.object(features, 'can_return_rows_from_bulk_insert', new_callable=mock.PropertyMock,
+                               return_value=False):
+            buffer.add(ChatMessage(sender=user, course=course, text='没有回填主键的消息'))
+            buffer.stop()
+
+        document = SearchDocument.objects.get(kind='chat')
+        self.assertEqual(document.object_id, ChatMessage.objects.get().id)
@@ -0,0 +1,90 @@
+from rest_framework.views import APIView
+from rest_framework.permissions import IsAuthenticated
+from course_management.models import Course, StudentCourse
+from user_management.utils import api_response
+from .backends import search
+from .models import SearchDocument
+
+# 每页结果数
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def accessible_course_ids(user):
+    """用户可以检索的课程：授课教师的课程或学生选的课程；管理员为 None（不限制）"""
+    if user.is_superuser:
+        return None
+    if user.role == 'teacher':
+        teacher = getattr(user, 'teacher_profile', None)
+        if teacher is None:
+            return []
+        return list(Course.objects.filter(teacher=teacher).values_list('course_id', flat=True))
+    if user.role == 'student':
+        student = getattr(user, 'student_profile', None)
+        if student is None:
+            return []
+        return list(StudentCourse.objects.filter(student=student).values_list('course_id', flat=True))
+    return []
+
+
+class SearchView(APIView):
+    """
+    全文检索聊天消息、课程资源和课程公告
+    参数：q 检索词（空格分隔，需全部命中），course_id 限定课程，type 限定类型（chat/resource/announcement），
+    limit、offset 分页；结果按相关度排序，title 和 snippet 中命中的部分用 <mark> 标记
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return api_response(code=400, message="请输入检索词", data=None)
+
+        documents = SearchDocument.objects.all()
+
+        course_ids = accessible_course_ids(request.user)
+        course_id = request.query_params.get('course_id')
+        if course_id:
+            try:
+                course_id = int(course_id)
+            except ValueError:
+                return api_response(code=400, message="课程ID无效", data=None)
+            if course_ids is not None and course_id not in course_ids:
+                return api_response(code=403, message="您没有权限检索此课程", data=None)
+            documents = documents.filter(course_id=course_id)
+        elif course_ids is not None:
+            documents = documents.filter(course_id__in=course_ids)
+
+        kind = request.query_params.get('type')
+        if kind:
+            if kind not in dict(SearchDocument.KIND_CHOICES):
+                return api_response(code=400, message="不支持的类型", data=None)
+            documents = documents.filter(kind=kind)
+
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', DEFAULT_LIMIT)), MAX_LIMIT))
+            offset = max(0, int(request.query_params.get('offset', 0)))
+        except ValueError:
+            return api_response(code=400, message="分页参数无效", data=None)
+
+        results = search(documents, query, limit=limit, offset=offset)
+        return api_response(
+            code=200,
+            message="检索成功",
+            data={
+                "items": [
+                    {
+                        "type": result['document'].kind,
+                        "id": result['document'].object_id,
+                        "course_id": result['document'].course_id,
+                        "title": result['title'],
+                        "snippet": result['snippet'],
+                        "score": result['score'],
+                        "created_at": result['document'].created_at.strftime("%Y-%m-%d %H:%M:%S"),
+                    }
+                    for result in results
+                ],
+                "limit": limit,
+                "offset": offset
+            }
+        )
@@ -1,8 +1,25 @@
 from django.contrib import admin
-from .models import Status
+from .models import Status, StudentCourseAttention, CourseWeeklyAttention, ClassCourseAttention
 
 @admin.register(Status)
 class StatusAdmin(admin.ModelAdmin):
     list_display = ('id', 'student', 'course_time', 'concentrate', 'sleepy', 'low_head', 'if_come')
     list_filter = ('student', 'course_time', 'if_come')
     search_fields = ('student__user__username', 'course_time__course__title')
+
+
+@admin.register(StudentCourseAttention)
+class StudentCourseAttentionAdmin(admin.ModelAdmin):
+    list_display = ('student', 'course', 'session_count', 'total_records', 'focused_count', 'updated_at')
+    list_filter = ('course',)
+    search_fields = ('student__user__username', 'course__title')
+
+@admin.register(CourseWeeklyAttention)
+class CourseWeeklyAttentionAdmin(admin.ModelAdmin):
+    list_display = ('course', 'week_start', 'session_count', 'total_records', 'focused_count', 'updated_at')
+    list_filter = ('course',)
+
+@admin.register(ClassCourseAttention)
+class ClassCourseAttentionAdmin(admin.ModelAdmin):
+    list_display = ('class_id', 'course', 'session_count', 'total_records', 'focused_count', 'updated_at')
+    list_filter = ('course',)
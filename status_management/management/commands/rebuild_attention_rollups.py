@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from status_management.rollups import rebuild_attention_rollups
+
+
+class Command(BaseCommand):
+    help = '根据所有课次的情绪分析结果重新生成注意力汇总表'
+
+    def handle(self, *args, **options):
+        processed = rebuild_attention_rollups()
+        self.stdout.write(self.style.SUCCESS(f'注意力汇总表已重建，共处理 {processed} 个课次'))
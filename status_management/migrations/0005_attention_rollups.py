@@ -0,0 +1,94 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('class_management', '0003_alter_class_options_alter_teacherclass_options_and_more'),
+        ('course_management', '0012_coursetime_emotion_analysis_json_and_more'),
+        ('status_management', '0004_remove_created_at'),
+        ('user_management', '0009_remove_userbackground_user_delete_useravatar_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SessionAttentionContribution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('contribution', models.JSONField(default=dict)),
+                ('applied_at', models.DateTimeField(auto_now=True)),
+                ('course_time', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='attention_contribution', to='course_management.coursetime')),
+            ],
+            options={
+                'verbose_name': '课次注意力贡献',
+                'verbose_name_plural': '课次注意力贡献',
+            },
+        ),
+        migrations.CreateModel(
+            name='ClassCourseAttention',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_count', models.IntegerField(default=0, verbose_name='课次数')),
+                ('total_records', models.IntegerField(default=0, verbose_name='记录总数')),
+                ('focused_count', models.IntegerField(default=0, verbose_name='专注')),
+                ('distracted_count', models.IntegerField(default=0, verbose_name='分心')),
+                ('confused_count', models.IntegerField(default=0, verbose_name='困惑')),
+                ('head_down_count', models.IntegerField(default=0, verbose_name='低头')),
+                ('turning_count', models.IntegerField(default=0, verbose_name='转头')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('class_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attention_rollups', to='class_management.class')),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='class_attention_rollups', to='course_management.course')),
+            ],
+            options={
+                'verbose_name': '班级课程注意力汇总',
+                'verbose_name_plural': '班级课程注意力汇总',
+                'unique_together': {('class_id', 'course')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CourseWeeklyAttention',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_count', models.IntegerField(default=0, verbose_name='课次数')),
+                ('total_records', models.IntegerField(default=0, verbose_name='记录总数')),
+                ('focused_count', models.IntegerField(default=0, verbose_name='专注')),
+                ('distracted_count', models.IntegerField(default=0, verbose_name='分心')),
+                ('confused_count', models.IntegerField(default=0, verbose_name='困惑')),
+                ('head_down_count', models.IntegerField(default=0, verbose_name='低头')),
+                ('turning_count', models.IntegerField(default=0, verbose_name='转头')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('week_start', models.DateField(verbose_name='周开始日期')),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='weekly_attention_rollups', to='course_management.course')),
+            ],
+            options={
+                'verbose_name': '课程周注意力汇总',
+                'verbose_name_plural': '课程周注意力汇总',
+                'ordering': ['week_start'],
+                'unique_together': {('course', 'week_start')},
+            },
+        ),
+        migrations.CreateModel(
+            name='StudentCourseAttention',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_count', models.IntegerField(default=0, verbose_name='课次数')),
+                ('total_records', models.IntegerField(default=0, verbose_name='记录总数')),
+                ('focused_count', models.IntegerField(default=0, verbose_name='专注')),
+                ('distracted_count', models.IntegerField(default=0, verbose_name='分心')),
+                ('confused_count', models.IntegerField(default=0, verbose_name='困惑')),
+                ('head_down_count', models.IntegerField(default=0, verbose_name='低头')),
+                ('turning_count', models.IntegerField(default=0, verbose_name='转头')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='student_attention_rollups', to='course_management.course')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attention_rollups', to='user_management.student')),
+            ],
+            options={
+                'verbose_name': '学生课程注意力汇总',
+                'verbose_name_plural': '学生课程注意力汇总',
+                'unique_together': {('student', 'course')},
+            },
+        ),
+    ]
@@ -21,3 +21,86 @@ class Status(models.Model):
         student_name = self.student.username if self.student else "未知学生"
         course_name = self.course_time.course.title if self.course_time and self.course_time.course else "未知课程"
         return f"{student_name} - {course_name} 状态"
+
+
+class AttentionRollup(models.Model):
+    """注意力汇总基类，保存按情绪状态累加的记录数"""
+    session_count = models.IntegerField(default=0, verbose_name='课次数')
+    total_records = models.IntegerField(default=0, verbose_name='记录总数')
+    focused_count = models.IntegerField(default=0, verbose_name='专注')
+    distracted_count = models.IntegerField(default=0, verbose_name='分心')
+    confused_count = models.IntegerField(default=0, verbose_name='困惑')
+    head_down_count = models.IntegerField(default=0, verbose_name='低头')
+    turning_count = models.IntegerField(default=0, verbose_name='转头')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+    
+    class Meta:
+        abstract = True
+    
+    @property
+    def focus_rate(self):
+        """专注记录占比（百分比）"""
+        if not self.total_records:
+            return None
+        return round(self.focused_count / self.total_records * 100, 2)
+
+
+class StudentCourseAttention(AttentionRollup):
+    """学生在某门课程上的注意力汇总"""
+    student = models.ForeignKey('user_management.Student', on_delete=models.CASCADE, related_name='attention_rollups')
+    course = models.ForeignKey('course_management.Course', on_delete=models.CASCADE, related_name='student_attention_rollups')
+    
+    class Meta:
+        app_label = 'status_management'
+        verbose_name = '学生课程注意力汇总'
+        verbose_name_plural = verbose_name
+        unique_together = ['student', 'course']
+    
+    def __str__(self):
+        return f"{self.student.username} - {self.course.title} 注意力汇总"
+
+
+class CourseWeeklyAttention(AttentionRollup):
+    """课程按周的注意力汇总，week_start 为该周周一"""
+    course = models.ForeignKey('course_management.Course', on_delete=models.CASCADE, related_name='weekly_attention_rollups')
+    week_start = models.DateField(verbose_name='周开始日期')
+    
+    class Meta:
+        app_label = 'status_management'
+        verbose_name = '课程周注意力汇总'
+        verbose_name_plural = verbose_name
+        unique_together = ['course', 'week_start']
+        ordering = ['week_start']
+    
+    def __str__(self):
+        return f"{self.course.title} - {self.week_start} 周注意力汇总"
+
+
+class ClassCourseAttention(AttentionRollup):
+    """班级在某门课程上的注意力汇总"""
+    class_id = models.ForeignKey('class_management.Class', on_delete=models.CASCADE, related_name='attention_rollups')
+    course = models.ForeignKey('course_management.Course', on_delete=models.CASCADE, related_name='class_attention_rollups')
+    
+    class Meta:
+        app_label = 'status_management'
+        verbose_name = '班级课程注意力汇总'
+        verbose_name_plural = verbose_name
+        unique_together = ['class_id', 'course']
+    
+    def __str__(self):
+        return f"{self.class_id.class_name} - {self.course.title} 注意力汇总"
+
+
+class SessionAttentionContribution(models.Model):
+    """记录某个课次已计入汇总表的数据，重新分析时先减去旧值再加上新值"""
+    course_time = models.OneToOneField('course_management.CourseTime', on_delete=models.CASCADE, related_name='attention_contribution')
+    contribution = models.JSONField(default=dict)
+    applied_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        app_label = 'status_management'
+        verbose_name = '课次注意力贡献'
+        verbose_name_plural = verbose_name
+    
+    def __str__(self):
+        return f"课次 {self.course_time_id} 注意力贡献"
@@ -0,0 +1,206 @@
+"""
+注意力汇总表的增量维护
+
+每次课次的情绪分析完成（CourseTime.emotion_analysis_json 更新）后，
+把该课次的记录数累加到学生/课程周/班级三类汇总表中。
+已累加的数据保存在 SessionAttentionContribution 中，
+同一课次重新分析时先减去旧值再加上新值，保证汇总结果与全量重算一致。
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from user_management.models import Student
+from .models import (
+    StudentCourseAttention,
+    CourseWeeklyAttention,
+    ClassCourseAttention,
+    SessionAttentionContribution,
+)
+
+# 情绪分析中的状态名 -> 汇总表字段
+STATUS_COUNTER_FIELDS = {
+    'Focused': 'focused_count',
+    'Distracted': 'distracted_count',
+    'Confused': 'confused_count',
+    'Head Down': 'head_down_count',
+    'Turning LEFT': 'turning_count',
+    'Turning RIGHT': 'turning_count',
+}
+
+COUNTER_FIELDS = ['session_count', 'total_records'] + sorted(set(STATUS_COUNTER_FIELDS.values()))
+
+
+def _empty_counters():
+    return {field: 0 for field in COUNTER_FIELDS}
+
+
+def _merge_counters(target, source):
+    for field in COUNTER_FIELDS:
+        target[field] += source.get(field, 0)
+
+
+def _week_start(begin_time):
+    """课次所在周的周一（按本地时间）"""
+    if begin_time is None:
+        return None
+    local_date = timezone.localtime(begin_time).date()
+    return local_date - timedelta(days=local_date.weekday())
+
+
+def build_session_contribution(course_time):
+    """
+    根据课次的情绪分析结果计算它对各汇总表的贡献
+    只统计能匹配到该课程选课学生（按用户名）的记录，没有分析数据时返回空字典
+    """
+    summary = (course_time.emotion_analysis_json or {}).get('summary') or {}
+    if not summary:
+        return {}
+    
+    enrolled = Student.objects.filter(
+        student_courses__course_id=course_time.course_id,
+        user__username__in=list(summary.keys())
+    ).values_list('student_id', 'user__username', 'class_id')
+    
+    course_counters = _empty_counters()
+    students = {}
+    classes = {}
+    
+    for student_id, username, class_id in enrolled:
+        entry = summary.get(username) or {}
+        counters = _empty_counters()
+        counters['session_count'] = 1
+        counters['total_records'] = int(entry.get('total_records', 0))
+        for status_name, count in (entry.get('status_counts') or {}).items():
+            field = STATUS_COUNTER_FIELDS.get(status_name)
+            if field:
+                counters[field] += int(count)
+        students[str(student_id)] = counters
+        
+        course_counters['total_records'] += counters['total_records']
+        for field in set(STATUS_COUNTER_FIELDS.values()):
+            course_counters[field] += counters[field]
+        
+        if class_id is not None:
+            class_counters = classes.setdefault(str(class_id), _empty_counters())
+            _merge_counters(class_counters, counters)
+            # 同一班级在一个课次中只计一次课次数
+            class_counters['session_count'] = 1
+    
+    if not students:
+        return {}
+    
+    course_counters['session_count'] = 1
+    week_start = _week_start(course_time.begin_time)
+    
+    return {
+        'week_start': week_start.isoformat() if week_start else None,
+        'course': course_counters,
+        'students': students,
+        'classes': classes,
+    }
+
+
+def _add_counters(model, lookup, counters, sign):
+    """以 F 表达式把计数增量写入汇总行，行不存在时先创建"""
+    changes = {
+        field: F(field) + sign * value
+        for field, value in counters.items()
+        if value
+    }
+    if not changes:
+        return
+    obj, _ = model.objects.get_or_create(**lookup)
+    model.objects.filter(pk=obj.pk).update(updated_at=timezone.now(), **changes)
+
+
+def _apply_contribution(course_id, contribution, sign):
+    if not contribution:
+        return
+    
+    if contribution.get('week_start'):
+        _add_counters(
+            CourseWeeklyAttention,
+            {'course_id': course_id, 'week_start': contribution['week_start']},
+            contribution['course'],
+            sign
+        )
+    
+    for student_id, counters in contribution.get('students', {}).items():
+        _add_counters(
+            StudentCourseAttention,
+            {'course_id': course_id, 'student_id': int(student_id)},
+            counters,
+            sign
+        )
+    
+    for class_id, counters in contribution.get('classes', {}).items():
+        _add_counters(
+            ClassCourseAttention,
+            {'course_id': course_id, 'class_id_id': int(class_id)},
+            counters,
+            sign
+        )
+
+
+def apply_session_analysis(course_time):
+    """
+    把课次的最新分析结果增量计入汇总表
+    返回汇总表是否发生了变化
+    """
+    contribution = build_session_contribution(course_time)
+    
+    with transaction.atomic():
+        record = SessionAttentionContribution.objects.select_for_update().filter(
+            course_time_id=course_time.pk
+        ).first()
+        previous = record.contribution if record else {}
+        
+        if previous == contribution:
+            return False
+        
+        _apply_contribution(course_time.course_id, previous, -1)
+        _apply_contribution(course_time.course_id, contribution, 1)
+        
+        if contribution:
+            SessionAttentionContribution.objects.update_or_create(
+                course_time_id=course_time.pk,
+                defaults={'contribution': contribution}
+            )
+        elif record:
+            record.delete()
+    
+    return True
+
+
+def remove_session_analysis(course_time):
+    """课次被删除时，从汇总表中减去它的贡献"""
+    with transaction.atomic():
+        record = SessionAttentionContribution.objects.select_for_update().filter(
+            course_time_id=course_time.pk
+        ).first()
+        if record is None:
+            return
+        _apply_contribution(course_time.course_id, record.contribution, -1)
+        record.delete()
+
+
+def rebuild_attention_rollups():
+    """清空并根据所有课次的分析结果重新生成汇总表，返回处理的课次数"""
+    from course_management.models import CourseTime
+    
+    with transaction.atomic():
+        StudentCourseAttention.objects.all().delete()
+        CourseWeeklyAttention.objects.all().delete()
+        ClassCourseAttention.objects.all().delete()
+        SessionAttentionContribution.objects.all().delete()
+        
+        processed = 0
+        course_times = CourseTime.objects.filter(emotion_analysis_json__isnull=False)
+        for course_time in course_times.iterator():
+            if apply_session_analysis(course_time):
+                processed += 1
+    
+    return processed
@@ -0,0 +1,17 @@
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+from course_management.models import CourseTime
+from .rollups import apply_session_analysis, remove_session_analysis
+
+@receiver(post_save, sender=CourseTime)
+def update_attention_rollups(sender, instance, created, **kwargs):
+    """课次分析结果保存后，增量更新注意力汇总表"""
+    # 新建且没有分析数据的课次（如开始上课）不会影响汇总表
+    if created and not instance.emotion_analysis_json:
+        return
+    apply_session_analysis(instance)
+
+@receiver(pre_delete, sender=CourseTime)
+def remove_attention_rollups(sender, instance, **kwargs):
+    """删除课次前，从注意力汇总表中减去它的贡献"""
+    remove_session_analysis(instance)
@@ -1,3 +1,196 @@
+from datetime import datetime, timezone as dt_timezone
+from io import StringIO
 from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from rest_framework.test import APITestCase, APIClient
+from rest_framework import status
+from user_management.models import Teacher, Student
+from class_management.models import Class
+from course_management.models import Course, CourseTime, StudentCourse
+from .models import Status, StudentCourseAttention, CourseWeeklyAttention, ClassCourseAttention
 
 # Create your tests here.
+
+class CourseStatusMatrixViewTests(APITestCase):
+    def setUp(self):
+        """测试数据初始化"""
+        User = get_user_model()
+        
+        self.teacher_user = User.objects.create_user(
+            username='teacher1', password='testpass123', role='teacher'
+        )
+        self.teacher = Teacher.objects.get(user=self.teacher_user)
+        
+        self.student_user1 = User.objects.create_user(
+            username='student1', password='testpass123', role='student'
+        )
+        self.student_user2 = User.objects.create_user(
+            username='student2', password='testpass123', role='student'
+        )
+        self.student1 = Student.objects.get(user=self.student_user1)
+        self.student2 = Student.objects.get(user=self.student_user2)
+        
+        self.course = Course.objects.create(title='测试课程', teacher=self.teacher)
+        self.session1 = CourseTime.objects.create(
+            course=self.course, teacher=self.teacher,
+            begin_time=datetime(2025, 3, 1, 8, 0, tzinfo=dt_timezone.utc)
+        )
+        self.session2 = CourseTime.objects.create(
+            course=self.course, teacher=self.teacher,
+            begin_time=datetime(2025, 3, 8, 8, 0, tzinfo=dt_timezone.utc)
+        )
+        
+        Status.objects.create(student=self.student1, course_time=self.session1, concentrate=5, if_come=True)
+        Status.objects.create(student=self.student1, course_time=self.session2, concentrate=7, sleepy=1, if_come=True)
+        Status.objects.create(student=self.student2, course_time=self.session2, puzzle=3)
+        
+        self.client = APIClient()
+        self.url = reverse('status_management:course_status_matrix')
+    
+    def test_matrix_layout(self):
+        """测试返回列式矩阵"""
+        self.client.force_authenticate(user=self.teacher_user)
+        response = self.client.get(self.url, {'course_id': self.course.course_id})
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data
+        self.assertEqual(data['students']['id'], [self.student1.student_id, self.student2.student_id])
+        self.assertEqual(data['sessions']['id'], [self.session1.id, self.session2.id])
+        self.assertEqual(data['values']['concentrate'], [[5, 7], [None, 0]])
+        self.assertEqual(data['values']['puzzle'], [[0, 0], [None, 3]])
+        self.assertEqual(data['values']['if_come'], [[1, 1], [None, 0]])
+    
+    def test_matrix_date_range(self):
+        """测试按日期范围过滤课次"""
+        self.client.force_authenticate(user=self.teacher_user)
+        response = self.client.get(self.url, {
+            'course_id': self.course.course_id,
+            'start_date': '2025-03-05',
+        })
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['sessions']['id'], [self.session2.id])
+        self.assertEqual(response.data['values']['concentrate'], [[7], [0]])
+    
+    def test_matrix_includes_students_and_sessions_without_records(self):
+        """没有状态记录的选课学生和课次也出现在矩阵中，值为 null"""
+        student_user3 = get_user_model().objects.create_user(
+            username='student3', password='testpass123', role='student'
+        )
+        student3 = Student.objects.get(user=student_user3)
+        StudentCourse.objects.create(student=student3, course=self.course)
+        session3 = CourseTime.objects.create(
+            course=self.course, teacher=self.teacher,
+            begin_time=datetime(2025, 3, 15, 8, 0, tzinfo=dt_timezone.utc)
+        )
+        
+        self.client.force_authenticate(user=self.teacher_user)
+        response = self.client.get(self.url, {'course_id': self.course.course_id})
+        
+        data = response.data
+        self.assertEqual(data['students']['id'], [self.student1.student_id, self.student2.student_id, student3.student_id])
+        self.assertEqual(data['students']['name'][2], 'student3')
+        self.assertEqual(data['sessions']['id'], [self.session1.id, self.session2.id, session3.id])
+        self.assertEqual(data['values']['concentrate'], [[5, 7, None], [None, 0, None], [None, None, None]])
+    
+    def test_matrix_single_query(self):
+        """测试矩阵数据只执行一次状态查询"""
+        self.client.force_authenticate(user=self.teacher_user)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(self.url, {'course_id': self.course.course_id})
+        
+        status_queries = [q for q in context.captured_queries if 'status_management_status' in q['sql']]
+        self.assertEqual(len(status_queries), 1)
+    
+    def test_matrix_forbidden_for_student(self):
+        """测试学生无权限获取状态矩阵"""
+        self.client.force_authenticate(user=self.student_user1)
+        response = self.client.get(self.url, {'course_id': self.course.course_id})
+        
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class AttentionRollupTests(TestCase):
+    def setUp(self):
+        """测试数据初始化"""
+        User = get_user_model()
+        
+        teacher_user = User.objects.create_user(username='teacher1', password='testpass123', role='teacher')
+        self.teacher = Teacher.objects.get(user=teacher_user)
+        
+        self.class_obj = Class.objects.create(class_name='测试班级1', class_system='本科')
+        student_user = User.objects.create_user(username='张三', password='testpass123', role='student')
+        self.student = Student.objects.get(user=student_user)
+        self.student.class_id = self.class_obj
+        self.student.save()
+        
+        self.course = Course.objects.create(title='测试课程', teacher=self.teacher)
+        StudentCourse.objects.create(student=self.student, course=self.course)
+        
+        self.course_time = CourseTime.objects.create(
+            course=self.course, teacher=self.teacher,
+            begin_time=datetime(2025, 3, 5, 8, 0, tzinfo=dt_timezone.utc)
+        )
+    
+    def _analysis(self, focused, distracted):
+        return {'summary': {
+            '张三': {
+                'total_records': focused + distracted,
+                'status_counts': {'Focused': focused, 'Distracted': distracted},
+            },
+            '未知人脸': {'total_records': 4, 'status_counts': {'Distracted': 4}},
+        }}
+    
+    def test_rollups_updated_when_analysis_saved(self):
+        """测试保存分析结果后汇总表增量更新"""
+        self.course_time.emotion_analysis_json = self._analysis(focused=6, distracted=4)
+        self.course_time.save()
+        
+        rollup = StudentCourseAttention.objects.get(student=self.student, course=self.course)
+        self.assertEqual(rollup.session_count, 1)
+        self.assertEqual(rollup.total_records, 10)
+        self.assertEqual(rollup.focus_rate, 60.0)
+        
+        weekly = CourseWeeklyAttention.objects.get(course=self.course)
+        self.assertEqual(weekly.week_start.isoformat(), '2025-03-03')
+        self.assertEqual(weekly.focused_count, 6)
+        
+        class_rollup = ClassCourseAttention.objects.get(class_id=self.class_obj, course=self.course)
+        self.assertEqual(class_rollup.distracted_count, 4)
+    
+    def test_reanalysis_replaces_previous_contribution(self):
+        """测试重新分析同一课次时不会重复累加"""
+        self.course_time.emotion_analysis_json = self._analysis(focused=6, distracted=4)
+        self.course_time.save()
+        self.course_time.emotion_analysis_json = self._analysis(focused=1, distracted=1)
+        self.course_time.save()
+        
+        rollup = StudentCourseAttention.objects.get(student=self.student, course=self.course)
+        self.assertEqual(rollup.session_count, 1)
+        self.assertEqual(rollup.total_records, 2)
+        self.assertEqual(rollup.focused_count, 1)
+    
+    def test_rebuild_matches_incremental(self):
+        """测试全量重建与增量结果一致"""
+        self.course_time.emotion_analysis_json = self._analysis(focused=6, distracted=4)
+        self.course_time.save()
+        
+        call_command('rebuild_attention_rollups', skip_checks=True, stdout=StringIO())
+        
+        rollup = StudentCourseAttention.objects.get(student=self.student, course=self.course)
+        self.assertEqual(rollup.session_count, 1)
+        self.assertEqual(rollup.total_records, 10)
+    
+    def test_delete_session_removes_contribution(self):
+        """测试删除课次后汇总表减去对应数据"""
+        self.course_time.emotion_analysis_json = self._analysis(focused=6, distracted=4)
+        self.course_time.save()
+        self.course_time.delete()
+        
+        rollup = StudentCourseAttention.objects.get(student=self.student, course=self.course)
+        self.assertEqual(rollup.session_count, 0)
+        self.assertEqual(rollup.total_records, 0)
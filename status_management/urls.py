@@ -6,4 +6,6 @@ app_name = 'status_management'
 urlpatterns = [
     # 在这里添加 status_management 的 URL 配置
     path('get_student_status/', views.get_student_status, name='get_student_status'),
-] 
\ No newline at end of file
+    path('course_status_matrix/', views.get_course_status_matrix, name='course_status_matrix'),
+    path('course_attention/', views.get_course_attention, name='course_attention'),
+] 
@@ -1,9 +1,15 @@
 from django.shortcuts import render
 from django.http import JsonResponse
+from django.utils.dateparse import parse_date
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Status
+from course_management.models import Course, CourseTime, StudentCourse
+from .models import Status, StudentCourseAttention, CourseWeeklyAttention, ClassCourseAttention
+from .rollups import COUNTER_FIELDS
+
+# 状态矩阵中返回的计数字段（顺序即 values 中的键顺序）
+STATUS_MATRIX_FIELDS = ['concentrate', 'sleepy', 'low_head', 'half', 'puzzle', 'if_come']
 
 # Create your views here.
 
@@ -40,3 +46,152 @@ def get_student_status(request):
             {'error': '未找到相关状态数据'},
             status=status.HTTP_404_NOT_FOUND
         )
+
+
+def _get_teacher_course(request):
+    """
+    根据 course_id 查询参数获取课程，并检查当前用户是否为该课程的授课教师
+    返回 (course, None)，出错时返回 (None, 错误响应)
+    """
+    course_id = request.query_params.get('course_id')
+    if not course_id:
+        return None, Response(
+            {'error': '需要提供 course_id'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        course = Course.objects.get(course_id=course_id)
+    except (Course.DoesNotExist, ValueError):
+        return None, Response(
+            {'error': '课程不存在'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    # 只有课程的授课教师可以查看整门课的状态
+    teacher = getattr(request.user, 'teacher_profile', None) if request.user.role == 'teacher' else None
+    if teacher is None or course.teacher_id != teacher.pk:
+        return None, Response(
+            {'error': '您没有权限查看此课程的状态数据'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    return course, None
+
+
+@api_view(['GET'])
+def get_course_status_matrix(request):
+    """
+    批量获取课程的学生 × 课次状态矩阵
+    使用列式布局：students/sessions 为坐标轴，values 中每个字段是 [学生][课次] 的二维数组，
+    没有记录的位置为 null。学生为选课学生（以及有状态记录的其他学生），课次为课程的所有课次，
+    状态数据只执行一次查询。
+    """
+    course, error_response = _get_teacher_course(request)
+    if error_response:
+        return error_response
+    
+    queryset = Status.objects.filter(course_time__course_id=course.course_id, student__isnull=False)
+    course_times = CourseTime.objects.filter(course=course)
+    
+    # 可选的日期范围过滤（YYYY-MM-DD，闭区间）
+    for param, lookup in (('start_date', 'gte'), ('end_date', 'lte')):
+        value = request.query_params.get(param)
+        if not value:
+            continue
+        parsed = parse_date(value)
+        if parsed is None:
+            return Response(
+                {'error': f'{param} 格式不正确，应为 YYYY-MM-DD'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        queryset = queryset.filter(**{f'course_time__begin_time__date__{lookup}': parsed})
+        course_times = course_times.filter(**{f'begin_time__date__{lookup}': parsed})
+    
+    rows = list(queryset.values_list(
+        'student_id',
+        'student__user__username',
+        'course_time_id',
+        'course_time__begin_time',
+        *STATUS_MATRIX_FIELDS
+    ))
+    
+    # 坐标轴：选课学生和课程的所有课次，没有状态记录的学生和课次也在矩阵中；学生按ID排序，课次按开始时间排序
+    students = dict(
+        StudentCourse.objects.filter(course=course).values_list('student_id', 'student__user__username')
+    )
+    sessions = dict(course_times.values_list('id', 'begin_time'))
+    for row in rows:
+        students.setdefault(row[0], row[1])
+        sessions.setdefault(row[2], row[3])
+    
+    student_ids = sorted(students)
+    session_ids = sorted(sessions, key=lambda sid: (sessions[sid] is None, sessions[sid], sid))
+    student_index = {sid: i for i, sid in enumerate(student_ids)}
+    session_index = {sid: j for j, sid in enumerate(session_ids)}
+    
+    values = {
+        field: [[None] * len(session_ids) for _ in student_ids]
+        for field in STATUS_MATRIX_FIELDS
+    }
+    for row in rows:
+        i = student_index[row[0]]
+        j = session_index[row[2]]
+        for offset, field in enumerate(STATUS_MATRIX_FIELDS, start=4):
+            value = row[offset]
+            values[field][i][j] = int(value) if field == 'if_come' else value
+    
+    data = {
+        'course_id': course.course_id,
+        'students': {
+            'id': student_ids,
+            'name': [students[sid] for sid in student_ids],
+        },
+        'sessions': {
+            'id': session_ids,
+            'begin_time': [sessions[sid].isoformat() if sessions[sid] else None for sid in session_ids],
+        },
+        'fields': STATUS_MATRIX_FIELDS,
+        'values': values,
+    }
+    
+    return Response(data)
+
+
+def _serialize_rollup(rollup):
+    data = {field: getattr(rollup, field) for field in COUNTER_FIELDS}
+    data['focus_rate'] = rollup.focus_rate
+    return data
+
+
+@api_view(['GET'])
+def get_course_attention(request):
+    """
+    获取课程的注意力汇总（学生、按周、按班级）
+    数据来自增量维护的汇总表，不再逐个读取课次的情绪分析 JSON
+    """
+    course, error_response = _get_teacher_course(request)
+    if error_response:
+        return error_response
+    
+    students = StudentCourseAttention.objects.filter(course=course).select_related('student__user').order_by('student_id')
+    weekly = CourseWeeklyAttention.objects.filter(course=course).order_by('week_start')
+    classes = ClassCourseAttention.objects.filter(course=course).select_related('class_id').order_by('class_id_id')
+    
+    data = {
+        'course_id': course.course_id,
+        'students': [
+            {'student_id': rollup.student_id, 'name': rollup.student.username, **_serialize_rollup(rollup)}
+            for rollup in students
+        ],
+        'weekly': [
+            {'week_start': rollup.week_start.isoformat(), **_serialize_rollup(rollup)}
+            for rollup in weekly
+        ],
+        'classes': [
+            {'class_id': rollup.class_id_id, 'class_name': rollup.class_id.class_name, **_serialize_rollup(rollup)}
+            for rollup in classes
+        ],
+    }
+    
+    return Response(data)
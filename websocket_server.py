@@ -1,14 +1,20 @@
+"""
+独立的实时分析 WebSocket 服务器（ws://0.0.0.0:8765）
+
+推理流水线与 Channels 的 AnalysisConsumer（ws/analysis/<course_time_id>/）共用 face_recognition.pipeline，
+新部署建议直接使用 ASGI 服务，本脚本保留给已有的客户端。
+
+连接时必须在 ?token= 中携带 JWT；绑定课程时间（?course_time_id=、?course_id= 或 hello 消息）
+与 AnalysisConsumer 相同，只允许管理员和该课程的教师。
+"""
 import asyncio
 import websockets
 import json
-import base64
-import cv2
-import numpy as np
 import os
 import logging
-from datetime import datetime
 import sys
 import traceback
+from urllib.parse import parse_qs, urlparse
 
 # 设置日志
 logging.basicConfig(
@@ -21,261 +27,118 @@ logging.basicConfig(
 )
 logger = logging.getLogger("WebSocketServer")
 
-# 检查CUDA是否可用
-cuda_available = False
-cuda_devices = 0
-try:
-    cuda_devices = cv2.cuda.getCudaEnabledDeviceCount()
-    if cuda_devices > 0:
-        cuda_available = True
-        # 选择第一个CUDA设备
-        cv2.cuda.setDevice(0)
-        logger.info(f"CUDA加速已启用，检测到 {cuda_devices} 个CUDA设备")
-        # 打印CUDA设备信息
-        cv2.cuda.printCudaDeviceInfo(0)
-    else:
-        logger.warning("未检测到支持CUDA的设备，将使用CPU模式")
-except Exception as e:
-    logger.warning(f"初始化CUDA失败或CUDA不可用: {e}，将使用CPU模式")
-    cuda_available = False
-
-# 导入情绪识别和人脸检测模块
+# 初始化Django；识别模型由 face_recognition.pipeline 在第一次推理时加载
 try:
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from emotion_recognition.emotions.inmidinate_output import app, process_frame, load_target_feats_from_db, StatusLogger, DataCollector
-    logger.info("成功导入情绪识别模块")
+    # 识别流水线和会话写库都依赖Django配置
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "zwky_api.settings")
+    import django
+    django.setup()
 except Exception as e:
-    logger.error(f"导入情绪识别模块失败: {e}")
+    logger.error(f"初始化Django失败: {e}")
     logger.error(traceback.format_exc())
     raise
 
-# 创建数据收集器和日志记录器
-data_collector = DataCollector()
-logger_obj = StatusLogger()
+from asgiref.sync import sync_to_async
+from face_recognition.pipeline import (
+    LatestFrameSlot, finish_session, gallery_holder, handle_text_message, inference_executor,
+    start_frame_workers, stop_frame_workers
+)
+from face_recognition.realtime import AnalysisSession, authorized_course_time_id
 
-# 加载人脸特征向量
-try:
-    # 尝试多个可能的数据库路径
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    possible_db_paths = [
-        os.path.join(current_dir, "db.sqlite3"),
-        os.path.join(os.path.dirname(current_dir), "db.sqlite3"),
-        os.path.join(current_dir, "emotion_recognition", "emotions", "db.sqlite3"),
-        "db.sqlite3"
-    ]
-    
-    db_path = None
-    for path in possible_db_paths:
-        if os.path.exists(path):
-            db_path = path
-            break
-    
-    if db_path is None:
-        # 使用默认路径
-        db_path = possible_db_paths[0]  
-        logger.warning(f"数据库文件未找到，将使用默认路径: {db_path}")
-    
-    logger.info(f"尝试从以下路径加载数据库: {db_path}")
-    target_feats, target_names = load_target_feats_from_db(db_path)
-    logger.info(f"成功加载 {len(target_names)} 个人脸特征向量")
-except Exception as e:
-    logger.error(f"加载人脸特征向量失败: {e}")
-    logger.error(traceback.format_exc())
-    # 创建空的列表以避免程序崩溃
-    target_feats, target_names = [], []
+# 启动时加载人脸库，之后按版本号增量刷新
+gallery_holder.reload()
 
 # 存储活跃连接
 active_connections = set()
 
-# 全局变量跟踪识别到的学生
-recognized_students = set()
+def query_param(websocket, name):
+    """从连接地址的查询参数中读取一个值"""
+    request = getattr(websocket, "request", None)
+    path = getattr(request, "path", None) or getattr(websocket, "path", "") or ""
+    values = parse_qs(urlparse(path).query).get(name)
+    return values[0] if values else None
 
-# 创建CUDA流对象(如果CUDA可用)
-cuda_stream = None
-if cuda_available:
-    try:
-        cuda_stream = cv2.cuda.Stream()
-        logger.info("成功创建CUDA流")
-    except Exception as e:
-        logger.error(f"创建CUDA流失败: {e}")
-        cuda_available = False
-        logger.warning("已切换到CPU模式")
+def course_time_id_from_path(websocket):
+    """从连接地址的查询参数中读取 course_time_id"""
+    return query_param(websocket, "course_time_id")
 
-# 获取CUDA优化的重采样方法
-def get_cuda_interpolation(method):
-    # 确保CUDA可用，否则返回原始方法
-    if not cuda_available:
-        return method
-        
+def authenticate_token(token):
+    """校验 JWT，返回对应的用户，无效时返回None"""
+    if not token:
+        return None
+    from django.contrib.auth import get_user_model
+    from rest_framework_simplejwt.tokens import AccessToken
     try:
-        if method == cv2.INTER_AREA:
-            return cv2.cuda.INTER_AREA
-        elif method == cv2.INTER_LINEAR:
-            return cv2.cuda.INTER_LINEAR
-        elif method == cv2.INTER_NEAREST:
-            return cv2.cuda.INTER_NEAREST
-        else:
-            return cv2.cuda.INTER_LINEAR
-    except Exception:
-        # 如果出现任何错误，返回原始方法
-        return method
+        return get_user_model().objects.get(id=AccessToken(token)["user_id"])
+    except Exception as e:
+        logger.error(f"认证失败: {e}")
+        return None
 
-async def process_video_frame(websocket, frame_data):
-    """处理从客户端接收的视频帧"""
+def active_course_time_id(course_id):
+    """返回课程正在进行的课程时间记录（StartClassView 创建、尚未结束）的ID，没有时返回None"""
+    if course_id in (None, ""):
+        return None
+    from course_management.models import CourseTime
     try:
-        # 解码Base64图像 - 使用更高效的解码方式
-        img_data = base64.b64decode(frame_data)
-        np_arr = np.frombuffer(img_data, np.uint8)
-        frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        
-        if frame is None:
-            logger.error("无法解码图像数据")
-            return {"error": "无法解码图像数据"}
-        
-        # 缩小图像尺寸以提高处理速度
-        height, width = frame.shape[:2]
-        if width > 640:  # 如果宽度大于640，则缩小
-            scale = 640 / width
-            new_width = 640
-            new_height = int(height * scale)
-            
-            if cuda_available:
-                try:
-                    # 使用CUDA加速图像缩放
-                    gpu_frame = cv2.cuda_GpuMat()
-                    gpu_frame.upload(frame)
-                    
-                    # 使用CUDA重采样
-                    gpu_resized = cv2.cuda.resize(
-                        gpu_frame, 
-                        (new_width, new_height), 
-                        interpolation=get_cuda_interpolation(cv2.INTER_AREA),
-                        stream=cuda_stream
-                    )
-                    
-                    # 下载结果
-                    frame = gpu_resized.download()
-                except Exception as e:
-                    logger.warning(f"CUDA图像缩放失败，回退到CPU: {e}")
-                    frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
-            else:
-                # CPU缩放
-                frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
-        
-        # 使用process_frame处理图像
-        student_set = set()
-        try:
-            # 修改为接收任意数量的返回值，只使用第一个返回值（处理后的帧）
-            result = process_frame(
-                frame, target_feats, target_names, student_set, similarity_threshold=0.45
-            )
-            # 确保至少有一个返回值
-            if isinstance(result, tuple):
-                processed_frame = result[0]
-                num_faces = result[1] if len(result) > 1 else len(student_set)
-            else:
-                processed_frame = result
-                num_faces = len(student_set)
-        except Exception as e:
-            logger.error(f"处理图像时出错: {e}")
-            logger.error(traceback.format_exc())
-            return {"error": f"处理图像失败: {str(e)}"}
-        
-        # 更新全局识别到的学生集合
-        recognized_students.update(student_set)
-        
-        # 优化：不是每帧都获取情绪状态数据
-        static_frame_count = getattr(process_video_frame, 'frame_count', 0) + 1
-        process_video_frame.frame_count = static_frame_count
-        
-        # 每3帧更新一次情绪统计
-        if static_frame_count % 3 == 0:
-            emotion_stats = data_collector.get_status_stats()
-        else:
-            emotion_stats = getattr(process_video_frame, 'last_emotion_stats', None)
-        
-        # 保存最后的情绪状态
-        process_video_frame.last_emotion_stats = emotion_stats
-        
-        # 将处理后的帧编码为JPEG，优化质量和速度
-        encode_params = [cv2.IMWRITE_JPEG_QUALITY, 75]  # 降低质量以减小数据量
-        
-        if cuda_available:
-            try:
-                # 使用CUDA加速JPEG编码
-                gpu_processed = cv2.cuda_GpuMat()
-                gpu_processed.upload(processed_frame)
-                
-                # 目前CUDA不直接支持JPEG编码，需要下载回CPU
-                _, buffer = cv2.imencode('.jpg', processed_frame, encode_params)
-            except Exception as e:
-                logger.warning(f"CUDA图像编码失败，回退到CPU: {e}")
-                _, buffer = cv2.imencode('.jpg', processed_frame, encode_params)
-        else:
-            # CPU编码
-            _, buffer = cv2.imencode('.jpg', processed_frame, encode_params)
-            
-        processed_frame_base64 = base64.b64encode(buffer).decode('utf-8')
-        
-        # 返回结果，仅每3帧发送一次完整的统计数据
-        if static_frame_count % 3 == 0:
-            result = {
-                "processed_frame": processed_frame_base64,
-                "face_count": num_faces,
-                "students_detected": list(student_set),
-                "all_recognized_students": list(recognized_students),
-                "emotion_stats": emotion_stats
-            }
-        else:
-            # 简化返回数据，仅包含必要信息
-            result = {
-                "processed_frame": processed_frame_base64,
-                "face_count": num_faces,
-                "students_detected": list(student_set)
-            }
-        
-        return result
-    except Exception as e:
-        logger.error(f"处理视频帧时发生错误: {e}")
-        logger.error(traceback.format_exc())
-        return {"error": str(e)}
+        return (
+            CourseTime.objects.filter(course_id=course_id, begin_time__isnull=False, end_time__isnull=True)
+            .order_by('-begin_time').values_list('id', flat=True).first()
+        )
+    except (TypeError, ValueError):
+        return None
 
 async def handle_client(websocket):
     """处理WebSocket客户端连接"""
-    active_connections.add(websocket)
     client_id = id(websocket)
-    logger.info(f"新客户端连接 [ID: {client_id}]")
+    user = await sync_to_async(authenticate_token)(query_param(websocket, "token"))
+    if user is None:
+        await websocket.close(code=4401, reason="unauthenticated")
+        return
+    
+    async def resolve_course_time_id(value):
+        """当前用户可以分析该课程时间时返回整数ID，否则返回None"""
+        if value in (None, ""):
+            return None
+        return await sync_to_async(authorized_course_time_id)(user, value)
+    
+    # 每个连接一个会话：自己的跟踪器、统计和识别到的学生，可以通过 ?course_time_id= 绑定课程时间，
+    # 或通过 ?course_id= 绑定该课程正在进行的课堂
+    requested = course_time_id_from_path(websocket) or await sync_to_async(active_course_time_id)(
+        query_param(websocket, "course_id")
+    )
+    course_time_id = await resolve_course_time_id(requested)
+    if requested and course_time_id is None:
+        await websocket.send(json.dumps({"error": "您没有权限分析此课程"}))
+        await websocket.close(code=4403, reason="forbidden")
+        return
+    # 多个摄像头推流到同一课堂时用 ?camera= 区分，统计按摄像头融合
+    session = AnalysisSession(course_time_id, camera=query_param(websocket, "camera"))
+    active_connections.add(websocket)
+    logger.info(f"新客户端连接 [ID: {client_id}]，用户: {user.username}，课程时间: {session.course_time_id}")
+    
+    async def send(result):
+        try:
+            await websocket.send(result if isinstance(result, bytes) else json.dumps(result))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+    
+    # 接收循环只把帧放进帧槽，由固定数量的处理任务取最新的帧，限制每个连接的在途帧数
+    slot = LatestFrameSlot()
+    workers = start_frame_workers(session, slot, send)
     
     try:
         async for message in websocket:
             try:
-                # 解析JSON消息
-                data = json.loads(message)
-                message_type = data.get("type")
-                
-                if message_type == "video_frame":
-                    # 处理视频帧
-                    frame_data = data.get("data", "")
-                    if not frame_data:
-                        await websocket.send(json.dumps({"error": "未提供视频帧数据"}))
-                        continue
-                    
-                    result = await process_video_frame(websocket, frame_data)
-                    await websocket.send(json.dumps(result))
+                # 二进制消息：头 + 元数据 + 原始JPEG
+                if isinstance(message, bytes):
+                    slot.put(("binary", message, None))
+                    continue
                 
-                elif message_type == "reset":
-                    # 重置会话数据
-                    recognized_students.clear()
-                    data_collector.reset()
-                    await websocket.send(json.dumps({"status": "reset_complete"}))
-                
-                elif message_type == "ping":
-                    # 心跳检测
-                    await websocket.send(json.dumps({"type": "pong"}))
-                
-                else:
-                    logger.warning(f"未知消息类型: {message_type}")
-                    await websocket.send(json.dumps({"error": "未知消息类型"}))
+                # 文本消息：解析JSON
+                reply = await handle_text_message(session, slot, json.loads(message), resolve_course_time_id)
+                if reply is not None:
+                    await websocket.send(json.dumps(reply))
             
             except json.JSONDecodeError:
                 logger.error("JSON解析错误")
@@ -290,6 +153,17 @@ async def handle_client(websocket):
         logger.info(f"客户端断开连接 [ID: {client_id}]")
     
     finally:
+        # 停止该连接的处理任务
+        await stop_frame_workers(workers)
+        if slot.total_dropped:
+            logger.info(f"客户端 [ID: {client_id}] 共丢弃 {slot.total_dropped} 帧")
+        # 把本连接的统计写入课程时间记录
+        try:
+            if await sync_to_async(finish_session)(session):
+                logger.info(f"客户端 [ID: {client_id}] 的统计已写入课程时间记录 #{session.course_time_id}")
+        except Exception as e:
+            logger.error(f"写入课程时间记录失败 [ID: {client_id}]: {e}")
+            logger.error(traceback.format_exc())
         # 清理连接
         active_connections.remove(websocket)
         logger.info(f"清理完成 [ID: {client_id}]")
@@ -300,8 +174,9 @@ async def shutdown_handler():
     if active_connections:
         await asyncio.gather(*(ws.close() for ws in active_connections))
     
-    # 关闭日志记录器
-    logger_obj.close()
+    # 关闭推理线程池
+    inference_executor.shutdown(wait=False)
+    
     logger.info("服务器已关闭，所有连接已清理")
 
 async def main():
@@ -12,13 +12,18 @@ from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from channels.security.websocket import AllowedHostsOriginValidator
-from chat.routing import websocket_urlpatterns
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zwky_api.settings')
 
 # 先初始化 Django ASGI 应用
 django_asgi_app = get_asgi_application()
 
+# 路由中的 consumer 会导入模型，必须在 Django 初始化之后导入
+from chat.routing import websocket_urlpatterns as chat_websocket_urlpatterns
+from face_recognition.routing import websocket_urlpatterns as analysis_websocket_urlpatterns
+
+websocket_urlpatterns = chat_websocket_urlpatterns + analysis_websocket_urlpatterns
+
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AllowedHostsOriginValidator(
@@ -23,9 +23,11 @@ class RequestLoggingMiddleware(MiddlewareMixin):
         
         # 获取请求体（如果有）
         # 检查内容类型，对于文件上传和非JSON请求，不尝试解析
+        # 注意：只有JSON请求才访问request.body，否则上传内容会被整体读入内存，
+        # 视图也无法再以流的方式读取分块数据
         content_type = request.META.get('CONTENT_TYPE', '')
         
-        if request.body and 'application/json' in content_type:
+        if 'application/json' in content_type and request.body:
             try:
                 body = json.loads(request.body)
                 logger.debug(f"请求体: {json.dumps(body, ensure_ascii=False)}")
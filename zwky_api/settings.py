@@ -55,12 +55,41 @@ INSTALLED_APPS = [
     'advanced_features',
     'ai_assistant',
     'face_recognition',
+    'search',
 ]
 
 # 上传文件大小限制设置
 # 设置为100MB (100 * 1024 * 1024)
 DATA_UPLOAD_MAX_MEMORY_SIZE = 104857600
-FILE_UPLOAD_MAX_MEMORY_SIZE = 104857600
+# 超过5MB的上传文件写入临时文件而不是保存在内存中
+FILE_UPLOAD_MAX_MEMORY_SIZE = 5242880
+
+# 录像分块上传设置：建议分块大小8MB，单个录像最大4GB
+RECORDING_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+RECORDING_UPLOAD_MAX_SIZE = 4 * 1024 * 1024 * 1024
+# 超过24小时没有新分块的上传会话视为过期，由 cleanup_recording_uploads 命令删除
+RECORDING_UPLOAD_EXPIRE_HOURS = 24
+
+# 录像播放的文件发送方式：
+# None - 由Django按范围流式返回
+# 'x-sendfile' - 交给Apache/lighttpd（mod_xsendfile）发送
+# 'x-accel-redirect' - 交给Nginx发送，需配置internal的location映射到媒体目录
+RECORDING_STREAM_OFFLOAD = None
+RECORDING_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# 录像HLS切片设置（需要安装ffmpeg）
+FFMPEG_BINARY = 'ffmpeg'
+HLS_AUTO_GENERATE = True  # 情绪分析保存处理后录像后自动在后台切片
+HLS_SEGMENT_SECONDS = 6
+HLS_RENDITIONS = [
+    {'name': '720p', 'height': 720, 'video_bitrate': '2500k', 'audio_bitrate': '128k'},
+    {'name': '360p', 'height': 360, 'video_bitrate': '800k', 'audio_bitrate': '96k'},
+]
+
+# 录像封面和时间轴雪碧图设置
+THUMBNAIL_INTERVAL_SECONDS = 10  # 每隔多少秒取一张缩略图
+THUMBNAIL_TILE_WIDTH = 160
+THUMBNAIL_SPRITE_COLUMNS = 10
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
@@ -242,6 +271,14 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'upload-offset',  # 录像分块上传（RecordingUploadSessionView.patch）
+]
+
+# 允许前端读取的响应头：聊天记录的分页游标（见 chat/pagination.py）
+CORS_EXPOSE_HEADERS = [
+    'X-Before-Cursor',
+    'X-After-Cursor',
+    'X-Has-More',
 ]
 
 # CSRF设置
@@ -292,6 +329,65 @@ LOGGING = {
 # Channels configuration
 ASGI_APPLICATION = 'zwky_api.asgi.application'
 
+# 聊天连接缓存课程成员身份的有效期（秒），过期后重新校验
+CHAT_MEMBERSHIP_REVALIDATE_SECONDS = 300
+# 聊天消息先广播，再由后台线程按批写入数据库
+CHAT_WRITE_BEHIND = True
+CHAT_WRITE_BEHIND_BATCH_SIZE = 100
+CHAT_WRITE_BEHIND_INTERVAL_MS = 200
+# 聊天记录每页条数
+CHAT_HISTORY_PAGE_SIZE = 50
+CHAT_HISTORY_MAX_PAGE_SIZE = 200
+# 认证成功时推送的最近消息条数，在内存中按课程缓存，0 表示不推送
+CHAT_RECENT_HISTORY_SIZE = 50
+# 在线状态的合并广播周期（毫秒）、在线状态的 TTL 和“正在输入”的 TTL（秒）
+CHAT_PRESENCE_INTERVAL_MS = 1000
+CHAT_PRESENCE_TTL_SECONDS = 60
+CHAT_TYPING_TTL_SECONDS = 5
+
+# 聊天广播使用的 channel layer：单机部署使用内存实现；
+# 多节点部署时设置 CHANNEL_REDIS_URL（需要安装 channels-redis），所有节点通过 Redis 转发群组消息
+CHANNEL_REDIS_URL = None
+if CHANNEL_REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [CHANNEL_REDIS_URL],
+                'capacity': 1000,
+                'expiry': 10,
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            'CONFIG': {
+                'capacity': 1000,
+                'expiry': 10,
+            },
+        },
+    }
+
 # WebSocket specific settings
 WEBSOCKET_ACCEPT_ALL = True  # 允许所有WebSocket连接
-WEBSOCKET_URL = '/ws/'  # WebSocket URL前缀
\ No newline at end of file
+WEBSOCKET_URL = '/ws/'  # WebSocket URL前缀
+# 实时分析（ws/analysis/<course_time_id>/ 与 websocket_server.py 共用）
+REALTIME_INFERENCE_WORKERS = None  # 推理线程数，None 表示 min(4, CPU核数)
+REALTIME_MAX_IN_FLIGHT_PER_CONNECTION = 2  # 每个连接同时处理的帧数
+REALTIME_ADVISE_TARGET_FPS = True  # 在结果中建议客户端的发送帧率
+REALTIME_MAX_ADVISED_FPS = 15
+# 建议客户端的采集档位：单帧处理耗时超过目标时逐级降低采集宽度和JPEG质量
+REALTIME_TARGET_LATENCY_MS = 200
+REALTIME_CAPTURE_PROFILES = [
+    {'width': 640, 'jpeg_quality': 80},
+    {'width': 480, 'jpeg_quality': 70},
+    {'width': 320, 'jpeg_quality': 60},
+]
+REALTIME_GALLERY_POLL_SECONDS = 5  # 人脸库版本的检查间隔
+REALTIME_FLUSH_SECONDS = 30  # 上课期间统计写入课程时间记录的间隔
+# 推理进程数，0 表示在服务进程内用推理线程识别；大于0时帧通过共享内存交给推理进程，每个进程各自加载模型
+REALTIME_WORKER_PROCESSES = 0
+REALTIME_WORKER_SLOTS = 4  # 每个推理进程的共享内存帧槽数
+REALTIME_WORKER_SLOT_BYTES = 640 * 960 * 3  # 单个帧槽的字节数